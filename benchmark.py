@@ -0,0 +1,430 @@
+"""
+Benchmarks of the recognition pipeline on synthetic data
+
+python benchmark.py dtw
+python benchmark.py search
+python benchmark.py batch
+python benchmark.py parallel
+python benchmark.py spotting
+python benchmark.py recorder
+python benchmark.py joint
+python benchmark.py shortlist --references 2000
+python benchmark.py embeddings
+python benchmark.py landmarks [--video PATH]
+"""
+import argparse
+import gc
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from models.hand_model import EMBEDDINGS, get_embedding_size
+from models.reference_index import ReferenceIndex
+from models.sign_model import SignModel
+from utils.dtw import DTW_ENGINES, dtw_distances, get_buckets, precompute_envelopes
+from utils.landmark_backend import LANDMARK_BACKENDS, get_landmark_backend
+from utils.parallel_search import ParallelSearch
+from utils.projection import leave_one_out
+from utils.shortlist import SHORTLIST_LENGTH, precompute_resampled
+from utils.spotting import SignSpotter
+from sign_recorder import SignRecorder
+
+
+EMBEDDING_SIZE = 21 * 21
+
+
+def random_embeddings(n_signs, min_len=30, max_len=70, seed=0):
+    """Return a list of random sign embeddings of shape (n_frames, 441)"""
+    rng = np.random.default_rng(seed)
+    embeddings = []
+    for _ in range(n_signs):
+        n_frames = rng.integers(min_len, max_len + 1)
+        # Smooth trajectories of angles in [0, pi], like a hand moving over time
+        steps = rng.normal(scale=0.05, size=(n_frames, EMBEDDING_SIZE))
+        start = rng.uniform(0, np.pi, size=EMBEDDING_SIZE)
+        embeddings.append(np.clip(start + np.cumsum(steps, axis=0), 0, np.pi))
+    return embeddings
+
+
+def random_sign_models(n_signs, min_len=30, max_len=70, seed=0, joint=False):
+    """
+    Return a list of SignModel built from random hand trajectories (one or two hands),
+    with their joint embedding if joint
+    """
+    rng = np.random.default_rng(seed)
+    sign_models = []
+    for idx in range(n_signs):
+        n_frames = rng.integers(min_len, max_len + 1)
+        hands = []
+        for _ in range(2):
+            steps = rng.normal(scale=0.01, size=(n_frames, 21, 3))
+            hands.append((rng.random((21, 3)) + np.cumsum(steps, axis=0)).reshape(-1, 63))
+        # A third of the signs are made with the left hand only
+        if idx % 3 == 0:
+            hands[1] = np.zeros_like(hands[1])
+        sign_models.append(SignModel(*hands, joint=joint))
+    return sign_models
+
+
+def random_sign_landmarks(n_classes, n_clips, min_len=30, max_len=70, seed=0):
+    """
+    Return the names and the landmarks of the hands of random clips of n_classes signs:
+    the clips of a sign are the same hand motion, played at another speed,
+    at another place and scale in the image, with noise; the motions of all the signs
+    are variations of a common one
+    """
+    rng = np.random.default_rng(seed)
+    common = [
+        0.1 * rng.random((21, 3))
+        + np.cumsum(rng.normal(scale=0.005, size=(max_len, 21, 3)), axis=0)
+        for _ in range(2)
+    ]
+    names, hand_lists = [], []
+    for class_idx in range(n_classes):
+        motions = [
+            motion + np.cumsum(rng.normal(scale=0.001, size=(max_len, 21, 3)), axis=0)
+            for motion in common
+        ]
+        for _ in range(n_clips):
+            n_frames = rng.integers(min_len, max_len + 1)
+            frames = np.linspace(0, max_len - 1, n_frames).round().astype(int)
+            hands = []
+            for motion in motions:
+                offset = rng.uniform(0.2, 0.8, size=3)
+                scale = rng.uniform(0.8, 1.2)
+                noise = rng.normal(scale=0.008, size=(n_frames, 21, 3))
+                hands.append((offset + scale * motion[frames] + noise).reshape(-1, 63))
+            names.append(f"sign_{class_idx}")
+            hand_lists.append(hands)
+    return names, hand_lists
+
+
+def random_results(n_frames, seed=0):
+    """Return a list of objects mimicking the Holistic results of a sign made with both hands"""
+    rng = np.random.default_rng(seed)
+    hands = []
+    for _ in range(2):
+        steps = rng.normal(scale=0.01, size=(n_frames, 21, 3))
+        hands.append(rng.random((21, 3)) + np.cumsum(steps, axis=0))
+
+    def to_landmark_list(points):
+        return SimpleNamespace(
+            landmark=[SimpleNamespace(x=x, y=y, z=z) for x, y, z in points]
+        )
+
+    return [
+        SimpleNamespace(
+            pose_landmarks=None,
+            left_hand_landmarks=to_landmark_list(left_hand),
+            right_hand_landmarks=to_landmark_list(right_hand),
+        )
+        for left_hand, right_hand in zip(*hands)
+    ]
+
+
+def timeit(function, repeat):
+    """Return the mean duration of function() in seconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def benchmark_dtw(args):
+    """Latency of one query against every reference for each DTW engine"""
+    query = random_embeddings(1, args.seq_len, args.seq_len, seed=1)[0]
+    references = random_embeddings(args.references)
+
+    configurations = [("fastdtw", None), ("dtw", None), ("dtw", 0.2), ("dtw", 0.1)]
+    baseline = None
+    for engine, window in configurations:
+        distance = DTW_ENGINES[engine]
+        duration = timeit(
+            lambda: [distance(query, reference, window) for reference in references],
+            args.repeat,
+        )
+        baseline = baseline or duration
+        print(
+            f"{engine:>8} window={str(window):>5}: {duration * 1000:8.1f} ms/query"
+            f"  (x{baseline / duration:.1f})"
+        )
+
+
+def benchmark_search(args):
+    """Latency of the search of the nearest references for each search strategy"""
+    sign_models = random_sign_models(args.references)
+    names = [f"sign_{idx % 20}" for idx in range(args.references)]
+    reference_index = ReferenceIndex.from_sign_models(names, sign_models)
+    precompute_envelopes(reference_index, args.seq_len, args.window)
+    queries = random_sign_models(5, args.seq_len, args.seq_len, seed=1)
+
+    configurations = [("dtw", None), ("dtw", 5), ("batch", None), ("batch", 5)]
+    for engine, k in configurations:
+        duration = timeit(
+            lambda: [
+                dtw_distances(query, reference_index, engine, args.window, k)
+                for query in queries
+            ],
+            args.repeat,
+        ) / len(queries)
+        print(f"{engine:>6} k={str(k):>4}: {duration * 1000:8.1f} ms/query")
+
+
+def benchmark_batch(args):
+    """
+    Latency of the comparison with every reference, one reference at a time and by bucket,
+    for references of a fixed length and of variable lengths
+    """
+    names = [f"sign_{idx % 20}" for idx in range(args.references)]
+    queries = random_sign_models(5, args.seq_len, args.seq_len, seed=1)
+    for min_len, max_len in ((args.seq_len, args.seq_len), (30, 70), (15, 120)):
+        sign_models = random_sign_models(args.references, min_len, max_len)
+        reference_index = ReferenceIndex.from_sign_models(names, sign_models)
+        n_buckets = sum(
+            len(get_buckets(partition, hand))
+            for partition in reference_index.partitions.values()
+            for hand in partition.hands
+        )
+
+        baseline = None
+        for engine in ("dtw", "batch"):
+            duration = timeit(
+                lambda: [
+                    dtw_distances(query, reference_index, engine, args.window)
+                    for query in queries
+                ],
+                args.repeat,
+            ) / len(queries)
+            baseline = baseline or duration
+            print(
+                f"lengths {min_len:>3}-{max_len:<3} ({n_buckets:>2} buckets) {engine:>6}: "
+                f"{duration * 1000:8.1f} ms/query  (x{baseline / duration:.1f})"
+            )
+
+
+def benchmark_parallel(args):
+    """Latency of the search sharded across 1, 2, 4 and 8 worker processes"""
+    sign_models = random_sign_models(args.references)
+    names = [f"sign_{idx % 20}" for idx in range(args.references)]
+    reference_index = ReferenceIndex.from_sign_models(names, sign_models)
+    precompute_envelopes(reference_index, args.seq_len, args.window)
+    queries = random_sign_models(5, args.seq_len, args.seq_len, seed=1)
+
+    baseline = None
+    for n_workers in (1, 2, 4, 8):
+        with ParallelSearch(reference_index, n_workers) as parallel_search:
+            # The first search builds the caches of the workers
+            parallel_search.search(queries[0], "dtw", args.window, 5)
+            duration = timeit(
+                lambda: [
+                    parallel_search.search(query, "dtw", args.window, 5)
+                    for query in queries
+                ],
+                args.repeat,
+            ) / len(queries)
+        baseline = baseline or duration
+        print(
+            f"{n_workers} workers: {duration * 1000:8.1f} ms/query"
+            f"  (x{baseline / duration:.1f})"
+        )
+
+
+def benchmark_spotting(args):
+    """Latency of each frame of a stream spotted against every reference"""
+    sign_models = random_sign_models(args.references)
+    names = [f"sign_{idx % 20}" for idx in range(args.references)]
+    reference_index = ReferenceIndex.from_sign_models(names, sign_models)
+    # The second random sign is made with both hands
+    stream = random_sign_models(2, 10 * args.seq_len, 10 * args.seq_len, seed=1)[1]
+    frames = list(zip(stream.lh_embedding, stream.rh_embedding))
+
+    sign_spotter = SignSpotter(reference_index, threshold=np.inf)
+    duration = timeit(
+        lambda: [sign_spotter.update(lh, rh) for lh, rh in frames], args.repeat
+    ) / len(frames)
+    print(f"spotting: {duration * 1000:8.2f} ms/frame")
+
+    # Latency of a recording of seq_len frames compared afterwards to every reference
+    query = random_sign_models(2, args.seq_len, args.seq_len, seed=1)[1]
+    duration = timeit(
+        lambda: dtw_distances(query, reference_index, "batch", args.window), args.repeat
+    )
+    print(f"recording: {duration * 1000:8.2f} ms after the last frame")
+
+
+def benchmark_recorder(args):
+    """
+    Time spent by SignRecorder.process_results on the frames of a recording,
+    and recognition delay: time spent on the frame where the recording ends
+    """
+    sign_models = random_sign_models(args.references)
+    names = [f"sign_{idx % 20}" for idx in range(args.references)]
+    reference_index = ReferenceIndex.from_sign_models(names, sign_models)
+    sign_recorder = SignRecorder(reference_index, args.seq_len, dtw_window=args.window)
+    frames = random_results(args.seq_len + 1, seed=1)
+
+    # Garbage collections triggered while the frames are recorded
+    collections = []
+    count_collections = lambda phase, info: phase == "start" and collections.append(info)
+
+    frame_durations, delays, n_collections = [], [], 0
+    for _ in range(args.repeat):
+        sign_recorder.record()
+        for results in frames:
+            collections.clear()
+            gc.callbacks.append(count_collections)
+            start = time.perf_counter()
+            sign_recorder.process_results(results)
+            frame_durations.append(time.perf_counter() - start)
+            gc.callbacks.remove(count_collections)
+            n_collections += len(collections)
+        delays.append(frame_durations.pop())
+    print(f"recording frames: {np.mean(frame_durations) * 1000:8.3f} ms/frame")
+    print(f"garbage collections: {n_collections / args.repeat:8.1f} per recording")
+    print(f"recognition delay: {np.mean(delays) * 1000:8.2f} ms")
+
+
+def benchmark_joint(args):
+    """Latency of two-handed queries with one DTW per hand and with a joint DTW"""
+    sign_models = random_sign_models(args.references, joint=True)
+    names = [f"sign_{idx % 20}" for idx in range(args.references)]
+    reference_index = ReferenceIndex.from_sign_models(names, sign_models)
+    # Random signs whose index is not a multiple of 3 are made with both hands
+    queries = random_sign_models(6, args.seq_len, args.seq_len, seed=1, joint=True)
+    queries = [query for idx, query in enumerate(queries) if idx % 3 != 0]
+
+    for engine in ("dtw", "batch"):
+        for joint in (False, True):
+            duration = timeit(
+                lambda: [
+                    dtw_distances(query, reference_index, engine, args.window, joint=joint)
+                    for query in queries
+                ],
+                args.repeat,
+            ) / len(queries)
+            print(f"{engine:>6} joint={str(joint):>5}: {duration * 1000:8.1f} ms/query")
+
+
+def benchmark_shortlist(args):
+    """
+    Latency of the search with a first stage on the resampled signs, and recall
+    of the 5 nearest references found without it
+    """
+    sign_models = random_sign_models(args.references)
+    names = [f"sign_{idx % 20}" for idx in range(args.references)]
+    reference_index = ReferenceIndex.from_sign_models(names, sign_models)
+    precompute_envelopes(reference_index, args.seq_len, args.window)
+    precompute_resampled(reference_index, SHORTLIST_LENGTH)
+    # Queries close to references: noisy copies of some of them
+    rng = np.random.default_rng(1)
+    queries = [
+        SignModel.from_embeddings(
+            *(
+                embedding + rng.normal(scale=0.05, size=embedding.shape)
+                for embedding in (sign_models[idx].lh_embedding, sign_models[idx].rh_embedding)
+            )
+        )
+        for idx in range(0, args.references, max(args.references // 5, 1))
+    ]
+    exact = [set(dtw_distances(query, reference_index, k=5).ids) for query in queries]
+
+    for shortlist in (None, 200, 50):
+        duration = timeit(
+            lambda: [
+                dtw_distances(query, reference_index, "dtw", args.window, 5, shortlist=shortlist)
+                for query in queries
+            ],
+            args.repeat,
+        ) / len(queries)
+        found = [
+            set(dtw_distances(query, reference_index, k=5, shortlist=shortlist).ids)
+            for query in queries
+        ]
+        recall = np.mean([len(nearest & ids) / 5 for nearest, ids in zip(exact, found)])
+        print(
+            f"shortlist={str(shortlist):>4}: {duration * 1000:8.1f} ms/query"
+            f"  recall@5={recall:.2f}"
+        )
+
+
+def benchmark_embeddings(args):
+    """
+    Build time of the references, latency of the search and leave-one-out accuracy
+    of each embedding of the hands
+    """
+    names, hand_lists = random_sign_landmarks(20, max(args.references // 20, 5))
+    for embedding in EMBEDDINGS:
+        start = time.perf_counter()
+        sign_models = [SignModel(*hands, embedding=embedding) for hands in hand_lists]
+        build_time = time.perf_counter() - start
+        accuracy, duration = leave_one_out(names, sign_models, window=args.window)
+        print(
+            f"{embedding:>10} {get_embedding_size(embedding):4d}-D: "
+            f"build {build_time * 1000 / len(sign_models):6.2f} ms/sign"
+            f"  {duration * 1000:8.1f} ms/query  accuracy {accuracy:.3f}"
+        )
+
+
+def benchmark_landmarks(args):
+    """Latency per frame of each landmark backend, on a video or on random images"""
+    if args.video is not None:
+        frames = []
+        cap = cv2.VideoCapture(args.video)
+        while len(frames) < args.seq_len:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        cap.release()
+    else:
+        rng = np.random.default_rng(0)
+        frames = [
+            rng.integers(0, 256, (480, 640, 3), dtype=np.uint8) for _ in range(args.seq_len)
+        ]
+
+    for name in LANDMARK_BACKENDS:
+        try:
+            backend = get_landmark_backend(name)
+        except FileNotFoundError as error:
+            print(f"{name:>16}: skipped, {error}")
+            continue
+        with backend:
+            # The first frame loads the models
+            backend.process(frames[0])
+            backend.reset()
+            duration = timeit(lambda: [backend.process(frame) for frame in frames], args.repeat)
+        print(f"{name:>16}: {duration * 1000 / len(frames):8.2f} ms/frame")
+
+
+BENCHMARKS = {
+    "dtw": benchmark_dtw,
+    "search": benchmark_search,
+    "batch": benchmark_batch,
+    "parallel": benchmark_parallel,
+    "spotting": benchmark_spotting,
+    "recorder": benchmark_recorder,
+    "joint": benchmark_joint,
+    "shortlist": benchmark_shortlist,
+    "embeddings": benchmark_embeddings,
+    "landmarks": benchmark_landmarks,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmark", choices=BENCHMARKS)
+    parser.add_argument("--references", type=int, default=50)
+    parser.add_argument("--seq-len", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--window",
+        type=lambda value: float(value) if "." in value else int(value),
+        default=None,
+        help="Sakoe-Chiba band: width in frames (int) or fraction of the lengths (float)",
+    )
+    parser.add_argument("--video", default=None, help="Video of the landmarks benchmark")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.benchmark](args)
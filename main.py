@@ -1,3 +1,5 @@
+import argparse
+
 import customtkinter as ctk
 import pygame
 
@@ -10,10 +12,11 @@ from pages.imitacion.imitacion_senas import ImitacionSeñasGame
 from pages.adivina_palabra.secuencia_senas import AdivinaPalabraGame
 from pages.ahorcado.ahorcado_senas import AhorcadoSeñasGame
 from pages.opciones.opciones import OpcionesWindow
+from utils.landmark_backend import DEFAULT_BACKEND, LANDMARK_BACKENDS
 
 
 class MainApp(ctk.CTk):
-    def __init__(self):
+    def __init__(self, landmark_backend=DEFAULT_BACKEND):
         super().__init__()
         self.title("EnSEÑA PLAY")
         self.geometry("900x600")
@@ -49,22 +52,30 @@ class MainApp(ctk.CTk):
         lista_page.grid(row=0, column=0, sticky="nsew")
         
         #Juegos Imitacion de Señas
-        imitacion_game = ImitacionSeñasGame(parent=container, controller=self)
+        imitacion_game = ImitacionSeñasGame(
+            parent=container, controller=self, landmark_backend=landmark_backend
+        )
         self.frames["ImitacionSeñasGame"] = imitacion_game
         imitacion_game.grid(row=0, column=0, sticky="nsew")
 
         # Juego Secuencia de Señas
-        secuencia_game = SecuenciaSeñasGame(parent=container, controller=self)
+        secuencia_game = SecuenciaSeñasGame(
+            parent=container, controller=self, landmark_backend=landmark_backend
+        )
         self.frames["SecuenciaSeñasGame"] = secuencia_game
         secuencia_game.grid(row=0, column=0, sticky="nsew")
 
         # Juego Secuencia de Señas
-        secuencia_game = AdivinaPalabraGame(parent=container, controller=self)
+        secuencia_game = AdivinaPalabraGame(
+            parent=container, controller=self, landmark_backend=landmark_backend
+        )
         self.frames["AdivinaPalabraGame"] = secuencia_game
         secuencia_game.grid(row=0, column=0, sticky="nsew")
 
         # Juego Ahorcado
-        ahorcado_game = AhorcadoSeñasGame(parent=container, controller=self)
+        ahorcado_game = AhorcadoSeñasGame(
+            parent=container, controller=self, landmark_backend=landmark_backend
+        )
         self.frames["AhorcadoSeñasGame"] = ahorcado_game
         ahorcado_game.grid(row=0, column=0, sticky="nsew")
 
@@ -156,6 +167,11 @@ class MainApp(ctk.CTk):
         super().destroy()
 
 if __name__ == "__main__":
-    app = MainApp()
+    parser = argparse.ArgumentParser()
+    # Detector de puntos de las manos de los juegos (ver utils.landmark_backend)
+    parser.add_argument("--backend", choices=tuple(LANDMARK_BACKENDS), default=DEFAULT_BACKEND)
+    args = parser.parse_args()
+
+    app = MainApp(landmark_backend=args.backend)
     app.mainloop()
 
@@ -1,21 +1,37 @@
+import argparse
+
 import cv2
-import mediapipe
 
 from utils.dataset_utils import load_dataset, load_reference_signs
+from utils.projection import load_projection
+from utils.prototypes import load_prototypes
+from utils.landmark_backend import DEFAULT_BACKEND, LANDMARK_BACKENDS, get_landmark_backend
 from utils.mediapipe_utils import mediapipe_detection
 from sign_recorder import SignRecorder
 from webcam_manager import WebcamManager
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=tuple(LANDMARK_BACKENDS), default=DEFAULT_BACKEND)
+    args = parser.parse_args()
+
     # Create dataset of the videos where landmarks have not been extracted yet
     videos = load_dataset()
 
-    # Create a DataFrame of reference signs (name: str, model: SignModel, distance: int)
-    reference_signs = load_reference_signs(videos)
+    # Projection of the hand embeddings (None if not fitted)
+    projection = load_projection(videos)
+
+    # Create an index of the reference signs (names, hand embeddings)
+    reference_signs = load_reference_signs(videos, projection=projection)
+
+    # Prototypes of the signs for a two-stage search (None if not built)
+    prototypes = load_prototypes(videos, projection=projection)
 
     # Object that stores mediapipe results and computes sign similarities
-    sign_recorder = SignRecorder(reference_signs)
+    sign_recorder = SignRecorder(
+        reference_signs, prototypes=prototypes, projection=projection
+    )
 
     # Object that draws keypoints & displays results
     webcam_manager = WebcamManager()
@@ -36,10 +52,11 @@ if __name__ == "__main__":
     print("Webcam opened successfully!")
     print("Press 'r' to record a sign, 'q' to quit")
     
-    # Set up the Mediapipe environment
-    with mediapipe.solutions.holistic.Holistic(
-        min_detection_confidence=0.5, min_tracking_confidence=0.5
-    ) as holistic:
+    # Set up the landmark backend ("holistic", "hands" or "hand_landmarker",
+    # see utils.landmark_backend)
+    with get_landmark_backend(
+        args.backend, min_detection_confidence=0.5, min_tracking_confidence=0.5
+    ) as landmark_backend:
         while cap.isOpened():
 
             # Read feed
@@ -50,7 +67,7 @@ if __name__ == "__main__":
                 break
 
             # Make detections
-            image, results = mediapipe_detection(frame, holistic)
+            image, results = mediapipe_detection(frame, landmark_backend)
 
             # Process results
             sign_detected, is_recording = sign_recorder.process_results(results)
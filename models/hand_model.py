@@ -4,6 +4,138 @@ import numpy as np
 import mediapipe as mp
 
 
+# Ids of the two landmarks of each connection, in the iteration order of
+# mp.solutions.holistic.HAND_CONNECTIONS (the order used by the feature vector)
+HAND_CONNECTIONS = list(mp.solutions.holistic.HAND_CONNECTIONS)
+CONNECTIONS_FROM = np.array([connection[0] for connection in HAND_CONNECTIONS])
+CONNECTIONS_TO = np.array([connection[1] for connection in HAND_CONNECTIONS])
+NB_CONNECTIONS = len(HAND_CONNECTIONS)
+
+
+def get_feature_vectors(landmarks: np.ndarray) -> np.ndarray:
+    """
+    Compute the angles between all the connections of a batch of hands in one pass
+
+    Params
+        landmarks: array of shape (n_frames, 21, 3) (or (n_frames, 63))
+    Return
+        Array of shape (n_frames, nb_connections * nb_connections) containing
+        all the angles between the connections of each frame
+    """
+    landmarks = np.asarray(landmarks, dtype=float).reshape((-1, 21, 3))
+
+    # Connection vectors: (n_frames, nb_connections, 3)
+    connections = landmarks[:, CONNECTIONS_TO] - landmarks[:, CONNECTIONS_FROM]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Normalized connections and their Gram matrix hold the cosines of all the angles
+        norms = np.linalg.norm(connections, axis=2, keepdims=True)
+        unit_connections = connections / norms
+        cosines = np.matmul(unit_connections, unit_connections.transpose((0, 2, 1)))
+
+        # Cosines pushed out of [-1, 1] by rounding or undefined (null connection)
+        # give a NaN angle, which is stored as 0
+        angles = np.nan_to_num(np.arccos(cosines), nan=0.0)
+
+    # Two identical connections (including a connection with itself) have a null angle
+    identical = np.all(connections[:, :, None] == connections[:, None, :], axis=3)
+    angles[identical] = 0
+
+    return angles.reshape((len(landmarks), NB_CONNECTIONS * NB_CONNECTIONS))
+
+
+# Ids of the wrist, of the middle finger MCP (whose distance to the wrist sets the scale
+# of the hand) and of the fingertips
+WRIST, MIDDLE_MCP = 0, 9
+FINGERTIPS = np.array([4, 8, 12, 16, 20])
+# Base joint of each finger, to measure how much the finger is bent
+FINGER_BASES = np.array([1, 5, 9, 13, 17])
+
+
+def _get_hand_scales(landmarks: np.ndarray) -> np.ndarray:
+    """
+    :param landmarks: array of shape (n_frames, 21, 3)
+    :return: array of shape (n_frames, 1, 1), distance between the wrist
+             and the middle finger MCP of each hand
+    """
+    return np.linalg.norm(
+        landmarks[:, MIDDLE_MCP] - landmarks[:, WRIST], axis=1
+    )[:, None, None]
+
+
+def get_wrist_coordinates(landmarks: np.ndarray) -> np.ndarray:
+    """
+    Coordinates of the landmarks relative to the wrist, divided by the size of the hand
+
+    Params
+        landmarks: array of shape (n_frames, 21, 3) (or (n_frames, 63))
+    Return
+        Array of shape (n_frames, 21 * 3); a null hand gives a null vector
+    """
+    landmarks = np.asarray(landmarks, dtype=float).reshape((-1, 21, 3))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        coordinates = (landmarks - landmarks[:, WRIST : WRIST + 1]) / _get_hand_scales(landmarks)
+    return np.nan_to_num(coordinates, nan=0.0, posinf=0.0, neginf=0.0).reshape(
+        (len(landmarks), 21 * 3)
+    )
+
+
+# Pairs of points whose distance is kept by get_fingertip_distances: every pair of
+# the wrist and the fingertips, then each fingertip and the base of its finger
+_TIP_POINTS = np.concatenate([[WRIST], FINGERTIPS])
+_TIP_PAIRS = np.concatenate(
+    [
+        np.array(np.triu_indices(len(_TIP_POINTS), k=1)).T,
+        np.stack([np.arange(1, len(_TIP_POINTS)), len(_TIP_POINTS) + np.arange(5)], axis=1),
+    ]
+)
+
+
+def get_fingertip_distances(landmarks: np.ndarray) -> np.ndarray:
+    """
+    Distances between the wrist and the fingertips, and between each fingertip and
+    the base of its finger, divided by the size of the hand
+
+    Params
+        landmarks: array of shape (n_frames, 21, 3) (or (n_frames, 63))
+    Return
+        Array of shape (n_frames, 20); a null hand gives a null vector
+    """
+    landmarks = np.asarray(landmarks, dtype=float).reshape((-1, 21, 3))
+    points = landmarks[:, np.concatenate([_TIP_POINTS, FINGER_BASES])]
+    distances = np.linalg.norm(
+        points[:, _TIP_PAIRS[:, 0]] - points[:, _TIP_PAIRS[:, 1]], axis=2
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distances = distances / _get_hand_scales(landmarks)[:, 0]
+    return np.nan_to_num(distances, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+# Embeddings of the hands, by name: functions of an array of shape (n_frames, 21, 3)
+# (or (n_frames, 63)) returning an array of shape (n_frames, embedding size),
+# null for a null hand
+EMBEDDINGS = {
+    "angles": get_feature_vectors,
+    "wrist": get_wrist_coordinates,
+    "fingertips": get_fingertip_distances,
+}
+DEFAULT_EMBEDDING = "angles"
+
+
+def get_embedding_function(embedding: str):
+    """
+    :param embedding: name of the embedding, one of EMBEDDINGS
+    """
+    if embedding not in EMBEDDINGS:
+        raise ValueError(f"Unknown embedding {embedding}, expected one of {tuple(EMBEDDINGS)}")
+    return EMBEDDINGS[embedding]
+
+
+def get_embedding_size(embedding: str) -> int:
+    """Size of the feature vector of a hand with the given embedding"""
+    return get_embedding_function(embedding)(np.zeros((1, 21, 3))).shape[1]
+
+
 class HandModel(object):
     """
     Params
@@ -16,7 +148,7 @@ class HandModel(object):
     def __init__(self, landmarks: List[float]):
 
         # Define the connections
-        self.connections = mp.solutions.holistic.HAND_CONNECTIONS
+        self.connections = HAND_CONNECTIONS
 
         # Create feature vector (list of the angles between all the connections)
         landmarks = np.array(landmarks).reshape((21, 3))
@@ -30,45 +162,4 @@ class HandModel(object):
             List of length nb_connections * nb_connections containing
             all the angles between the connections
         """
-        connections = self._get_connections_from_landmarks(landmarks)
-
-        angles_list = []
-        for connection_from in connections:
-            for connection_to in connections:
-                angle = self._get_angle_between_vectors(connection_from, connection_to)
-                # If the angle is not NaN we store it else we store 0
-                if angle == angle:
-                    angles_list.append(angle)
-                else:
-                    angles_list.append(0)
-        return angles_list
-
-    def _get_connections_from_landmarks(
-        self, landmarks: np.ndarray
-    ) -> List[np.ndarray]:
-        """
-        Params
-            landmarks: numpy array of shape (21, 3)
-        Return
-            List of vectors representing hand connections
-        """
-        return list(
-            map(
-                lambda t: landmarks[t[1]] - landmarks[t[0]],
-                self.connections,
-            )
-        )
-
-    @staticmethod
-    def _get_angle_between_vectors(u: np.ndarray, v: np.ndarray) -> float:
-        """
-        Args
-            u, v: 3D vectors representing two connections
-        Return
-            Angle between the two vectors
-        """
-        if np.array_equal(u, v):
-            return 0
-        dot_product = np.dot(u, v)
-        norm = np.linalg.norm(u) * np.linalg.norm(v)
-        return np.arccos(dot_product / norm)
+        return get_feature_vectors(landmarks[np.newaxis])[0].tolist()
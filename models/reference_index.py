@@ -0,0 +1,254 @@
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from models.sign_model import SignModel
+
+
+class ReferencePartition(object):
+    """
+    References sharing the same detected hands
+
+    Params
+        ids: positions of the references in the ReferenceIndex
+        offsets: {hand: int array of size n + 1}, hand being "lh" or "rh", the embedding
+                 of the i-th reference is the slice [offsets[i], offsets[i + 1]) of its block
+        blocks: {hand: float32 array of shape (total_frames, embedding_size)}
+        weights: {hand: float32 array of size total_frames}, number of frames merged in each
+                 frame of the embeddings (see utils.compression), None if not compressed
+    Args
+        hands: hands detected in the references of the partition
+        envelopes: cache of the LB_Keogh envelopes (see utils.dtw)
+        buckets: cache of the embeddings grouped by range of length (see utils.dtw)
+        resampled: cache of the embeddings resampled to a fixed length (see utils.shortlist)
+        joint: ReferencePartition of the same references whose only "hand" is "joint",
+               the embedding of both hands on a shared timeline (None if not computed)
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        offsets: Dict[str, np.ndarray],
+        blocks: Dict[str, np.ndarray],
+        weights: Dict[str, np.ndarray] = None,
+    ):
+        self.ids = ids
+        self.hands = tuple(blocks)
+        self.offsets = offsets
+        self.blocks = blocks
+        self.weights = weights
+
+        self.envelopes = {}
+        self.buckets = {}
+        self.resampled = {}
+        self.joint = None
+
+    @classmethod
+    def from_embeddings(
+        cls,
+        ids: List[int],
+        embeddings: Dict[str, List[np.ndarray]],
+        weights: Dict[str, List[np.ndarray]] = None,
+    ):
+        """
+        Params
+            ids: positions of the references in the ReferenceIndex
+            embeddings: {hand: list of the embeddings of the references}
+            weights: {hand: list of the weights of the frames of the references
+                     (None for a reference whose frames all weigh 1)}, None if not compressed
+        """
+        offsets, blocks = {}, {}
+        for hand, hand_embeddings in embeddings.items():
+            lengths = [len(embedding) for embedding in hand_embeddings]
+            offsets[hand] = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+            blocks[hand] = np.ascontiguousarray(
+                np.concatenate(hand_embeddings), dtype=np.float32
+            )
+
+        weight_blocks = None
+        if weights is not None:
+            weight_blocks = {
+                hand: np.concatenate(
+                    [
+                        np.ones(len(embedding)) if hand_weights is None else hand_weights
+                        for embedding, hand_weights in zip(embeddings[hand], weights[hand])
+                    ]
+                ).astype(np.float32)
+                for hand in embeddings
+            }
+        return cls(np.array(ids, dtype=np.int64), offsets, blocks, weight_blocks)
+
+    def get_shard(self, start: int, end: int):
+        """
+        Return a ReferencePartition viewing the references at the positions [start, end),
+        without copying their embeddings and envelopes
+        """
+        offsets, blocks = {}, {}
+        for hand in self.hands:
+            first, last = self.offsets[hand][start], self.offsets[hand][end]
+            offsets[hand] = self.offsets[hand][start : end + 1] - first
+            blocks[hand] = self.blocks[hand][first:last]
+        weights = None
+        if self.weights is not None:
+            weights = {
+                hand: self.weights[hand][self.offsets[hand][start] : self.offsets[hand][end]]
+                for hand in self.hands
+            }
+        shard = ReferencePartition(self.ids[start:end], offsets, blocks, weights)
+        if self.joint is not None:
+            shard.joint = self.joint.get_shard(start, end)
+
+        for (hand, window), (radii, lower, upper) in self.envelopes.items():
+            first, last = self.offsets[hand][start], self.offsets[hand][end]
+            shard.envelopes[(hand, window)] = (
+                radii[start:end],
+                lower[first:last],
+                upper[first:last],
+            )
+        return shard
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get_embedding(self, hand: str, position: int) -> np.ndarray:
+        """View on the embedding of the reference at the given position of the partition"""
+        offsets = self.offsets[hand]
+        return self.blocks[hand][offsets[position] : offsets[position + 1]]
+
+    def get_weights(self, hand: str, position: int):
+        """Weights of the frames of the reference at the given position, None if not compressed"""
+        if self.weights is None:
+            return None
+        offsets = self.offsets[hand]
+        return self.weights[hand][offsets[position] : offsets[position + 1]]
+
+    def get_lengths(self, hand: str) -> np.ndarray:
+        """Number of frames of the embedding of each reference"""
+        return np.diff(self.offsets[hand])
+
+    def get_first_frames(self, hand: str) -> np.ndarray:
+        return self.blocks[hand][self.offsets[hand][:-1]]
+
+    def get_last_frames(self, hand: str) -> np.ndarray:
+        return self.blocks[hand][self.offsets[hand][1:] - 1]
+
+
+class ReferenceIndex(object):
+    """
+    Array-backed set of reference signs, partitioned by detected hands
+
+    Params
+        sign_names: array of the distinct sign names
+        labels: int array, index in sign_names of the name of each reference
+        partitions: {(has_left_hand, has_right_hand): ReferencePartition}
+    """
+
+    def __init__(
+        self,
+        sign_names: np.ndarray,
+        labels: np.ndarray,
+        partitions: Dict[Tuple[bool, bool], ReferencePartition],
+    ):
+        self.sign_names = sign_names
+        self.labels = labels
+        self.partitions = partitions
+
+    @classmethod
+    def from_sign_models(cls, names: List[str], sign_models: List[SignModel]):
+        """
+        Params
+            names: name of the sign of each reference
+            sign_models: SignModel of each reference, the joint partitions being only built
+                         if they all have their joint embedding
+        """
+        joint_embeddings = [sign_model.joint_embedding for sign_model in sign_models]
+        if any(joint_embedding is None for joint_embedding in joint_embeddings):
+            joint_embeddings = None
+        return cls.from_embeddings(
+            names,
+            [sign_model.lh_embedding for sign_model in sign_models],
+            [sign_model.rh_embedding for sign_model in sign_models],
+            [sign_model.has_left_hand for sign_model in sign_models],
+            [sign_model.has_right_hand for sign_model in sign_models],
+            joint_embeddings,
+            {
+                hand: [getattr(sign_model, f"{hand}_weights") for sign_model in sign_models]
+                for hand in ("lh", "rh", "joint")
+            },
+        )
+
+    @classmethod
+    def from_embeddings(
+        cls,
+        names: List[str],
+        lh_embeddings: List[np.ndarray],
+        rh_embeddings: List[np.ndarray],
+        has_left_hand: List[bool] = None,
+        has_right_hand: List[bool] = None,
+        joint_embeddings: List[np.ndarray] = None,
+        weights: Dict[str, List[np.ndarray]] = None,
+    ):
+        """
+        Params
+            names: name of the sign of each reference
+            xh_embeddings: embedding of the x hand of each reference
+            has_x_hand: whether the x hand is detected in each reference
+                        (by default, whether its embedding is not empty)
+            joint_embeddings: embedding of both hands of each reference (see SignModel),
+                              stored for the references made with both hands
+            weights: {"lh", "rh" or "joint": weights of the frames of the embedding of each
+                     reference (see SignModel)}, None if the references are not compressed
+        """
+        if weights is not None and all(
+            hand_weights is None for values in weights.values() for hand_weights in values
+        ):
+            weights = None
+
+        if has_left_hand is None:
+            has_left_hand = [len(embedding) > 0 for embedding in lh_embeddings]
+        if has_right_hand is None:
+            has_right_hand = [len(embedding) > 0 for embedding in rh_embeddings]
+
+        sign_names, labels = np.unique(np.array(names, dtype=str), return_inverse=True)
+
+        partition_ids = {}
+        for idx, key in enumerate(zip(has_left_hand, has_right_hand)):
+            partition_ids.setdefault((bool(key[0]), bool(key[1])), []).append(idx)
+
+        partitions = {}
+        for (has_lh, has_rh), ids in partition_ids.items():
+            embeddings = {}
+            if has_lh:
+                embeddings["lh"] = [lh_embeddings[idx] for idx in ids]
+            if has_rh:
+                embeddings["rh"] = [rh_embeddings[idx] for idx in ids]
+            partition_weights = None
+            if weights is not None:
+                partition_weights = {
+                    hand: [weights[hand][idx] for idx in ids] for hand in (*embeddings, "joint")
+                }
+            partition = ReferencePartition.from_embeddings(ids, embeddings, partition_weights)
+            if has_lh and has_rh and joint_embeddings is not None:
+                partition.joint = ReferencePartition.from_embeddings(
+                    ids,
+                    {"joint": [joint_embeddings[idx] for idx in ids]},
+                    partition_weights and {"joint": partition_weights["joint"]},
+                )
+            partitions[(has_lh, has_rh)] = partition
+
+        return cls(sign_names, labels.astype(np.int32), partitions)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def get_partition(self, has_left_hand: bool, has_right_hand: bool):
+        """Return the ReferencePartition of the references with these hands, or None"""
+        return self.partitions.get((bool(has_left_hand), bool(has_right_hand)))
+
+    def get_names(self, ids: np.ndarray) -> List[str]:
+        return self.sign_names[self.labels[ids]].tolist()
+
+    def count_by_name(self) -> Counter:
+        """Number of references of each sign"""
+        return Counter(self.get_names(np.arange(len(self))))
@@ -2,42 +2,151 @@ from typing import List
 
 import numpy as np
 
-from models.hand_model import HandModel
+from models.hand_model import DEFAULT_EMBEDDING, get_embedding_function
+from utils.compression import Compression, get_active_frames, merge_similar_frames
 
 
 class SignModel(object):
     def __init__(
-        self, left_hand_list: List[List[float]], right_hand_list: List[List[float]]
+        self,
+        left_hand_list: List[List[float]],
+        right_hand_list: List[List[float]],
+        compression: Compression = None,
+        embedding: str = DEFAULT_EMBEDDING,
+        joint: bool = False,
     ):
         """
         Params
             x_hand_list: List of all landmarks for each frame of a video
+            compression: temporal compression of the sign (see utils.compression),
+                         None to keep every frame
+            embedding: name of the embedding of the hands (see models.hand_model.EMBEDDINGS)
+            joint: whether the joint embedding is computed, for the joint DTW
         Args
             has_x_hand: bool; True if x hand is detected in the video, otherwise False
-            xh_embedding: ndarray; Array of shape (n_frame, nb_connections * nb_connections)
+            xh_embedding: ndarray; Array of shape (n_frame, embedding size)
+                          (nb_connections * nb_connections for the angles)
+            joint_embedding: ndarray; Array of shape (n_frame, 2 * embedding size),
+                             feature vectors of both hands on a shared timeline,
+                             None if not joint
+            xh_weights, joint_weights: ndarray; Number of frames merged in each frame of the
+                                       embedding, None if the sign is not compressed
         """
+        if compression is not None:
+            # Idle lead-in and lead-out frames are trimmed
+            hand_arrays = [
+                np.asarray(hand_list, dtype=float).reshape((-1, 21 * 3))
+                for hand_list in (left_hand_list, right_hand_list)
+            ]
+            frames = get_active_frames(hand_arrays, compression.motion_threshold)
+            left_hand_list, right_hand_list = hand_arrays[0][frames], hand_arrays[1][frames]
+
         self.has_left_hand = np.sum(left_hand_list) != 0
         self.has_right_hand = np.sum(right_hand_list) != 0
 
-        self.lh_embedding = self._get_embedding_from_landmark_list(left_hand_list)
-        self.rh_embedding = self._get_embedding_from_landmark_list(right_hand_list)
+        self.lh_embedding = self._get_embedding_from_landmark_list(left_hand_list, embedding)
+        self.rh_embedding = self._get_embedding_from_landmark_list(right_hand_list, embedding)
+        self.joint_embedding = None
+        if joint:
+            self.joint_embedding = self._get_joint_embedding(
+                self.lh_embedding,
+                self.rh_embedding,
+                [
+                    np.sum(np.asarray(hand_list, dtype=float).reshape((-1, 21 * 3)), axis=1) != 0
+                    for hand_list in (left_hand_list, right_hand_list)
+                ],
+                embedding,
+            )
+
+        self.lh_weights = self.rh_weights = self.joint_weights = None
+        if compression is not None:
+            self.compress(compression.merge_tolerance)
+
+    def compress(self, merge_tolerance: float):
+        """
+        Merge the runs of near-identical consecutive frames of the embeddings
+        into weighted frames (see utils.compression)
+        """
+        for name in ("lh", "rh", "joint"):
+            embedding = getattr(self, f"{name}_embedding")
+            if embedding is None:
+                continue
+            embedding, weights = merge_similar_frames(embedding, merge_tolerance)
+            setattr(self, f"{name}_embedding", embedding)
+            setattr(self, f"{name}_weights", weights)
+
+    @classmethod
+    def from_embeddings(
+        cls,
+        lh_embedding: np.ndarray,
+        rh_embedding: np.ndarray,
+        joint_embedding: np.ndarray = None,
+    ):
+        """
+        Build a SignModel from the embeddings of the hands, already computed frame by frame
+
+        Params
+            xh_embedding: Array of shape (n_frame, embedding size),
+                          feature vectors of the x hand in the frames where it is detected
+            joint_embedding: Array of shape (n_frame, 2 * embedding size),
+                             see _get_joint_embedding (None if not computed)
+        """
+        sign_model = cls.__new__(cls)
+        sign_model.lh_embedding = np.asarray(lh_embedding, dtype=float)
+        sign_model.rh_embedding = np.asarray(rh_embedding, dtype=float)
+        sign_model.joint_embedding = joint_embedding
+        sign_model.lh_weights = sign_model.rh_weights = sign_model.joint_weights = None
+        sign_model.has_left_hand = len(sign_model.lh_embedding) > 0
+        sign_model.has_right_hand = len(sign_model.rh_embedding) > 0
+        return sign_model
 
     @staticmethod
     def _get_embedding_from_landmark_list(
-        hand_list: List[List[float]],
-    ) -> List[List[float]]:
+        hand_list: List[List[float]], embedding: str = DEFAULT_EMBEDDING
+    ) -> np.ndarray:
         """
         Params
             hand_list: List of all landmarks for each frame of a video
+            embedding: name of the embedding of the hand
         Return
-            Array of shape (n_frame, nb_connections * nb_connections) containing
+            Array of shape (n_frame, embedding size) containing
             the feature_vectors of the hand for each frame
         """
-        embedding = []
-        for frame_idx in range(len(hand_list)):
-            if np.sum(hand_list[frame_idx]) == 0:
-                continue
+        hand_array = np.asarray(hand_list, dtype=float).reshape((-1, 21 * 3))
+
+        # Frames where the hand is not detected are skipped
+        hand_array = hand_array[np.sum(hand_array, axis=1) != 0]
+        return get_embedding_function(embedding)(hand_array)
+
+    @staticmethod
+    def _get_joint_embedding(
+        lh_embedding: np.ndarray,
+        rh_embedding: np.ndarray,
+        is_detected: List[np.ndarray],
+        embedding: str = DEFAULT_EMBEDDING,
+    ) -> np.ndarray:
+        """
+        Params
+            xh_embedding: Array of shape (n_detections, embedding size),
+                          feature vectors of the x hand in the frames where it is detected
+            is_detected: bool arrays of size n_frame, whether the left and right hands
+                         are detected in each frame
+            embedding: name of the embedding of the hands
+        Return
+            Array of shape (n_frame, 2 * embedding size) containing
+            the feature vectors of the left and right hands of each frame where at least
+            one hand is detected. A missing hand is explicitly represented by a null
+            feature vector (the one of a hand whose connections are all null).
+        """
+        # Frames where no hand is detected are skipped
+        frames = is_detected[0] | is_detected[1]
+        null_embedding = get_embedding_function(embedding)(np.zeros((1, 21 * 3)))[0]
 
-            hand_gesture = HandModel(hand_list[frame_idx])
-            embedding.append(hand_gesture.feature_vector)
-        return embedding
+        # The feature vectors of each hand are scattered into the frames of the union
+        joint_embedding = np.empty((int(frames.sum()), 2, len(null_embedding)))
+        for hand_idx, (hand_embedding, detected) in enumerate(
+            zip((lh_embedding, rh_embedding), is_detected)
+        ):
+            joint_embedding[:, hand_idx] = null_embedding
+            joint_embedding[detected[frames], hand_idx] = hand_embedding
+        return joint_embedding.reshape((len(joint_embedding), -1))
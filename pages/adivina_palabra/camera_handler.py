@@ -4,10 +4,11 @@ import threading
 import time
 from tkinter import messagebox
 from PIL import Image, ImageTk
+from utils.landmark_backend import DEFAULT_BACKEND, get_landmark_backend
 from utils.mediapipe_utils import mediapipe_detection
 
 class CameraHandler:
-    def __init__(self, parent):
+    def __init__(self, parent, landmark_backend=DEFAULT_BACKEND):
         self.parent = parent
         
         # Variables de la cámara
@@ -18,6 +19,10 @@ class CameraHandler:
         
         # Estado de grabación para el indicador visual
         self.is_recording_visual = False
+
+        # Detector de puntos de las manos ("holistic", "hands" o "hand_landmarker",
+        # ver utils.landmark_backend)
+        self.landmark_backend = landmark_backend
     
     def iniciar_camara(self):
         """Inicializar la cámara"""
@@ -35,9 +40,9 @@ class CameraHandler:
     
     def proceso_camara(self):
         """Proceso principal de la cámara con reconocimiento"""
-        with mediapipe.solutions.holistic.Holistic(
-            min_detection_confidence=0.5, min_tracking_confidence=0.5
-        ) as holistic:
+        with get_landmark_backend(
+            self.landmark_backend, min_detection_confidence=0.5, min_tracking_confidence=0.5
+        ) as detector:
             
             while self.camera_running and self.cap and self.cap.isOpened():
                 ret, frame = self.cap.read()
@@ -46,7 +51,7 @@ class CameraHandler:
                 
                 try:
                     # Procesar frame con MediaPipe
-                    image, results = mediapipe_detection(frame, holistic)
+                    image, results = mediapipe_detection(frame, detector)
                     
                     # Procesar resultados del reconocimiento
                     if (self.parent.game_logic.sign_recorder and 
@@ -2,9 +2,10 @@ import customtkinter as ctk
 from pages.adivina_palabra.ui_components import SecuenciaUI
 from pages.adivina_palabra.game_logic import GameLogic
 from pages.adivina_palabra.camera_handler import CameraHandler
+from utils.landmark_backend import DEFAULT_BACKEND
 
 class AdivinaPalabraGame(ctk.CTkFrame):
-    def __init__(self, parent, controller):
+    def __init__(self, parent, controller, landmark_backend=DEFAULT_BACKEND):
         super().__init__(parent)
         self.controller = controller
         self.configure(fg_color="#E6F3FF")
@@ -12,7 +13,7 @@ class AdivinaPalabraGame(ctk.CTkFrame):
         # Inicializar componentes
         self.ui = SecuenciaUI(self)
         self.game_logic = GameLogic(self)
-        self.camera_handler = CameraHandler(self)
+        self.camera_handler = CameraHandler(self, landmark_backend)
         
         # Configurar UI
         self.ui.setup_ui()
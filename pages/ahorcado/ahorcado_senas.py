@@ -5,13 +5,16 @@ from .ahorcado_logic import AhorcadoLogic
 from .ui_component import AhorcadoUI
 from .camera_handler import CameraHandler
 from .ahorcado_detector import SignDetector
+from utils.landmark_backend import DEFAULT_BACKEND
 
 class AhorcadoSeñasGame(ctk.CTkFrame):
     """Juego de Ahorcado integrado con el sistema de navegación principal"""
 
-    def __init__(self, parent, controller):
+    def __init__(self, parent, controller, landmark_backend=DEFAULT_BACKEND):
         super().__init__(parent, fg_color="#ECF0F1")
         self.controller = controller  # Referencia a MainApp
+        # Detector de puntos de las manos de la cámara (ver utils.landmark_backend)
+        self.landmark_backend = landmark_backend
         self.help_window = None  # Ventana de ayuda
 
         # Estado de inicialización
@@ -48,7 +51,7 @@ class AhorcadoSeñasGame(ctk.CTkFrame):
         self.ui.pack(fill="both", expand=True)
 
         # 4. Manejador de cámara
-        self.camera_handler = CameraHandler(self)
+        self.camera_handler = CameraHandler(self, self.landmark_backend)
 
         # Conectar componentes
         self.logic.set_sign_detector(self.sign_detector)
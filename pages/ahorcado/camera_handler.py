@@ -10,17 +10,21 @@ from tkinter import messagebox
 from PIL import Image
 import customtkinter as ctk
 import mediapipe as mp
+from utils.landmark_backend import DEFAULT_BACKEND, get_landmark_backend
 from utils.mediapipe_utils import mediapipe_detection
 
 class CameraHandler:
     """Maneja la captura de video y detección de señas en tiempo real"""
 
-    def __init__(self, app):
+    def __init__(self, app, landmark_backend=DEFAULT_BACKEND):
         self.app = app
 
         # Configuración de MediaPipe
         self.mp_holistic = mp.solutions.holistic
         self.holistic = None
+        # Detector de puntos de las manos ("holistic", "hands" o "hand_landmarker",
+        # ver utils.landmark_backend)
+        self.landmark_backend = landmark_backend
         self.mp_drawing = mp.solutions.drawing_utils
 
         # Estado de la cámara
@@ -44,7 +48,8 @@ class CameraHandler:
             self.app.ui.mostrar_camara_iniciando()
 
             # Inicializar MediaPipe
-            self.holistic = self.mp_holistic.Holistic(
+            self.holistic = get_landmark_backend(
+                self.landmark_backend,
                 min_detection_confidence=0.5,
                 min_tracking_confidence=0.5
             )
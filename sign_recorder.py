@@ -1,30 +1,118 @@
-import pandas as pd
-import numpy as np
 from collections import Counter
 
-from utils.dtw import dtw_distances
-from models.sign_model import SignModel
-from utils.landmark_utils import extract_landmarks
+from utils.anytime import AnytimeClassifier
+from utils.dtw import dtw_distances, precompute_envelopes
+from utils.parallel_search import ParallelSearch
+from utils.prototypes import prototype_search
+from utils.shortlist import SHORTLIST_LENGTH, precompute_resampled
+from utils.spotting import SignSpotter
+from models.hand_model import DEFAULT_EMBEDDING
+from models.reference_index import ReferenceIndex
+from utils.compression import Compression
+from utils.projection import Projection
+from utils.landmark_buffer import LandmarkBuffer
 
 
 class SignRecorder(object):
-    def __init__(self, reference_signs: pd.DataFrame, seq_len=50):
+    def __init__(
+        self,
+        reference_signs: ReferenceIndex,
+        seq_len=50,
+        dtw_engine="dtw",
+        dtw_window=None,
+        batch_size=5,
+        n_workers=None,
+        prototypes: ReferenceIndex = None,
+        n_classes=3,
+        spotting_threshold=None,
+        early_stop_margin=None,
+        early_stop_every=10,
+        joint_dtw=False,
+        compression: Compression = None,
+        shortlist_size=None,
+        shortlist_metric="euclidean",
+        projection: Projection = None,
+        embedding: str = DEFAULT_EMBEDDING,
+    ):
         # Variables para la grabación
         self.is_recording = False
         self.seq_len = seq_len
 
-        # Lista para almacenar los resultados de cada fotograma
-        self.recorded_results = []
+        # Implementación de DTW ("dtw", "batch" o "fastdtw") y banda de Sakoe-Chiba
+        self.dtw_engine = dtw_engine
+        self.dtw_window = dtw_window
 
-        # DataFrame que almacena las distancias entre la seña grabada y las señas de referencia del dataset
+        # Con joint_dtw, las señas con las dos manos se comparan con un solo DTW
+        # sobre el embedding conjunto de las dos manos (ver SignModel): las señas de referencia
+        # deben cargarse con load_reference_signs(..., joint=True)
+        self.joint_dtw = joint_dtw
+
+        # Con compression, la seña grabada se comprime como las señas de referencia
+        # (ver utils.compression): sin fotogramas quietos al inicio y al final
+        self.compression = compression
+
+        # Con shortlist_size, solo las shortlist_size señas de referencia más cercanas una vez
+        # remuestreadas a longitud fija (ver utils.shortlist) se comparan con DTW
+        # shortlist_metric: distancia entre las señas remuestreadas, "euclidean" o "cosine"
+        self.shortlist_size = shortlist_size
+        self.shortlist_metric = shortlist_metric
+        if shortlist_size is not None:
+            precompute_resampled(reference_signs, SHORTLIST_LENGTH)
+
+        # Puntos de las manos de los fotogramas grabados y sus embeddings, calculados a medida
+        # que llegan los fotogramas, en un buffer circular reservado una sola vez
+        # Con projection, los embeddings se proyectan como los de las señas de referencia
+        # (ver utils.projection); embedding debe ser el de las señas de referencia
+        # (ver models.hand_model.EMBEDDINGS)
+        self.landmark_buffer = LandmarkBuffer(seq_len, projection, embedding)
+
+        # Número de señas de referencia más cercanas usadas para la predicción
+        self.batch_size = batch_size
+
+        # Índice de las señas de referencia del dataset
         self.reference_signs = reference_signs
 
+        # Señas de referencia más cercanas a la última seña grabada (None si no se ha calculado)
+        self.search_result = None
+
+        # Envolventes LB_Keogh de las señas de referencia, calculadas una sola vez al inicio
+        precompute_envelopes(self.reference_signs, self.seq_len, self.dtw_window)
+
+        # Con n_workers, la búsqueda se reparte entre procesos creados una sola vez al inicio
+        self.parallel_search = None
+        if n_workers is not None:
+            self.parallel_search = ParallelSearch(self.reference_signs, n_workers)
+
+        # Con prototipos (ver utils.prototypes), la búsqueda se hace en dos etapas:
+        # primero las n_classes señas con los prototipos más cercanos, luego sus videos
+        # (repartidos entre los procesos si hay n_workers)
+        self.prototypes = prototypes
+        self.n_classes = n_classes
+
+        # Con spotting_threshold, las señas se detectan en continuo sin necesidad de grabar
+        # (ver utils.spotting): la última detección se guarda en self.detection
+        self.sign_spotter = None
+        self.detection = None
+        if spotting_threshold is not None:
+            self.sign_spotter = SignSpotter(self.reference_signs, spotting_threshold)
+
+        # Con early_stop_margin, cada early_stop_every fotogramas se compara la grabación
+        # en curso con las señas de referencia (ver utils.anytime): la grabación termina
+        # antes de seq_len fotogramas si la seña más cercana supera a la segunda por el margen
+        self.anytime_classifier = None
+        self.early_stop_every = early_stop_every
+        self.frames_saved = 0
+        if early_stop_margin is not None:
+            self.anytime_classifier = AnytimeClassifier(self.reference_signs, early_stop_margin)
+
     def record(self):
         """
         Inicializa las distancias y comienza la grabación
         """
-        self.reference_signs["distance"].values[:] = 0
+        self.search_result = None
         self.is_recording = True
+        if self.anytime_classifier is not None:
+            self.anytime_classifier.reset()
 
     def process_results(self, results) -> (str, bool):  # type: ignore
         """
@@ -36,56 +124,135 @@ class SignRecorder(object):
         :return: Devuelve la palabra predicha (texto vacío si no se han calculado distancias)
                  y el estado de grabación
         """
+        if self.sign_spotter is not None:
+            return self._spot_sign(results), False
+
         if self.is_recording:
-            if len(self.recorded_results) < self.seq_len:
-                self.recorded_results.append(results)
+            if len(self.landmark_buffer) < self.seq_len:
+                self.landmark_buffer.push(results)
+                if self._is_decided():
+                    self.frames_saved = self.seq_len - len(self.landmark_buffer)
+                    print(f"Grabación terminada {self.frames_saved} fotogramas antes")
+                    self.compute_distances()
+                    print(self.search_result)
             else:
+                self.frames_saved = 0
                 self.compute_distances()
-                print(self.reference_signs)
+                print(self.search_result)
 
-        if np.sum(self.reference_signs["distance"].values) == 0:
+        if self.search_result is None:
             return "", self.is_recording
         return self._get_sign_predicted(), self.is_recording
 
+    def _is_decided(self) -> bool:
+        """
+        Cada early_stop_every fotogramas, añade los últimos embeddings grabados a la
+        clasificación anticipada y comprueba si ya se puede decidir la seña
+        """
+        if (
+            self.anytime_classifier is None
+            or len(self.landmark_buffer) % self.early_stop_every != 0
+        ):
+            return False
+
+        n_frames = self.anytime_classifier.n_frames
+        self.anytime_classifier.update(
+            self.landmark_buffer.get_embedding("lh", n_frames["lh"]),
+            self.landmark_buffer.get_embedding("rh", n_frames["rh"]),
+        )
+        return self.anytime_classifier.decide() is not None
+
     def compute_distances(self):
         """
-        Actualiza la columna de distancias del DataFrame reference_signs
+        Busca las señas de referencia más cercanas a la seña grabada
         y reinicia las variables de grabación
         """
-        left_hand_list, right_hand_list = [], []
-        for results in self.recorded_results:
-            _, left_hand, right_hand = extract_landmarks(results)
-            left_hand_list.append(left_hand)
-            right_hand_list.append(right_hand)
-
-        # Crear un objeto SignModel con los puntos recolectados durante la grabación
-        recorded_sign = SignModel(left_hand_list, right_hand_list)
+        # Crear un objeto SignModel con los embeddings calculados durante la grabación
+        recorded_sign = self.landmark_buffer.get_sign_model(
+            self.compression, self.joint_dtw
+        )
 
         # Calcular la similitud con otras señas usando DTW (orden ascendente)
-        self.reference_signs = dtw_distances(recorded_sign, self.reference_signs)
+        # Solo se necesitan las batch_size señas más cercanas: las demás se descartan
+        # con cotas inferiores y DTW abandonado a tiempo
+        if self.prototypes is not None:
+            self.search_result = prototype_search(
+                recorded_sign,
+                self.reference_signs,
+                self.prototypes,
+                self.n_classes,
+                self.dtw_engine,
+                self.dtw_window,
+                k=self.batch_size,
+                joint=self.joint_dtw,
+                shortlist=self.shortlist_size,
+                shortlist_metric=self.shortlist_metric,
+                parallel_search=self.parallel_search,
+            )
+        elif self.parallel_search is not None:
+            self.search_result = self.parallel_search.search(
+                recorded_sign,
+                self.dtw_engine,
+                self.dtw_window,
+                k=self.batch_size,
+                joint=self.joint_dtw,
+                shortlist=self.shortlist_size,
+                shortlist_metric=self.shortlist_metric,
+            )
+        else:
+            self.search_result = dtw_distances(
+                recorded_sign,
+                self.reference_signs,
+                self.dtw_engine,
+                self.dtw_window,
+                k=self.batch_size,
+                joint=self.joint_dtw,
+                shortlist=self.shortlist_size,
+                shortlist_metric=self.shortlist_metric,
+            )
+        print(f"Señas descartadas por etapa: {self.search_result.pruning}")
 
         # Reiniciar variables
-        self.recorded_results = []
+        self.landmark_buffer.clear()
         self.is_recording = False
 
-    def _get_sign_predicted(self, batch_size=5, threshold=0.2):
+    def _spot_sign(self, results) -> str:
+        """
+        Avanza la detección continua con el fotograma actual
+
+        :param results: salida de mediapipe
+        :return: El nombre de la última seña detectada (texto vacío si todavía no hay ninguna)
+        """
+        # El buffer circular se sobrescribe: la memoria no crece aunque nunca se deje de grabar
+        self.landmark_buffer.push(results)
+        detection = self.sign_spotter.update(*self.landmark_buffer.get_last_embeddings())
+        if detection is not None:
+            self.detection = detection
+            print(detection)
+
+        if self.detection is None:
+            return ""
+        return self.detection.name
+
+    def _get_sign_predicted(self, threshold=0.2):
         """
         Método que determina la seña más común en el lote de señas de referencia más cercanas,
         siempre que su proporción sea mayor al umbral especificado
 
-        :param batch_size: Tamaño del lote de señas de referencia a comparar con la seña grabada
         :param threshold: Si la proporción de la seña más representada supera el umbral,
                           se devuelve el nombre de la seña
                           Si no, se devuelve "Seña desconocida"
         :return: El nombre de la seña predicha
         """
         # Obtener la lista (de tamaño batch_size) de las señas más similares
-        sign_names = self.reference_signs.iloc[:batch_size]["name"].values
+        sign_names = self.search_result.names[: self.batch_size]
+        if len(sign_names) == 0:
+            return "Seña desconocida"
 
         # Contar las ocurrencias de cada seña y ordenarlas de forma descendente
         sign_counter = Counter(sign_names).most_common()
 
         predicted_sign, count = sign_counter[0]
-        if count / batch_size < threshold:
+        if count / self.batch_size < threshold:
             return "Seña desconocida"
         return predicted_sign
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# The modules of the repository are imported from its root, as by the apps
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.reference_index import ReferenceIndex  # noqa: E402
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def random_embeddings(rng, n_references, min_length=5, max_length=30, size=8):
+    """Embeddings of random lengths, of a few dimensions (the DTW does not depend on it)"""
+    return [
+        rng.random((rng.integers(min_length, max_length + 1), size)) for _ in range(n_references)
+    ]
+
+
+@pytest.fixture
+def reference_index(rng):
+    """Synthetic ReferenceIndex with one-handed and two-handed references of 6 signs"""
+    n_references = 60
+    names = [f"sign{idx % 6}" for idx in range(n_references)]
+    lh_embeddings = random_embeddings(rng, n_references)
+    rh_embeddings = random_embeddings(rng, n_references)
+    # Left hand only, right hand only and both hands
+    for idx in range(n_references):
+        if idx % 3 == 0:
+            rh_embeddings[idx] = np.zeros((0, 8))
+        elif idx % 3 == 1:
+            lh_embeddings[idx] = np.zeros((0, 8))
+    return ReferenceIndex.from_embeddings(names, lh_embeddings, rh_embeddings)
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import pytest
+
+import utils.dataset_utils
+from utils.dataset_manifest import DatasetManifest, get_video_path
+from utils.dataset_utils import load_dataset
+from utils.landmark_store import get_landmark_path, save_landmarks
+
+
+def _save_fake_landmarks(video_name):
+    save_landmarks(get_landmark_path(video_name), np.zeros(3), np.ones((3, 63)), np.zeros((3, 63)))
+
+
+@pytest.fixture
+def extracted(tmp_path, monkeypatch):
+    """
+    Dataset in a temporary folder, whose extraction writes placeholder landmarks:
+    the names of the videos extracted by each call of load_dataset are recorded
+    """
+    monkeypatch.chdir(tmp_path)
+    extracted = []
+
+    def extract_landmarks_from_videos(video_names, *args):
+        extracted.append(sorted(video_names))
+        for video_name in video_names:
+            _save_fake_landmarks(video_name)
+            yield video_name, 3
+
+    monkeypatch.setattr(
+        utils.dataset_utils, "extract_landmarks_from_videos", extract_landmarks_from_videos
+    )
+    return extracted
+
+
+def _write_video(video_name, content=b"video"):
+    path = get_video_path(video_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+def _load_dataset(extracted, **params):
+    """:return: the videos of the dataset and the ones extracted again"""
+    extracted.clear()
+    videos = load_dataset(**params)
+    return sorted(videos), extracted[0] if extracted else []
+
+
+def test_adoption_of_the_landmarks_extracted_before_the_manifest(extracted):
+    for video_name in ("a-1", "a-2", "b-1"):
+        _write_video(video_name)
+    _save_fake_landmarks("a-1")
+    _save_fake_landmarks("b-1")
+
+    videos, reextracted = _load_dataset(extracted)
+    assert videos == ["a-1", "a-2", "b-1"]
+    assert reextracted == ["a-2"]
+    assert sorted(DatasetManifest().entries) == ["a-1", "a-2", "b-1"]
+
+    _, reextracted = _load_dataset(extracted)
+    assert reextracted == []
+
+
+def test_reextraction_of_the_changed_videos(extracted):
+    for video_name in ("a-1", "a-2", "a-3", "b-1"):
+        _write_video(video_name, video_name.encode())
+    _load_dataset(extracted)
+
+    # Touched video (same content): only hashed again
+    stat = os.stat(get_video_path("a-1"))
+    os.utime(get_video_path("a-1"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    # Modified video of the same size
+    _write_video("a-2", b"A-2")
+    # Removed video, and video whose landmarks were deleted
+    os.remove(get_video_path("a-3"))
+    os.remove(get_landmark_path("b-1"))
+
+    videos, reextracted = _load_dataset(extracted)
+    assert videos == ["a-1", "a-2", "b-1"]
+    assert reextracted == ["a-2", "b-1"]
+    assert not os.path.exists(get_landmark_path("a-3"))
+    manifest = DatasetManifest()
+    assert sorted(manifest.entries) == ["a-1", "a-2", "b-1"]
+    assert manifest.entries["a-1"].mtime_ns == os.stat(get_video_path("a-1")).st_mtime_ns
+
+    # New extraction parameters: every video is extracted again
+    _, reextracted = _load_dataset(extracted, frame_step=2)
+    assert reextracted == ["a-1", "a-2", "b-1"]
+    _, reextracted = _load_dataset(extracted, frame_step=2)
+    assert reextracted == []
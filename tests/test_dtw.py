@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from utils.dtw import _get_band, dtw_distance
+
+
+def _naive_dtw(x, y, window=None, x_weights=None, y_weights=None):
+    """Textbook DTW filling the whole (n x m) matrix, restricted to the band of the window"""
+    n, m = len(x), len(y)
+    lower, upper = _get_band(n, m, window)
+    matrix = np.full((n + 1, m + 1), np.inf)
+    matrix[0, 0] = 0
+    for i in range(n):
+        for j in range(lower[i], upper[i] + 1):
+            cost = np.abs(x[i] - y[j]).sum()
+            if x_weights is not None or y_weights is not None:
+                cost *= max(
+                    1 if x_weights is None else x_weights[i],
+                    1 if y_weights is None else y_weights[j],
+                )
+            matrix[i + 1, j + 1] = cost + min(matrix[i, j], matrix[i, j + 1], matrix[i + 1, j])
+    return matrix[n, m]
+
+
+def _get_pairs(rng):
+    lengths = [(1, 1), (1, 7), (7, 1), (12, 12), (9, 23), (30, 11)]
+    return [(rng.random((n, 4)), rng.random((m, 4))) for n, m in lengths]
+
+
+@pytest.mark.parametrize("window", [None, 0, 2, 5, 0.1, 0.3, 1.0])
+def test_banded_dtw_matches_naive_dp(rng, window):
+    for x, y in _get_pairs(rng):
+        assert dtw_distance(x, y, window) == pytest.approx(_naive_dtw(x, y, window), rel=1e-12)
+
+
+def test_weighted_dtw_matches_naive_dp(rng):
+    for x, y in _get_pairs(rng):
+        x_weights = rng.integers(1, 4, len(x)).astype(float)
+        y_weights = rng.integers(1, 4, len(y)).astype(float)
+        assert dtw_distance(x, y, 3, x_weights=x_weights, y_weights=y_weights) == pytest.approx(
+            _naive_dtw(x, y, 3, x_weights, y_weights), rel=1e-12
+        )
+
+
+def test_early_abandon_only_drops_larger_distances(rng):
+    for x, y in _get_pairs(rng):
+        distance = _naive_dtw(x, y)
+        assert dtw_distance(x, y, max_distance=distance) == pytest.approx(distance, rel=1e-12)
+        assert dtw_distance(x, y, max_distance=distance * 0.99) == np.inf
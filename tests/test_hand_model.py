@@ -0,0 +1,48 @@
+import numpy as np
+
+from models.hand_model import HAND_CONNECTIONS, HandModel, get_feature_vectors
+
+
+def _get_feature_vector_loop(landmarks: np.ndarray) -> list:
+    """Angles between the connections of one hand, computed pair by pair as before"""
+    connections = [landmarks[to] - landmarks[origin] for origin, to in HAND_CONNECTIONS]
+    angles = []
+    for u in connections:
+        for v in connections:
+            if np.array_equal(u, v):
+                angles.append(0)
+                continue
+            with np.errstate(divide="ignore", invalid="ignore"):
+                angle = np.arccos(np.dot(u, v) / (np.linalg.norm(u) * np.linalg.norm(v)))
+            angles.append(angle if angle == angle else 0)
+    return angles
+
+
+# Near 0, arccos turns a rounding error of a cosine into an error of about 1e-8 radians
+ATOL = 1e-7
+
+
+def _get_hands(rng):
+    hands = rng.random((6, 21, 3))
+    # Null hand, a hand with a null connection and a hand with parallel connections
+    hands[1] = 0
+    hands[2, 5] = hands[2, 0]
+    hands[3, 1:5] = hands[3, 0] + np.arange(4)[:, None] * 0.1
+    return hands
+
+
+def test_feature_vectors_match_the_loop(rng):
+    hands = _get_hands(rng)
+    expected = np.array([_get_feature_vector_loop(hand) for hand in hands])
+    np.testing.assert_allclose(get_feature_vectors(hands), expected, rtol=0, atol=ATOL)
+
+
+def test_hand_model_uses_the_feature_vectors(rng):
+    hands = _get_hands(rng)
+    for hand in hands:
+        np.testing.assert_allclose(
+            HandModel(hand.reshape(-1).tolist()).feature_vector,
+            _get_feature_vector_loop(hand),
+            rtol=0,
+            atol=ATOL,
+        )
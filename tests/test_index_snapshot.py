@@ -0,0 +1,81 @@
+import numpy as np
+
+from models.reference_index import ReferenceIndex
+from models.sign_model import SignModel
+from utils.dtw import dtw_distances, precompute_envelopes
+from utils.index_snapshot import load_snapshot, save_snapshot
+from utils.shortlist import SHORTLIST_LENGTH, precompute_resampled
+
+
+def _get_reference_index(rng):
+    """Compressed references, with the joint embeddings of the two-handed ones"""
+    n_references = 30
+    lengths = rng.integers(5, 25, n_references)
+    lh = [rng.random((length, 8)) for length in lengths]
+    rh = [
+        rng.random((length, 8)) if idx % 2 else np.zeros((0, 8))
+        for idx, length in enumerate(lengths)
+    ]
+    joint = [
+        np.concatenate([lh[idx], rh[idx]], axis=1) if idx % 2 else None
+        for idx in range(n_references)
+    ]
+    weights = {
+        "lh": [rng.integers(1, 3, length).astype(float) for length in lengths],
+        "rh": [rng.integers(1, 3, len(embedding)).astype(float) for embedding in rh],
+        "joint": [None if embedding is None else np.ones(len(embedding)) for embedding in joint],
+    }
+    names = [f"sign{idx % 4}" for idx in range(n_references)]
+    return ReferenceIndex.from_embeddings(names, lh, rh, None, None, joint, weights)
+
+
+def _assert_same_partition(loaded, partition):
+    np.testing.assert_array_equal(loaded.ids, partition.ids)
+    assert loaded.hands == partition.hands
+    for hand in partition.hands:
+        np.testing.assert_array_equal(loaded.offsets[hand], partition.offsets[hand])
+        np.testing.assert_array_equal(loaded.blocks[hand], partition.blocks[hand])
+        np.testing.assert_array_equal(loaded.weights[hand], partition.weights[hand])
+    for caches in ("envelopes", "resampled"):
+        assert getattr(loaded, caches).keys() == getattr(partition, caches).keys()
+        for key, arrays in getattr(partition, caches).items():
+            for loaded_array, array in zip(getattr(loaded, caches)[key], arrays):
+                np.testing.assert_array_equal(loaded_array, array)
+    assert (loaded.joint is None) == (partition.joint is None)
+    if partition.joint is not None:
+        _assert_same_partition(loaded.joint, partition.joint)
+
+
+def test_snapshot_round_trip(rng, tmp_path):
+    reference_index = _get_reference_index(rng)
+    precompute_envelopes(reference_index, 12, 3)
+    precompute_resampled(reference_index, SHORTLIST_LENGTH)
+    path = str(tmp_path / "index.bin")
+    save_snapshot(reference_index, "stamp", path)
+
+    loaded = load_snapshot(path, "stamp")
+    np.testing.assert_array_equal(loaded.sign_names, reference_index.sign_names)
+    np.testing.assert_array_equal(loaded.labels, reference_index.labels)
+    assert loaded.partitions.keys() == reference_index.partitions.keys()
+    for key, partition in reference_index.partitions.items():
+        _assert_same_partition(loaded.partitions[key], partition)
+
+    # Same search on the mapped arrays
+    query = SignModel.from_embeddings(
+        rng.random((12, 8)), rng.random((10, 8)), rng.random((12, 16))
+    )
+    for joint in (False, True):
+        result = dtw_distances(query, loaded, "dtw", 3, k=5, joint=joint, shortlist=10)
+        expected = dtw_distances(query, reference_index, "dtw", 3, k=5, joint=joint, shortlist=10)
+        np.testing.assert_array_equal(result.ids, expected.ids)
+        np.testing.assert_array_equal(result.distances, expected.distances)
+
+
+def test_snapshot_out_of_date(rng, tmp_path):
+    path = str(tmp_path / "index.bin")
+    assert load_snapshot(path) is None
+    save_snapshot(_get_reference_index(rng), "stamp", path)
+    assert load_snapshot(path, "other stamp") is None
+    assert load_snapshot(path) is not None
+    # No temporary file is left next to the snapshot
+    assert [entry.name for entry in tmp_path.iterdir()] == ["index.bin"]
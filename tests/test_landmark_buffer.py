@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from models.sign_model import SignModel
+from utils.compression import Compression
+from utils.landmark_buffer import LandmarkBuffer
+
+# The buffer stores float32 embeddings
+ATOL = 1e-5
+
+
+def _get_hands(rng, n_frames):
+    """
+    Landmarks of both hands moving slowly, with idle frames at the start and the end and
+    frames where a hand is missing. The values are float32, the precision of the buffer.
+    """
+    steps = rng.normal(scale=0.01, size=(2, n_frames, 21, 3))
+    steps[:, :5] = steps[:, -5:] = 0
+    hands = (rng.random((2, 1, 21, 3)) + np.cumsum(steps, axis=1)).astype(np.float32)
+    hands = hands.astype(float)
+    hands[0, 10:14] = 0
+    hands[1, 20:23] = 0
+    return hands
+
+
+def _get_results(left_hand, right_hand):
+    """Results of the landmark backend for one frame"""
+
+    def get_landmarks(hand):
+        if not hand.any():
+            return None
+        return SimpleNamespace(landmark=[SimpleNamespace(x=x, y=y, z=z) for x, y, z in hand])
+
+    return SimpleNamespace(
+        left_hand_landmarks=get_landmarks(left_hand),
+        right_hand_landmarks=get_landmarks(right_hand),
+    )
+
+
+def _assert_same_sign(sign_model, expected):
+    for name in ("lh", "rh", "joint"):
+        embedding = getattr(expected, f"{name}_embedding")
+        if embedding is None:
+            assert getattr(sign_model, f"{name}_embedding") is None
+            continue
+        np.testing.assert_allclose(getattr(sign_model, f"{name}_embedding"), embedding, atol=ATOL)
+        np.testing.assert_array_equal(
+            getattr(sign_model, f"{name}_weights"), getattr(expected, f"{name}_weights")
+        )
+    assert sign_model.has_left_hand == expected.has_left_hand
+    assert sign_model.has_right_hand == expected.has_right_hand
+
+
+@pytest.mark.parametrize("compression", [None, Compression()])
+@pytest.mark.parametrize("capacity", [100, 30])
+def test_buffer_matches_sign_model(rng, compression, capacity):
+    n_frames = 60
+    hands = _get_hands(rng, n_frames)
+    buffer = LandmarkBuffer(capacity)
+    for frame in range(n_frames):
+        buffer.push(_get_results(hands[0, frame], hands[1, frame]))
+
+    # Only the last frames are kept once the buffer is full
+    kept = hands[:, -min(capacity, n_frames) :]
+    expected = SignModel(
+        kept[0].reshape((-1, 63)).tolist(),
+        kept[1].reshape((-1, 63)).tolist(),
+        compression,
+        joint=True,
+    )
+    _assert_same_sign(buffer.get_sign_model(compression, joint=True), expected)
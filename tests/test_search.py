@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from models.sign_model import SignModel
+from utils.dtw import dtw_distance, dtw_distances
+from utils.parallel_search import ParallelSearch
+
+K = 5
+
+
+def _get_queries(rng):
+    """Recorded signs of several lengths, with the left, the right and both hands"""
+    queries = []
+    for length, hands in [(8, "lh"), (20, "rh"), (12, "both"), (27, "both"), (5, "rh")]:
+        lh = rng.random((length, 8)) if hands in ("lh", "both") else np.zeros((0, 8))
+        rh = rng.random((length + 3, 8)) if hands in ("rh", "both") else np.zeros((0, 8))
+        queries.append(SignModel.from_embeddings(lh, rh))
+    return queries
+
+
+def _brute_force(query, reference_index, window=None, labels=None):
+    """Distance to every reference with the same hands, one exact DTW per hand"""
+    partition = reference_index.get_partition(query.has_left_hand, query.has_right_hand)
+    distances = np.zeros(len(partition))
+    for hand in partition.hands:
+        recorded = getattr(query, f"{hand}_embedding")
+        distances += [
+            dtw_distance(recorded, partition.get_embedding(hand, position), window)
+            for position in range(len(partition))
+        ]
+    if labels is not None:
+        distances[~np.isin(reference_index.labels[partition.ids], labels)] = np.inf
+    order = np.argsort(distances, kind="stable")
+    order = order[np.isfinite(distances[order])]
+    return partition.ids[order], distances[order]
+
+
+def _assert_nearest(result, expected_ids, expected_distances, k=K):
+    np.testing.assert_array_equal(result.ids, expected_ids[:k])
+    np.testing.assert_allclose(result.distances, expected_distances[:k], rtol=1e-12)
+
+
+@pytest.mark.parametrize("window", [None, 3, 0.2])
+def test_cascade_matches_brute_force(rng, reference_index, window):
+    # The envelopes computed for the first query are reused by the next ones
+    for query in _get_queries(rng):
+        result = dtw_distances(query, reference_index, "dtw", window, k=K)
+        _assert_nearest(result, *_brute_force(query, reference_index, window))
+        # Each candidate is either pruned by a stage or fully compared
+        stages = ("lb_kim", "lb_keogh", "early_abandon", "dtw")
+        assert sum(result.pruning[stage] for stage in stages) == result.pruning["candidates"]
+
+
+@pytest.mark.parametrize("window", [None, 3, 0.2])
+def test_batch_engine_matches_brute_force(rng, reference_index, window):
+    # Every reference is compared: all the distances are checked, padding included
+    for query in _get_queries(rng):
+        result = dtw_distances(query, reference_index, "batch", window)
+        expected_ids, expected_distances = _brute_force(query, reference_index, window)
+        _assert_nearest(result, expected_ids, expected_distances, k=len(expected_ids))
+
+
+def test_parallel_search_matches_brute_force(rng, reference_index):
+    queries = _get_queries(rng)
+    labels = np.array([1, 4])
+    with ParallelSearch(reference_index, 2) as parallel_search:
+        for engine in ("dtw", "batch"):
+            for query in queries:
+                result = parallel_search.search(query, engine, 3, k=K)
+                _assert_nearest(result, *_brute_force(query, reference_index, 3))
+                result = parallel_search.search(query, engine, 3, k=K, labels=labels)
+                _assert_nearest(result, *_brute_force(query, reference_index, 3, labels))
@@ -0,0 +1,38 @@
+import numpy as np
+
+from utils.spotting import spring_step
+
+
+def _naive_spring_step(costs, column, starts, frame):
+    """SPRING cell by cell: each cell takes the cost and start of its best predecessor"""
+    n_references, m = costs.shape
+    new_column = np.empty_like(column)
+    new_starts = np.empty_like(starts)
+    for reference in range(n_references):
+        for j in range(m):
+            predecessors = [
+                # Diagonal (a path may start on this frame), horizontal and vertical moves
+                (0.0, frame) if j == 0 else (column[reference, j - 1], starts[reference, j - 1]),
+                (column[reference, j], starts[reference, j]),
+            ]
+            if j > 0:
+                predecessors.append((new_column[reference, j - 1], new_starts[reference, j - 1]))
+            cost, start = min(predecessors, key=lambda predecessor: predecessor[0])
+            new_column[reference, j] = costs[reference, j] + cost
+            new_starts[reference, j] = start
+    return new_column, new_starts
+
+
+def test_spring_step_matches_the_cell_by_cell_recurrence(rng):
+    n_references, m = 5, 7
+    column = expected_column = np.full((n_references, m), np.inf)
+    starts = expected_starts = np.zeros((n_references, m), dtype=np.int64)
+    for frame in range(40):
+        # Costs of very different magnitudes, whose cumulative sums are rounded
+        costs = rng.random((n_references, m)) * 10.0 ** rng.integers(-6, 4, (n_references, m))
+        column, starts = spring_step(costs, column, starts, frame)
+        expected_column, expected_starts = _naive_spring_step(
+            costs, expected_column, expected_starts, frame
+        )
+        np.testing.assert_allclose(column, expected_column, rtol=1e-12, atol=1e-12)
+        np.testing.assert_array_equal(starts, expected_starts)
@@ -0,0 +1,133 @@
+"""
+Anytime classification of a sign being recorded: open-ended DTW rows of every reference,
+advanced with the new frames of the recording, so that the recording can stop
+as soon as one sign is clearly the closest.
+"""
+from typing import Optional
+
+import numpy as np
+
+from models.reference_index import ReferenceIndex
+from utils.dtw import get_bucket_weights, get_buckets
+
+
+def _advance_rows(
+    x: np.ndarray, ys: np.ndarray, rows: np.ndarray, ys_weights: np.ndarray = None
+) -> np.ndarray:
+    """
+    Advance the DTW matrices of several sequences padded to the same length by the frames
+    of x (same recurrence as utils.dtw.dtw_distance_batch, without band: the cells of the
+    padding, at the end of the rows, do not change the cells of the sequences)
+
+    :param x: array of shape (n, d), new frames of the first sequence
+    :param ys: array of shape (n_sequences, m, d)
+    :param rows: array of shape (n_sequences, m + 1), last rows of the DTW matrices,
+                 shifted by one: index 0 stands for column -1
+    :param ys_weights: array of shape (n_sequences, m), weights of the frames of ys
+                       (the frames of x weigh 1, see utils.dtw.dtw_distance)
+    :return: the rows after the last frame of x
+    """
+    for frame in x:
+        cost = np.abs(ys - frame).sum(axis=2, dtype=float)
+        if ys_weights is not None:
+            cost *= ys_weights
+        best = cost + np.minimum(rows[:, :-1], rows[:, 1:])
+        cumulative_cost = np.cumsum(cost, axis=1)
+        new_rows = np.full_like(rows, np.inf)
+        new_rows[:, 1:] = cumulative_cost + np.minimum.accumulate(
+            best - cumulative_cost, axis=1
+        )
+        rows = new_rows
+    return rows
+
+
+class AnytimeClassifier(object):
+    """
+    Open-ended DTW of the frames recorded so far against every reference:
+    the distance to a reference is the one of the best alignment of the recording
+    with a prefix of the reference.
+
+    The recording is decided when the closest reference has been aligned up to its end
+    (min_progress of its frames) and the closest sign leads the second closest one
+    by margin (relative difference of their distances).
+
+    Params
+        reference_index: ReferenceIndex of the reference signs
+        margin: minimum relative lead of the closest sign, in (0, 1)
+        min_progress: minimum fraction of the closest reference aligned with the recording
+    Args
+        n_frames: number of frames of each hand added so far
+    """
+
+    def __init__(self, reference_index: ReferenceIndex, margin: float, min_progress=0.9):
+        self.reference_index = reference_index
+        self.margin = margin
+        self.min_progress = min_progress
+        self.reset()
+
+    def reset(self):
+        """Start a new recording"""
+        self.n_frames = {"lh": 0, "rh": 0}
+        # Rows of each bucket: {(partition key, hand): list of rows}
+        self._rows = {}
+        for key, partition in self.reference_index.partitions.items():
+            for hand in partition.hands:
+                self._rows[(key, hand)] = []
+                for _, bucket, _ in get_buckets(partition, hand):
+                    rows = np.full((len(bucket), bucket.shape[1] + 1), np.inf)
+                    rows[:, 0] = 0
+                    self._rows[(key, hand)].append(rows)
+
+    def update(self, lh_embedding: np.ndarray, rh_embedding: np.ndarray):
+        """
+        Add new frames of the recording
+
+        :param xh_embedding: array of shape (n_frames, nb_connections * nb_connections),
+                             embedding of the x hand in the new frames where it is detected
+        """
+        embeddings = {"lh": lh_embedding, "rh": rh_embedding}
+        for (key, hand), hand_rows in self._rows.items():
+            if len(embeddings[hand]) == 0:
+                continue
+            partition = self.reference_index.partitions[key]
+            buckets = get_buckets(partition, hand)
+            bucket_weights = get_bucket_weights(partition, hand) or [None] * len(buckets)
+            for idx, ((_, bucket, _), weights) in enumerate(zip(buckets, bucket_weights)):
+                hand_rows[idx] = _advance_rows(
+                    embeddings[hand], bucket, hand_rows[idx], weights
+                )
+
+        for hand, embedding in embeddings.items():
+            self.n_frames[hand] += len(embedding)
+
+    def decide(self) -> Optional[str]:
+        """
+        :return: the name of the closest sign if the decision can be taken now, else None
+        """
+        key = (self.n_frames["lh"] > 0, self.n_frames["rh"] > 0)
+        partition = self.reference_index.partitions.get(key)
+        if partition is None or not partition.hands:
+            return None
+
+        distances = np.zeros(len(partition))
+        progress = np.ones(len(partition))
+        for hand in partition.hands:
+            buckets = get_buckets(partition, hand)
+            for (positions, bucket, lengths), rows in zip(buckets, self._rows[(key, hand)]):
+                # Open end: best alignment with any prefix of the reference (padding excluded)
+                rows = np.where(np.arange(bucket.shape[1]) < lengths[:, None], rows[:, 1:], np.inf)
+                distances[positions] += rows.min(axis=1)
+                progress[positions] = np.minimum(
+                    progress[positions], (rows.argmin(axis=1) + 1) / lengths
+                )
+
+        labels = self.reference_index.labels[partition.ids]
+        closest = int(np.argmin(distances))
+        if progress[closest] < self.min_progress:
+            return None
+
+        # Distance of the second closest sign
+        others = distances[labels != labels[closest]]
+        if len(others) and distances[closest] > (1 - self.margin) * others.min():
+            return None
+        return str(self.reference_index.sign_names[labels[closest]])
@@ -0,0 +1,108 @@
+"""
+Temporal compression of the signs before DTW: the idle frames at the start and the end
+(still hands) are trimmed, then the runs of near-identical consecutive frames are merged
+into weighted segments, the weight of a segment being its number of frames.
+
+Average length reduction of the reference signs:
+python -m utils.compression [--motion-threshold T] [--merge-tolerance T]
+"""
+import argparse
+from typing import List, NamedTuple
+
+import numpy as np
+
+
+class Compression(NamedTuple):
+    """
+    Parameters of the temporal compression
+
+    motion_threshold: minimum motion energy of an active frame: mean displacement of
+                      the keypoints of the hands since the previous frame
+                      (in normalized image coordinates)
+    merge_tolerance: maximum mean absolute difference of the embeddings between
+                     the frames of a segment and its first frame (in radians for the angles)
+    """
+
+    motion_threshold: float = 0.005
+    merge_tolerance: float = 0.02
+
+
+def get_motion_energy(hand_arrays: List[np.ndarray]) -> np.ndarray:
+    """
+    :param hand_arrays: array of shape (n_frames, 21 * 3) of each hand,
+                        null in the frames where the hand is not detected
+    :return: array of size n_frames, motion energy of each frame (0 for the first one)
+    """
+    n_frames = len(hand_arrays[0])
+    energy = np.zeros(n_frames)
+    for hand_array in hand_arrays:
+        keypoints = np.asarray(hand_array, dtype=float).reshape((n_frames, 21, 3))
+        is_detected = keypoints.reshape((n_frames, -1)).sum(axis=1) != 0
+
+        # Only the displacements between two frames where the hand is detected
+        displacements = np.linalg.norm(np.diff(keypoints, axis=0), axis=2).mean(axis=1)
+        energy[1:] += np.where(is_detected[1:] & is_detected[:-1], displacements, 0)
+    return energy
+
+
+def get_active_frames(hand_arrays: List[np.ndarray], motion_threshold: float) -> slice:
+    """
+    Frames of the sign once the idle lead-in and lead-out frames are trimmed
+
+    :param hand_arrays: see get_motion_energy
+    :return: slice of the active frames (all the frames if none moves enough)
+    """
+    active = np.flatnonzero(get_motion_energy(hand_arrays) >= motion_threshold)
+    if len(active) == 0:
+        return slice(0, len(hand_arrays[0]))
+    # The frame before the first move is where the motion starts from
+    return slice(max(active[0] - 1, 0), active[-1] + 1)
+
+
+def merge_similar_frames(embedding: np.ndarray, merge_tolerance: float):
+    """
+    Merge the runs of near-identical consecutive frames into segments
+
+    :param embedding: array of shape (n_frames, d)
+    :return: array of shape (n_segments, d), mean frame of each segment,
+             and array of size n_segments, number of frames of each segment
+    """
+    if len(embedding) == 0:
+        return embedding, np.ones(0)
+
+    # A segment ends when a frame moves away from the first frame of the segment
+    starts = [0]
+    for idx in range(1, len(embedding)):
+        if np.abs(embedding[idx] - embedding[starts[-1]]).mean() > merge_tolerance:
+            starts.append(idx)
+
+    weights = np.diff(np.append(starts, len(embedding)))
+    merged = np.add.reduceat(embedding, starts, axis=0) / weights[:, None]
+    return merged, weights.astype(float)
+
+
+if __name__ == "__main__":
+    from models.sign_model import SignModel
+    from utils.dataset_utils import load_dataset, load_sign_landmarks
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--motion-threshold", type=float, default=Compression().motion_threshold)
+    parser.add_argument("--merge-tolerance", type=float, default=Compression().merge_tolerance)
+    args = parser.parse_args()
+    compression = Compression(args.motion_threshold, args.merge_tolerance)
+
+    lengths = {}
+    for video_name in load_dataset():
+        left_hand_list, right_hand_list = load_sign_landmarks(video_name)
+        before = SignModel(left_hand_list, right_hand_list, joint=True)
+        after = SignModel(left_hand_list, right_hand_list, compression, joint=True)
+        lengths.setdefault(video_name.split("-")[0], []).append(
+            (len(before.joint_embedding), len(after.joint_embedding))
+        )
+
+    for sign_name, sign_lengths in sorted(lengths.items()):
+        before, after = np.mean(sign_lengths, axis=0)
+        print(
+            f"{sign_name:>15}: {before:6.1f} -> {after:6.1f} frames"
+            f"  (-{100 * (1 - after / before):.0f}%)"
+        )
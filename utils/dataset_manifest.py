@@ -0,0 +1,146 @@
+"""
+Manifest of the dataset: for each video whose landmarks were extracted, the size,
+modification time and content hash of the video and the parameters of the extraction.
+A video is only hashed again when its size or modification time changes, and its
+landmarks are extracted again when its content or the extraction parameters change.
+"""
+import hashlib
+import os
+import pickle as pkl
+from typing import Dict, List, NamedTuple
+
+from utils.landmark_store import get_landmark_path
+from utils.landmark_utils import atomic_write, save_array
+
+
+MANIFEST_PATH = os.path.join("data", "dataset", "manifest.pickle")
+VIDEOS_PATH = os.path.join("data", "videos")
+
+
+class VideoEntry(NamedTuple):
+    """
+    Video of the dataset whose landmarks were extracted
+
+    size: size of the video, in bytes
+    mtime_ns: modification time of the video
+    hash: hash of the content of the video
+    params: parameters of the extraction of the landmarks
+    """
+
+    size: int
+    mtime_ns: int
+    hash: str
+    params: dict
+
+
+def hash_video(path: str, chunk_size=1 << 20) -> str:
+    """Hash of the content of a video, read by chunks"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_videos(videos_path=VIDEOS_PATH) -> Dict[str, os.stat_result]:
+    """
+    :return: {video name: stat of the video} of the videos of the folders of the signs,
+             listed with os.scandir, whose entries carry the stat of the files
+    """
+    if not os.path.isdir(videos_path):
+        return {}
+    videos = {}
+    with os.scandir(videos_path) as sign_entries:
+        for sign_entry in sign_entries:
+            if not sign_entry.is_dir():
+                continue
+            with os.scandir(sign_entry.path) as video_entries:
+                for video_entry in video_entries:
+                    if video_entry.is_file() and video_entry.name.endswith(".mp4"):
+                        videos[video_entry.name[: -len(".mp4")]] = video_entry.stat()
+    return videos
+
+
+def get_video_path(video_name: str, videos_path=VIDEOS_PATH) -> str:
+    sign_name = video_name.split("-")[0]
+    return os.path.join(videos_path, sign_name, video_name + ".mp4")
+
+
+class DatasetManifest(object):
+    """
+    Params
+        path: path of the manifest file, created on the first save
+    Args
+        entries: {video name: VideoEntry}
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                self.entries = {
+                    video_name: VideoEntry(**entry) for video_name, entry in pkl.load(file).items()
+                }
+        self._is_modified = False
+        # {(path, size, modification time): hash} of the videos hashed, a source video
+        # being shared by several videos of the dataset (see utils.source_dataset)
+        self._hashes = {}
+
+    def _hash_video(self, path: str, stat: os.stat_result) -> str:
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        if key not in self._hashes:
+            self._hashes[key] = hash_video(path)
+        return self._hashes[key]
+
+    def check(
+        self, video_name: str, stat: os.stat_result, params: dict, path: str = None
+    ) -> bool:
+        """
+        Whether the landmarks of the video are on disk and up to date. The video is only
+        hashed if its size or modification time changed; if its content did not change,
+        its entry is updated with the new ones.
+
+        :param path: path of the video the landmarks are extracted from,
+                     by default the one of data/videos
+        """
+        entry = self.entries.get(video_name)
+        if entry is None or entry.params != params:
+            return False
+        if not os.path.exists(get_landmark_path(video_name)):
+            return False
+        if (entry.size, entry.mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+            return True
+
+        # Copied or touched video: same content, new modification time
+        if self._hash_video(path or get_video_path(video_name), stat) != entry.hash:
+            return False
+        self.entries[video_name] = entry._replace(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        self._is_modified = True
+        return True
+
+    def add(self, video_name: str, stat: os.stat_result, params: dict, path: str = None):
+        """Record the video whose landmarks were just extracted with params (see check)"""
+        self.entries[video_name] = VideoEntry(
+            stat.st_size,
+            stat.st_mtime_ns,
+            self._hash_video(path or get_video_path(video_name), stat),
+            params,
+        )
+        self._is_modified = True
+
+    def remove(self, video_names: List[str]):
+        for video_name in video_names:
+            del self.entries[video_name]
+        self._is_modified = self._is_modified or len(video_names) > 0
+
+    def save(self):
+        """Write the manifest file if it changed"""
+        if not self._is_modified:
+            return
+        with atomic_write(self.path) as temporary_path:
+            save_array(
+                {video_name: entry._asdict() for video_name, entry in self.entries.items()},
+                temporary_path,
+            )
+        self._is_modified = False
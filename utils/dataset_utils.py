@@ -1,53 +1,198 @@
 import os
+import time
 
-import pandas as pd
 from tqdm import tqdm
 
+from models.hand_model import DEFAULT_EMBEDDING
+from models.reference_index import ReferenceIndex
 from models.sign_model import SignModel
-from utils.landmark_utils import save_landmarks_from_video, load_array
+from utils.compression import Compression
+from utils.dataset_manifest import MANIFEST_PATH, DatasetManifest, scan_videos
+from utils.embedding_cache import EMBEDDING_CACHE_PATH, EmbeddingCache, get_tag
+from utils.index_snapshot import SNAPSHOT_PATH, get_source_stamp, load_snapshot
+from utils.projection import Projection
+from utils.landmark_backend import DEFAULT_BACKEND
+from utils.landmark_store import (
+    DATASET_PATH,
+    get_hand_arrays,
+    get_landmark_path,
+    load_landmarks,
+    migrate_video,
+)
+from utils.landmark_utils import extract_landmarks_from_videos, get_extraction_params
 
 
-def load_dataset():
-    videos = [
-        file_name.replace(".mp4", "")
-        for root, dirs, files in os.walk(os.path.join("data", "videos"))
-        for file_name in files
-        if file_name.endswith(".mp4")
+def load_dataset(
+    with_pose=False, n_workers=None, frame_step=1, scale=1.0, backend=DEFAULT_BACKEND
+):
+    """
+    Extract the landmarks of the new videos of data/videos, and of the videos
+    that changed since their extraction (see utils.dataset_manifest); the landmarks
+    of the videos removed are deleted. The videos extracted from the ranges of source
+    videos (see utils.source_dataset) are kept.
+
+    :param with_pose: whether the pose landmarks are stored too
+    :param n_workers: number of processes extracting the landmarks (by default, one per CPU
+                      up to MAX_DEFAULT_WORKERS, see utils.landmark_utils)
+    :param frame_step: only every frame_step-th frame of the videos is processed
+    :param scale: factor of the resolution of the frames given to the landmark backend
+    :param backend: name of the landmark backend (see utils.landmark_backend)
+    :return: the names of the videos of the dataset
+    """
+    os.makedirs(DATASET_PATH, exist_ok=True)
+    params = get_extraction_params(with_pose, frame_step, scale, backend)
+    manifest = DatasetManifest()
+    videos = scan_videos()
+
+    if not os.path.exists(manifest.path):
+        _adopt_dataset(manifest, videos, params)
+
+    # Landmarks of the videos removed
+    orphans = [
+        video_name
+        for video_name, entry in manifest.entries.items()
+        if video_name not in videos and "source" not in entry.params
+    ]
+    for video_name in orphans:
+        if os.path.exists(get_landmark_path(video_name)):
+            os.remove(get_landmark_path(video_name))
+    manifest.remove(orphans)
+
+    # Create the dataset from the new and modified reference videos
+    videos_to_extract = [
+        video_name
+        for video_name, stat in videos.items()
+        if not manifest.check(video_name, stat, params)
+    ]
+    n = len(videos_to_extract)
+    if n > 0:
+        print(f"\nExtracting landmarks from new videos: {n} videos detected\n")
+
+        start, n_frames = time.perf_counter(), 0
+        with tqdm(total=n, unit="video") as progress:
+            for video_name, video_frames in extract_landmarks_from_videos(
+                videos_to_extract, with_pose, n_workers, frame_step, scale, backend
+            ):
+                manifest.add(video_name, videos[video_name], params)
+                # Saved after each video, so that an interrupted extraction resumes from there
+                manifest.save()
+                n_frames += video_frames
+                progress.set_postfix(fps=f"{n_frames / (time.perf_counter() - start):.1f}")
+                progress.update()
+    manifest.save()
+
+    return list(videos) + [
+        video_name
+        for video_name, entry in manifest.entries.items()
+        if video_name not in videos
+        and "source" in entry.params
+        and os.path.exists(get_landmark_path(video_name))
     ]
-    dataset = [
-        file_name.replace(".pickle", "").replace("pose_", "")
-        for root, dirs, files in os.walk(os.path.join("data", "dataset"))
+
+
+def _adopt_dataset(manifest: DatasetManifest, videos, params: dict):
+    """
+    Record in a new manifest the videos whose landmarks were extracted before
+    the manifest existed, converting the ones still stored in pickles. The pickles are
+    kept: python -m utils.landmark_store removes them once converted.
+    """
+    legacy = [
+        (root, file_name.replace(".pickle", "").replace("pose_", ""))
+        for root, dirs, files in os.walk(DATASET_PATH)
         for file_name in files
         if file_name.endswith(".pickle") and file_name.startswith("pose_")
     ]
+    legacy = [
+        (data_path, video_name)
+        for data_path, video_name in legacy
+        if not os.path.exists(get_landmark_path(video_name))
+    ]
+    if legacy:
+        print(f"\nConverting the landmarks of {len(legacy)} videos\n")
+        for data_path, video_name in legacy:
+            migrate_video(data_path, video_name, keep=True)
+        print("The pickles are kept, remove them with: python -m utils.landmark_store")
 
-    # Create the dataset from the reference videos
-    videos_not_in_dataset = list(set(videos).difference(set(dataset)))
-    n = len(videos_not_in_dataset)
-    if n > 0:
-        print(f"\nExtracting landmarks from new videos: {n} videos detected\n")
+    for video_name, stat in videos.items():
+        if os.path.exists(get_landmark_path(video_name)):
+            manifest.add(video_name, stat, params)
 
-        for idx in tqdm(range(n)):
-            save_landmarks_from_video(videos_not_in_dataset[idx])
 
-    return videos
+def load_sign_landmarks(video_name):
+    """
+    :return: the landmarks of the left and right hands of a video of the dataset,
+             arrays of shape (n_frames, 21 * 3)
+    """
+    return get_hand_arrays(load_landmarks(get_landmark_path(video_name)))
 
 
-def load_reference_signs(videos):
-    reference_signs = {"name": [], "sign_model": [], "distance": []}
+def get_reference_stamp(
+    videos,
+    compression: Compression = None,
+    projection: Projection = None,
+    embedding: str = DEFAULT_EMBEDDING,
+    joint: bool = False,
+) -> str:
+    """
+    :return: stamp of the sources of the reference signs (see utils.index_snapshot)
+    """
+    landmark_paths = [get_landmark_path(video_name) for video_name in videos]
+    return get_source_stamp(landmark_paths, get_tag(compression, embedding, joint), projection)
+
+
+def load_reference_signs(
+    videos,
+    compression: Compression = None,
+    projection: Projection = None,
+    embedding: str = DEFAULT_EMBEDDING,
+    joint: bool = False,
+    cache_path=EMBEDDING_CACHE_PATH,
+    snapshot_path=SNAPSHOT_PATH,
+) -> ReferenceIndex:
+    """
+    :param compression: temporal compression of the signs (see utils.compression),
+                        None to keep every frame
+    :param projection: projection of the embeddings (see utils.projection), None to keep
+                       the full embeddings
+    :param embedding: name of the embedding of the hands (see models.hand_model.EMBEDDINGS)
+    :param joint: whether the joint embeddings of the two-handed signs are built,
+                  for the joint DTW (SignRecorder(..., joint_dtw=True))
+    :param cache_path: folder of the cache of the embeddings (see utils.embedding_cache),
+                       None to compute them all
+    :param snapshot_path: path of the snapshot of the reference index, loaded instead of
+                          the signs if it is up to date (see utils.index_snapshot),
+                          None to ignore it
+    """
+    if snapshot_path is not None and os.path.exists(snapshot_path):
+        reference_signs = load_snapshot(
+            snapshot_path, get_reference_stamp(videos, compression, projection, embedding, joint)
+        )
+        if reference_signs is not None:
+            print(f"Dictionary count: {dict(sorted(reference_signs.count_by_name().items()))}")
+            return reference_signs
+        print("Reference index snapshot is out of date, run: python -m utils.index_snapshot")
+
+    cache = None
+    if cache_path is not None:
+        manifest = DatasetManifest() if os.path.exists(MANIFEST_PATH) else None
+        cache = EmbeddingCache(compression, embedding, joint, manifest, cache_path)
+    names, sign_models = [], []
     for video_name in videos:
-        sign_name = video_name.split("-")[0]
-        path = os.path.join("data", "dataset", sign_name, video_name)
-
-        left_hand_list = load_array(os.path.join(path, f"lh_{video_name}.pickle"))
-        right_hand_list = load_array(os.path.join(path, f"rh_{video_name}.pickle"))
-
-        reference_signs["name"].append(sign_name)
-        reference_signs["sign_model"].append(SignModel(left_hand_list, right_hand_list))
-        reference_signs["distance"].append(0)
-    
-    reference_signs = pd.DataFrame(reference_signs, dtype=object)
-    print(
-        f'Dictionary count: {reference_signs[["name", "sign_model"]].groupby(["name"]).count()}'
-    )
+        names.append(video_name.split("-")[0])
+        if cache is None:
+            left_hand_list, right_hand_list = load_sign_landmarks(video_name)
+            sign_model = SignModel(
+                left_hand_list, right_hand_list, compression, embedding, joint
+            )
+        else:
+            sign_model = cache.get_sign_model(video_name, get_landmark_path(video_name))
+        if projection is not None:
+            projection.apply(sign_model)
+        sign_models.append(sign_model)
+
+    if cache is not None:
+        cache.save()
+
+    reference_signs = ReferenceIndex.from_sign_models(names, sign_models)
+    print(f"Dictionary count: {dict(sorted(reference_signs.count_by_name().items()))}")
     return reference_signs
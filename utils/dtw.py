@@ -1,41 +1,770 @@
-import pandas as pd
+import heapq
+from typing import Dict, NamedTuple, Tuple
+
 from fastdtw import fastdtw
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.spatial.distance import cdist
+
+from models.reference_index import ReferenceIndex, ReferencePartition
 from models.sign_model import SignModel
+from utils.shortlist import get_shortlist
+
+
+def _get_band_radius(n: int, m: int, window=None):
+    """
+    Half-width of the Sakoe-Chiba band of a (n x m) DTW matrix
+
+    :param n: length of the first sequence
+    :param m: length of the second sequence
+    :param window: None for no constraint,
+                   int for a fixed half-width in frames,
+                   float in (0, 1] for a half-width relative to the longest sequence
+    :return: the half-width in columns, None if the band covers the whole matrix
+    """
+    if window is None or n == 1:
+        return None
+
+    radius = window * max(n, m) if isinstance(window, float) else window
+
+    # The band must be wide enough for the rows to stay connected when the lengths differ
+    slope = (m - 1) / (n - 1)
+    return max(radius, (slope + 1) / 2)
+
+
+def _get_diagonal(n: int, m: int) -> np.ndarray:
+    """Column of the diagonal of a (n x m) DTW matrix for each row"""
+    slope = (m - 1) / (n - 1) if n > 1 else 0
+    return np.arange(n) * slope
+
+
+def _get_band(n: int, m: int, window=None):
+    """
+    Compute the Sakoe-Chiba band of a (n x m) DTW matrix
+
+    :param window: see _get_band_radius
+    :return: Two int arrays of size n, first and last column of the band for each row
+    """
+    radius = _get_band_radius(n, m, window)
+    if radius is None:
+        return np.zeros(n, dtype=int), np.full(n, m - 1, dtype=int)
+
+    # The band follows the diagonal of the matrix
+    centers = _get_diagonal(n, m)
+    lower = np.clip(np.ceil(centers - radius), 0, m - 1).astype(int)
+    upper = np.clip(np.floor(centers + radius), 0, m - 1).astype(int)
+    return lower, upper
+
+
+# Maximum number of cells of the costs computed at once by dtw_distance_batch
+COST_BLOCK_SIZE = 1 << 18
+
+
+def _get_costs(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    L1 distances between the frames of x (n, d) and the frames of y (m, d), computed
+    by scipy without temporary arrays: array of shape (n, m), the same for each pair
+    of frames whatever the other frames
+    """
+    return cdist(x, y, "cityblock")
+
+
+def dtw_distance(
+    x: np.ndarray,
+    y: np.ndarray,
+    window=None,
+    max_distance: float = np.inf,
+    x_weights: np.ndarray = None,
+    y_weights: np.ndarray = None,
+) -> float:
+    """
+    Exact DTW distance between two sequences, without computing the warping path.
+    The cost between two frames is the L1 distance (the one used by fastdtw).
+    Only two rows of the DTW matrix are kept in memory.
+
+    :param x: array of shape (n, d)
+    :param y: array of shape (m, d)
+    :param window: Sakoe-Chiba band (see _get_band_radius)
+    :param max_distance: the computation is abandoned (and inf is returned)
+                         as soon as the distance is known to exceed it
+    :param x_weights, y_weights: number of frames merged in each frame of the sequences
+                                 (see utils.compression), None if not compressed:
+                                 the cost between two frames is multiplied by
+                                 the largest of their weights
+    :return: the DTW distance
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n, m = len(x), len(y)
+    if n == 0 or m == 0:
+        return np.inf
+
+    lower, upper = _get_band(n, m, window)
+
+    # Rows of the DTW matrix, shifted by one: index 0 stands for column -1
+    previous_row = np.full(m + 1, np.inf)
+    previous_row[0] = 0
+    for i in range(n):
+        lo, hi = lower[i], upper[i] + 1
+        cost = _get_costs(x[i : i + 1], y[lo:hi])[0]
+        if x_weights is not None or y_weights is not None:
+            cost *= _get_cost_weights(x_weights, y_weights, i, lo, hi)
+
+        # Best of the diagonal and vertical moves
+        best = cost + np.minimum(previous_row[lo:hi], previous_row[lo + 1 : hi + 1])
+
+        # Horizontal moves: row[j] = min_k<=j (best[k] + cost[k+1] + ... + cost[j])
+        cumulative_cost = np.cumsum(cost)
+        row = np.full(m + 1, np.inf)
+        row[lo + 1 : hi + 1] = cumulative_cost + np.minimum.accumulate(
+            best - cumulative_cost
+        )
+        previous_row = row
+
+        # Every warping path goes through each row
+        if row[lo + 1 : hi + 1].min() > max_distance:
+            return np.inf
+
+    return previous_row[m] if previous_row[m] <= max_distance else np.inf
+
+
+def dtw_distance_batch(
+    x: np.ndarray,
+    ys: np.ndarray,
+    window=None,
+    x_weights: np.ndarray = None,
+    ys_weights: np.ndarray = None,
+    lengths: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Exact DTW distances between a sequence and several sequences padded to the same length.
+    The DTW matrices of all the sequences are advanced together, one row of x at a time,
+    with the same operations as dtw_distance (so the distances are identical): the cells
+    outside of the band of each sequence, padding included, are masked.
+
+    :param x: array of shape (n, d)
+    :param ys: array of shape (n_sequences, m, d)
+    :param window: Sakoe-Chiba band (see _get_band_radius)
+    :param x_weights: array of size n, see dtw_distance
+    :param ys_weights: array of shape (n_sequences, m), see dtw_distance
+    :param lengths: int array of size n_sequences, lengths of the sequences before padding,
+                    None if none of them is padded
+    :return: array of size n_sequences containing the DTW distances
+    """
+    x = np.asarray(x, dtype=float)
+    n, (n_sequences, m, d) = len(x), ys.shape
+    if lengths is None:
+        lengths = np.full(n_sequences, m)
+    if n == 0 or m == 0:
+        return np.full(n_sequences, np.inf)
 
+    # Band of each sequence, empty for the empty sequences
+    lower = np.zeros((n_sequences, n), dtype=int)
+    upper = np.full((n_sequences, n), -1)
+    for length in np.unique(lengths[lengths > 0]):
+        lower[lengths == length], upper[lengths == length] = _get_band(n, length, window)
+    # The bands of sequences of different lengths differ
+    is_masked = np.any(lengths != m)
+
+    # The costs of a block of rows are computed at once, in the union of their bands
+    block_size = max(COST_BLOCK_SIZE // (n_sequences * m), 1)
+
+    # Rows of the DTW matrices, shifted by one: index 0 stands for column -1
+    previous_rows = np.full((n_sequences, m + 1), np.inf)
+    previous_rows[:, 0] = 0
+    for i in range(n):
+        if i % block_size == 0:
+            block_lo = lower[:, i : i + block_size].min()
+            block_hi = max(upper[:, i : i + block_size].max() + 1, 1)
+            costs = _get_costs(
+                x[i : i + block_size], ys[:, block_lo:block_hi].reshape(-1, d)
+            ).reshape(-1, n_sequences, block_hi - block_lo)
+
+        # Columns of the union of the bands of the row
+        lo, hi = lower[:, i].min(), max(upper[:, i].max() + 1, 1)
+        cost = costs[i % block_size, :, lo - block_lo : hi - block_lo]
+        if x_weights is not None or ys_weights is not None:
+            cost *= _get_cost_weights(x_weights, ys_weights, i, lo, hi)
+
+        best = cost + np.minimum(previous_rows[:, lo:hi], previous_rows[:, lo + 1 : hi + 1])
+        if is_masked:
+            columns = np.arange(lo, hi)
+            outside = (columns < lower[:, i, None]) | (columns > upper[:, i, None])
+            # No path enters a cell outside of the band, and the null costs before the band
+            # leave the cumulative costs of the band unchanged
+            best[outside] = np.inf
+            cost[outside] = 0
+
+        cumulative_cost = np.cumsum(cost, axis=1)
+        rows = np.full((n_sequences, m + 1), np.inf)
+        rows[:, lo + 1 : hi + 1] = cumulative_cost + np.minimum.accumulate(
+            best - cumulative_cost, axis=1
+        )
+        if is_masked:
+            rows[:, lo + 1 : hi + 1][outside] = np.inf
+        previous_rows = rows
+
+    distances = previous_rows[np.arange(n_sequences), lengths]
+    distances[lengths == 0] = np.inf
+    return distances
+
+
+def _get_cost_weights(x_weights, y_weights, i: int, lo: int, hi: int):
+    """
+    Weights of the costs between the frame i of x and the frames [lo, hi) of y (or of ys):
+    the largest weight of the two frames
+    """
+    x_weight = 1 if x_weights is None else x_weights[i]
+    if y_weights is None:
+        return x_weight
+    return np.maximum(y_weights[..., lo:hi], x_weight)
+
+
+def dtw_path(x: np.ndarray, y: np.ndarray, window=None):
+    """
+    Optimal warping path between two sequences (same cost and band as dtw_distance).
+    The whole DTW matrix is kept in memory: meant for offline use.
+
+    :param x: array of shape (n, d)
+    :param y: array of shape (m, d)
+    :param window: Sakoe-Chiba band (see _get_band_radius)
+    :return: the DTW distance and the list of the (i, j) cells of the path
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n, m = len(x), len(y)
+    lower, upper = _get_band(n, m, window)
+
+    # DTW matrix, shifted by one: row and column 0 stand for index -1
+    matrix = np.full((n + 1, m + 1), np.inf)
+    matrix[0, 0] = 0
+    for i in range(n):
+        lo, hi = lower[i], upper[i] + 1
+        cost = _get_costs(x[i : i + 1], y[lo:hi])[0]
+        best = cost + np.minimum(matrix[i, lo:hi], matrix[i, lo + 1 : hi + 1])
+        cumulative_cost = np.cumsum(cost)
+        matrix[i + 1, lo + 1 : hi + 1] = cumulative_cost + np.minimum.accumulate(
+            best - cumulative_cost
+        )
+
+    # Backtracking from the last cell
+    path = [(n - 1, m - 1)]
+    i, j = n, m
+    while (i, j) != (1, 1):
+        moves = [(i - 1, j - 1), (i - 1, j), (i, j - 1)]
+        i, j = min(moves, key=lambda move: matrix[move])
+        path.append((i - 1, j - 1))
+    return matrix[n, m], path[::-1]
+
+
+def _fastdtw_distance(
+    x: np.ndarray,
+    y: np.ndarray,
+    window=None,
+    max_distance: float = np.inf,
+    x_weights: np.ndarray = None,
+    y_weights: np.ndarray = None,
+) -> float:
+    """
+    Approximate DTW distance computed by fastdtw
+    (window, max_distance and the weights are not supported)
+    """
+    return fastdtw(x, y)[0]
+
+
+# Functions computing the distance between two embeddings:
+# f(x, y, window, max_distance, x_weights, y_weights) -> float,
+# never lower than the exact DTW distance (except fastdtw with weights)
+DTW_ENGINES = {"dtw": dtw_distance, "fastdtw": _fastdtw_distance}
+
+
+def lb_kim(x: np.ndarray, first_frames: np.ndarray, last_frames: np.ndarray, lengths):
+    """
+    LB_Kim lower bound of the DTW distances between x and several sequences:
+    cost of the first and last cells, which every warping path goes through
+
+    :param x: array of shape (n, d)
+    :param first_frames: array of shape (n_sequences, d), first frame of each sequence
+    :param last_frames: array of shape (n_sequences, d), last frame of each sequence
+    :param lengths: length of each sequence
+    :return: array of size n_sequences
+    """
+    bounds = np.abs(first_frames - x[0]).sum(axis=1)
+    last_costs = np.abs(last_frames - x[-1]).sum(axis=1)
+    # The first and last cells are the same one when both sequences have a single frame
+    return bounds + np.where((np.asarray(lengths) > 1) | (len(x) > 1), last_costs, 0)
+
+
+def _get_envelope_radius(n: int, m: int, window=None) -> int:
+    """
+    Radius (in frames of the second sequence) of an envelope containing
+    the band of each row around the nearest frame of the diagonal
+    """
+    radius = _get_band_radius(n, m, window)
+    if radius is None:
+        return m
+    return min(int(np.ceil(radius + 0.5)), m)
+
+
+def get_envelope(y: np.ndarray, radius: int):
+    """
+    :param y: array of shape (m, d)
+    :param radius: half-width of the envelope in frames
+    :return: Two arrays of shape (m, d), min & max of y over the frames [j - radius, j + radius]
+    """
+    y = np.asarray(y, dtype=float)
+    radius = min(radius, len(y) - 1)
+    if radius == len(y) - 1:
+        # Every window covers the whole sequence (unbounded band): global min & max
+        return (
+            np.repeat(y.min(axis=0, keepdims=True), len(y), axis=0),
+            np.repeat(y.max(axis=0, keepdims=True), len(y), axis=0),
+        )
+    padded = np.pad(y, ((radius, radius), (0, 0)), mode="edge")
+    windows = sliding_window_view(padded, 2 * radius + 1, axis=0)
+    return windows.min(axis=2), windows.max(axis=2)
+
+
+def lb_keogh(x: np.ndarray, envelope) -> float:
+    """
+    LB_Keogh lower bound of the DTW distance: L1 distance of each frame of x
+    to the envelope of the second sequence over the band of its row
 
-def dtw_distances(recorded_sign: SignModel, reference_signs: pd.DataFrame):
+    :param x: array of shape (n, d)
+    :param envelope: envelope of the second sequence (see get_envelope),
+                     with a radius given by _get_envelope_radius
+    """
+    lower, upper = envelope
+    centers = np.rint(_get_diagonal(len(x), len(lower))).astype(int)
+    lower, upper = lower[centers], upper[centers]
+    return (np.maximum(x - upper, 0) + np.maximum(lower - x, 0)).sum()
+
+
+def _compute_envelopes(partition: ReferencePartition, hand: str, query_len: int, window=None):
+    """
+    Envelopes of the references of a partition for queries of query_len frames,
+    stored in one block with the layout of the embeddings
+
+    :return: radius of the envelope of each reference, lower and upper envelope blocks
+    """
+    lengths = partition.get_lengths(hand)
+    radii = np.array([_get_envelope_radius(query_len, m, window) for m in lengths])
+    lower = np.empty_like(partition.blocks[hand])
+    upper = np.empty_like(partition.blocks[hand])
+    for position, radius in enumerate(radii):
+        start, end = partition.offsets[hand][position : position + 2]
+        lower[start:end], upper[start:end] = get_envelope(
+            partition.get_embedding(hand, position), radius
+        )
+    return radii, lower, upper
+
+
+def precompute_envelopes(reference_index: ReferenceIndex, query_len: int, window=None):
+    """
+    Compute the LB_Keogh envelopes of the reference signs for queries of query_len frames,
+    so that they are not computed during the first search. The envelopes already there
+    (e.g. mapped from a snapshot, see utils.index_snapshot) are kept if they are wide
+    enough for these queries.
+    """
+    for partition in reference_index.partitions.values():
+        for part in (partition, partition.joint):
+            if part is None:
+                continue
+            for hand in part.hands:
+                if (hand, window) in part.envelopes:
+                    radii = part.envelopes[(hand, window)][0]
+                    required_radii = [
+                        _get_envelope_radius(query_len, m, window) for m in part.get_lengths(hand)
+                    ]
+                    if np.all(radii >= required_radii):
+                        continue
+                part.envelopes[(hand, window)] = _compute_envelopes(
+                    part, hand, query_len, window
+                )
+
+
+class SearchResult(NamedTuple):
+    """
+    Nearest reference signs of a recorded sign, sorted by increasing distance
+
+    ids: positions of the references in the ReferenceIndex
+    names: names of the signs of the references
+    distances: DTW distances between the recorded sign and the references
+    pruning: number of references pruned by each stage of the search
+    """
+
+    ids: np.ndarray
+    names: Tuple[str, ...]
+    distances: np.ndarray
+    pruning: Dict[str, int]
+
+
+def dtw_distances(
+    recorded_sign: SignModel,
+    reference_index: ReferenceIndex,
+    engine: str = "dtw",
+    window=None,
+    k: int = None,
+    labels: np.ndarray = None,
+    joint: bool = False,
+    shortlist: int = None,
+    shortlist_metric: str = "euclidean",
+) -> SearchResult:
     """
     Use DTW to compute similarity between the recorded sign & the reference signs
 
+    Only the references with the same hands than the recorded sign are compared,
+    through a cascade: LB_Kim, then LB_Keogh, then a DTW abandoned when it exceeds
+    the current k-th best distance.
+
     :param recorded_sign: a SignModel object containing the data gathered during record
-    :param reference_signs: pd.DataFrame
-                            columns : name, dtype: str
-                                      sign_model, dtype: SignModel
-                                      distance, dtype: float64
-    :return: Return a sign dictionary sorted by the distances from the recorded sign
+    :param reference_index: ReferenceIndex of the reference signs
+    :param engine: name of the DTW implementation, "dtw" (exact, banded), "fastdtw",
+                   or "batch" (exact, banded, every reference of a length bucket at once;
+                   all the references are compared, without the cascade)
+    :param window: Sakoe-Chiba band of the "dtw" and "batch" engines
+                   (None, width in frames or fraction of the sequence lengths)
+    :param k: number of nearest references to search, None for all of them
+    :param labels: labels (see ReferenceIndex) of the signs to compare, None for all of them
+    :param joint: for two-handed signs, align both hands in a single DTW over
+                  their joint embedding (see SignModel), instead of one DTW per hand
+    :param shortlist: number of references kept by a first stage comparing the signs
+                      resampled to a fixed length (see utils.shortlist), None to skip it
+    :param shortlist_metric: distance of the shortlist, "euclidean" or "cosine"
+                             (see utils.shortlist.get_shortlist)
+    :return: Return the k nearest references, sorted by their distance to the recorded sign
     """
-    # Embeddings of the recorded sign
-    rec_left_hand = recorded_sign.lh_embedding
-    rec_right_hand = recorded_sign.rh_embedding
+    stats = new_pruning_stats()
+
+    partition = reference_index.get_partition(
+        recorded_sign.has_left_hand, recorded_sign.has_right_hand
+    )
+    if partition is None:
+        return get_search_result(reference_index, [], [], stats)
 
-    for idx, row in reference_signs.iterrows():
-        # Initialize the row variables
-        ref_sign_name, ref_sign_model, _ = row
+    candidates = None
+    if labels is not None:
+        candidates = np.flatnonzero(np.isin(reference_index.labels[partition.ids], labels))
 
+    if joint:
+        partition = get_joint_partition(partition, recorded_sign)
+    recorded_hands = get_recorded_hands(recorded_sign, partition.hands)
+    if shortlist is not None:
+        candidates = shortlist_candidates(
+            partition, recorded_hands, shortlist, stats, candidates, shortlist_metric
+        )
+    ids, distances = search_partition(
+        partition, recorded_hands, engine, window, k, stats, candidates
+    )
+    return get_search_result(reference_index, ids, distances, stats)
 
-        if (recorded_sign.has_left_hand == ref_sign_model.has_left_hand) and (
-            recorded_sign.has_right_hand == ref_sign_model.has_right_hand
-        ):
-            ref_left_hand = ref_sign_model.lh_embedding
-            ref_right_hand = ref_sign_model.rh_embedding
 
-            if recorded_sign.has_left_hand:
-                row["distance"] += list(fastdtw(rec_left_hand, ref_left_hand))[0]
-            if recorded_sign.has_right_hand:
-                row["distance"] += list(fastdtw(rec_right_hand, ref_right_hand))[0]
+def shortlist_candidates(
+    partition: ReferencePartition,
+    recorded_hands,
+    size: int,
+    stats: Dict[str, int],
+    candidates: np.ndarray = None,
+    metric: str = "euclidean",
+) -> np.ndarray:
+    """
+    Keep the size candidates closest to the recorded sign according to utils.shortlist
+
+    :param stats: number of references pruned by each stage, updated in place
+    :param metric: distance of the shortlist, see utils.shortlist.get_shortlist
+    :return: positions of the references kept
+    """
+    n_candidates = len(partition) if candidates is None else len(candidates)
+    candidates = get_shortlist(
+        partition, recorded_hands, size, metric=metric, candidates=candidates
+    )
+    stats["shortlist"] += n_candidates - len(candidates)
+    return candidates
+
+
+def get_joint_partition(partition: ReferencePartition, recorded_sign: SignModel):
+    """
+    Return the partition of the joint embeddings of the references (same positions),
+    or the partition itself if the joint embeddings are not available
+    """
+    if partition.joint is None or recorded_sign.joint_embedding is None:
+        return partition
+    return partition.joint
+
+
+def new_pruning_stats() -> Dict[str, int]:
+    """Number of candidates and of references pruned by each stage of the search"""
+    return {
+        "shortlist": 0,
+        "candidates": 0,
+        "lb_kim": 0,
+        "lb_keogh": 0,
+        "early_abandon": 0,
+        "dtw": 0,
+    }
+
+
+def get_recorded_hands(recorded_sign: SignModel, hands):
+    """
+    Return the list of (hand, embedding of the recorded sign, weights of its frames)
+    for the given hands (the weights are None if the sign is not compressed)
+    """
+    return [
+        (
+            hand,
+            np.asarray(getattr(recorded_sign, f"{hand}_embedding"), dtype=float),
+            getattr(recorded_sign, f"{hand}_weights"),
+        )
+        for hand in hands
+    ]
+
+
+def search_partition(
+    partition: ReferencePartition,
+    recorded_hands,
+    engine: str = "dtw",
+    window=None,
+    k: int = None,
+    stats: Dict[str, int] = None,
+    candidates: np.ndarray = None,
+):
+    """
+    Search the k nearest references of a partition (see dtw_distances)
+
+    :param recorded_hands: list of (hand, embedding, weights) of the recorded sign
+    :param stats: number of references pruned by each stage, updated in place
+    :param candidates: positions in the partition of the references to compare,
+                       None for all of them
+    :return: ids of the k nearest references and their distances, sorted by distance
+    """
+    if stats is None:
+        stats = new_pruning_stats()
+    if candidates is None:
+        candidates = np.arange(len(partition))
+    stats["candidates"] += len(candidates)
+    if k is None:
+        k = len(candidates)
+
+    if engine == "batch":
+        distances = _get_batch_distances(partition, recorded_hands, window, candidates)
+        stats["dtw"] += len(candidates)
+    else:
+        distances = _get_cascade_distances(
+            partition, recorded_hands, DTW_ENGINES[engine], window, k, stats, candidates
+        )
 
+    nearest = candidates[select_nearest(distances[candidates], k)]
+    return partition.ids[nearest], distances[nearest]
 
+
+def select_nearest(distances: np.ndarray, k: int) -> np.ndarray:
+    """
+    Partial selection of the k smallest distances, then sort of these k distances only
+
+    :return: indices of the k smallest distances, sorted by distance
+    """
+    k = min(k, len(distances))
+    if k == 0:
+        return np.array([], dtype=np.int64)
+    nearest = np.argpartition(distances, k - 1)[:k] if k < len(distances) else np.arange(k)
+    return nearest[np.argsort(distances[nearest], kind="stable")]
+
+
+def _get_cascade_distances(
+    partition: ReferencePartition,
+    recorded_hands,
+    distance,
+    window,
+    k: int,
+    stats: Dict[str, int],
+    candidates: np.ndarray,
+) -> np.ndarray:
+    """
+    Distances between the recorded sign and the references of a partition, computed
+    through the cascade of dtw_distances (pruned references get an infinite distance)
+
+    :param recorded_hands: list of (hand, embedding, weights) of the recorded sign
+    :param distance: DTW engine, see DTW_ENGINES
+    :param stats: number of references pruned by each stage, updated in place
+    :param candidates: positions of the references to compare
+    """
+    distances = np.full(len(partition), np.inf)
+
+    # The references closest to the recorded sign according to LB_Kim are compared first
+    kim_bounds = np.zeros(len(partition))
+    # The weights of the frames are at least 1: the bounds without weights are still valid
+    for hand, rec_hand, _ in recorded_hands:
+        kim_bounds += lb_kim(
+            rec_hand,
+            partition.get_first_frames(hand),
+            partition.get_last_frames(hand),
+            partition.get_lengths(hand),
+        )
+
+    # LB_Keogh is only valid for the references whose envelope covers the band of the query
+    envelopes = {}
+    for hand, rec_hand, _ in recorded_hands:
+        if (hand, window) not in partition.envelopes:
+            partition.envelopes[(hand, window)] = _compute_envelopes(
+                partition, hand, len(rec_hand), window
+            )
+        radii, lower, upper = partition.envelopes[(hand, window)]
+        required_radii = [
+            _get_envelope_radius(len(rec_hand), m, window)
+            for m in partition.get_lengths(hand)
+        ]
+        envelopes[hand] = (radii >= required_radii, lower, upper)
+
+    # Max-heap (negated distances) of the k best distances found so far
+    best_distances = []
+    for position in candidates[np.argsort(kim_bounds[candidates], kind="stable")]:
+        threshold = -best_distances[0] if len(best_distances) == k else np.inf
+
+        if kim_bounds[position] >= threshold:
+            stats["lb_kim"] += 1
+            continue
+
+        keogh_bound = 0
+        for hand, rec_hand, _ in recorded_hands:
+            is_valid, lower, upper = envelopes[hand]
+            if is_valid[position]:
+                start, end = partition.offsets[hand][position : position + 2]
+                keogh_bound += lb_keogh(rec_hand, (lower[start:end], upper[start:end]))
+        if keogh_bound >= threshold:
+            stats["lb_keogh"] += 1
+            continue
+
+        ref_distance = 0
+        for hand, rec_hand, rec_weights in recorded_hands:
+            ref_distance += distance(
+                rec_hand,
+                partition.get_embedding(hand, position),
+                window,
+                threshold - ref_distance,
+                rec_weights,
+                partition.get_weights(hand, position),
+            )
+            if ref_distance > threshold:
+                break
+        if ref_distance > threshold:
+            stats["early_abandon"] += 1
+            continue
+
+        stats["dtw"] += 1
+        distances[position] = ref_distance
+        if len(best_distances) < k:
+            heapq.heappush(best_distances, -ref_distance)
         else:
-            row["distance"] = np.inf
-    return reference_signs.sort_values(by=["distance"])
+            heapq.heappushpop(best_distances, -ref_distance)
+    return distances
+
+
+# Maximum padding of the shortest reference of a bucket, relative to its length
+BUCKET_PADDING = 0.25
+
+
+def _pad(sequences, m: int, fill=0) -> np.ndarray:
+    """Stack sequences of length at most m, padded at their end with fill"""
+    shape = (len(sequences), m) + sequences[0].shape[1:]
+    padded = np.full(shape, fill, dtype=sequences[0].dtype)
+    for idx, sequence in enumerate(sequences):
+        padded[idx, : len(sequence)] = sequence
+    return padded
+
+
+def get_buckets(partition: ReferencePartition, hand: str):
+    """
+    Group the references of a partition by range of length of the embedding of the hand
+    (the longest being at most 1 + BUCKET_PADDING times the shortest), padded with zeros
+    to the longest of their bucket, cached in the partition
+
+    :return: list of (positions of the references, array of shape (n_references, m, d),
+             int array of size n_references containing the lengths before padding)
+    """
+    if hand not in partition.buckets:
+        lengths = partition.get_lengths(hand)
+        order = np.argsort(lengths, kind="stable")
+        # A bucket starts at each reference too long for the bucket of the previous ones
+        starts = [0]
+        for idx in range(1, len(order)):
+            if lengths[order[idx]] > (1 + BUCKET_PADDING) * lengths[order[starts[-1]]]:
+                starts.append(idx)
+        partition.buckets[hand] = []
+        for positions in np.split(order, starts[1:]):
+            positions = np.sort(positions)
+            partition.buckets[hand].append(
+                (
+                    positions,
+                    _pad(
+                        [partition.get_embedding(hand, position) for position in positions],
+                        lengths[positions].max(),
+                    ),
+                    lengths[positions],
+                )
+            )
+    return partition.buckets[hand]
+
+
+def get_bucket_weights(partition: ReferencePartition, hand: str):
+    """
+    Weights of the frames of the references of each bucket (see get_buckets),
+    the padding weighing 1, cached in the partition
+
+    :return: list of arrays of shape (n_references, m), None if the partition is not compressed
+    """
+    if partition.weights is None:
+        return None
+    if (hand, "weights") not in partition.buckets:
+        partition.buckets[(hand, "weights")] = [
+            _pad(
+                [partition.get_weights(hand, position) for position in positions],
+                bucket.shape[1],
+                fill=1,
+            )
+            for positions, bucket, _ in get_buckets(partition, hand)
+        ]
+    return partition.buckets[(hand, "weights")]
+
+
+def _get_batch_distances(
+    partition: ReferencePartition, recorded_hands, window, candidates
+) -> np.ndarray:
+    """
+    Exact distances between the recorded sign and the candidate references of a partition,
+    computed bucket by bucket with dtw_distance_batch (the others get an infinite distance)
+
+    :param recorded_hands: list of (hand, embedding, weights) of the recorded sign
+    :param candidates: positions of the references to compare
+    """
+    is_candidate = np.zeros(len(partition), dtype=bool)
+    is_candidate[candidates] = True
+
+    distances = np.where(is_candidate, 0.0, np.inf)
+    for hand, rec_hand, rec_weights in recorded_hands:
+        buckets = get_buckets(partition, hand)
+        bucket_weights = get_bucket_weights(partition, hand) or [None] * len(buckets)
+        for (positions, bucket, lengths), weights in zip(buckets, bucket_weights):
+            selected = is_candidate[positions]
+            if selected.all():
+                distances[positions] += dtw_distance_batch(
+                    rec_hand, bucket, window, rec_weights, weights, lengths
+                )
+            elif selected.any():
+                distances[positions[selected]] += dtw_distance_batch(
+                    rec_hand,
+                    bucket[selected],
+                    window,
+                    rec_weights,
+                    None if weights is None else weights[selected],
+                    lengths[selected],
+                )
+    return distances
+
+
+def get_search_result(reference_index: ReferenceIndex, ids, distances, stats) -> SearchResult:
+    """Build the immutable SearchResult of the given references"""
+    ids = np.array(ids, dtype=np.int64)
+    distances = np.array(distances, dtype=float)
+    ids.flags.writeable = False
+    distances.flags.writeable = False
+    return SearchResult(ids, tuple(reference_index.get_names(ids)), distances, stats)
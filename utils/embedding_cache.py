@@ -0,0 +1,173 @@
+"""
+On-disk cache of the SignModel of the reference signs: the embeddings of the hands are
+computed once per landmark file, then loaded as they are on the following startups.
+
+The cache keeps one file per tag (embedding and compression of the signs), so that
+a startup only loads the entries of its tag. An entry is kept per video with the stamp
+of the landmarks it was computed from, taken from the manifest of the dataset (hash
+of the video and parameters of the extraction, see utils.dataset_manifest) without
+reading the landmark file: it is recomputed when the landmarks change, and dropped
+when the video leaves the dataset. A cache file is dropped when the code computing
+the embeddings changes.
+"""
+import hashlib
+import os
+import pickle as pkl
+
+import models.hand_model
+import models.sign_model
+import utils.compression
+from models.hand_model import DEFAULT_EMBEDDING
+from models.sign_model import SignModel
+from utils.compression import Compression
+from utils.dataset_manifest import DatasetManifest
+from utils.landmark_store import get_hand_arrays, load_landmarks
+from utils.landmark_utils import atomic_write, save_array
+
+
+EMBEDDING_CACHE_PATH = os.path.join("data", "dataset", "embeddings")
+
+# Modules whose source defines the embeddings stored in the cache
+_CODE_MODULES = (models.hand_model, models.sign_model, utils.compression)
+
+# Attributes of a SignModel stored in the cache
+_FIELDS = (
+    "has_left_hand",
+    "has_right_hand",
+    "lh_embedding",
+    "rh_embedding",
+    "joint_embedding",
+    "lh_weights",
+    "rh_weights",
+    "joint_weights",
+)
+
+
+def get_code_version() -> str:
+    """Hash of the source of the modules computing the embeddings"""
+    digest = hashlib.sha1()
+    for module in _CODE_MODULES:
+        with open(module.__file__, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def get_tag(
+    compression: Compression = None, embedding: str = DEFAULT_EMBEDDING, joint: bool = False
+) -> str:
+    """
+    Tag of the entries of the signs built with the given embedding and compression,
+    with or without the joint embedding
+    """
+    tag = f"{embedding}:{None if compression is None else tuple(compression)}"
+    return f"{tag}:joint" if joint else tag
+
+
+def get_cache_path(tag: str, path=EMBEDDING_CACHE_PATH) -> str:
+    """Path of the cache file of a tag, in the folder of the cache"""
+    return os.path.join(path, hashlib.sha1(tag.encode()).hexdigest()[:16] + ".pickle")
+
+
+class EmbeddingCache(object):
+    """
+    Cache of the signs built with a given embedding and compression
+
+    Params
+        compression, embedding, joint: see SignModel
+        manifest: DatasetManifest of the dataset, None if the landmarks are not recorded
+                  in a manifest (their file is then stamped with its size and modification
+                  time, and the entries are never dropped)
+        path: folder of the cache files, created on the first save (the single file
+              <path>.pickle of the previous versions, holding every tag, is then deleted)
+    Args
+        n_hits, n_misses: number of signs found in the cache and computed since it was loaded
+    """
+
+    def __init__(
+        self,
+        compression: Compression = None,
+        embedding: str = DEFAULT_EMBEDDING,
+        joint: bool = False,
+        manifest: DatasetManifest = None,
+        path=EMBEDDING_CACHE_PATH,
+    ):
+        self.compression = compression
+        self.embedding = embedding
+        self.joint = joint
+        self.manifest = manifest
+        self.path = get_cache_path(get_tag(compression, embedding, joint), path)
+        self.n_hits = self.n_misses = 0
+        self._legacy_path = f"{path}.pickle"
+        self._version = get_code_version()
+        # {video name: (stamp of the landmarks, dict of the fields)}
+        self._entries = {}
+        # Videos whose sign was requested since the cache was loaded
+        self._requested = set()
+        self._is_modified = False
+
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as file:
+                cache = pkl.load(file)
+            if cache.get("version") == self._version:
+                self._entries = cache["entries"]
+
+    def _get_stamp(self, video_name: str, landmark_path: str) -> tuple:
+        """Stamp of the landmarks of a video, without reading them"""
+        entry = None if self.manifest is None else self.manifest.entries.get(video_name)
+        if entry is not None:
+            return entry.hash, tuple(sorted(entry.params.items()))
+        stat = os.stat(landmark_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def get_sign_model(self, video_name: str, landmark_path: str) -> SignModel:
+        """
+        :param landmark_path: path of the landmarks of the video (see utils.landmark_store)
+        :return: the SignModel of the video, from the cache if its landmarks did not change
+        """
+        self._requested.add(video_name)
+        stamp = self._get_stamp(video_name, landmark_path)
+        entry = self._entries.get(video_name)
+        if entry is not None and entry[0] == stamp:
+            self.n_hits += 1
+            sign_model = SignModel.__new__(SignModel)
+            for field, value in entry[1].items():
+                setattr(sign_model, field, value)
+            return sign_model
+
+        self.n_misses += 1
+        sign_model = SignModel(
+            *get_hand_arrays(load_landmarks(landmark_path)),
+            self.compression,
+            self.embedding,
+            self.joint,
+        )
+        self._entries[video_name] = (
+            stamp, {field: getattr(sign_model, field) for field in _FIELDS}
+        )
+        self._is_modified = True
+        return sign_model
+
+    def save(self):
+        """
+        Write the cache file if new entries were computed or videos left the manifest,
+        without the entries of these videos (unless they were requested)
+        """
+        if self.manifest is not None:
+            removed = [
+                video_name
+                for video_name in self._entries
+                if video_name not in self.manifest.entries and video_name not in self._requested
+            ]
+            for video_name in removed:
+                del self._entries[video_name]
+            self._is_modified = self._is_modified or len(removed) > 0
+        if not self._is_modified:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with atomic_write(self.path) as temporary_path:
+            save_array({"version": self._version, "entries": self._entries}, temporary_path)
+        self._is_modified = False
+
+        # Entries of every tag, replaced by the files of the tags
+        if os.path.exists(self._legacy_path):
+            os.remove(self._legacy_path)
@@ -0,0 +1,202 @@
+"""
+Snapshot of the fully built ReferenceIndex in one binary file, mapped in memory when loaded:
+startup does not build any Python object per reference, and the app instances running
+on the same machine share the pages of the file through the OS page cache.
+
+Layout of the file: magic string, size of the header, pickled header (sign names and
+position, shape and dtype of every array), then the arrays, aligned on 64 bytes.
+
+Build the snapshot of the dataset (with the LB_Keogh envelopes for queries of N frames
+and the resampled embeddings of the shortlist):
+python -m utils.index_snapshot [--query-len N] [--window W] [--joint]
+"""
+import argparse
+import hashlib
+import os
+import pickle as pkl
+import struct
+from typing import List
+
+import numpy as np
+
+from models.reference_index import ReferenceIndex, ReferencePartition
+from utils.embedding_cache import get_code_version
+from utils.landmark_utils import atomic_write
+from utils.projection import Projection
+
+
+SNAPSHOT_PATH = os.path.join("data", "dataset", "reference_index.bin")
+# Version of the layout of the file, to increment when it changes
+SNAPSHOT_VERSION = 1
+
+_MAGIC = b"SIGNIDX\0"
+_HEADER_SIZE = struct.Struct("<Q")
+_ALIGNMENT = 64
+
+
+def get_source_stamp(landmark_paths: List[str], tag: str, projection: Projection = None) -> str:
+    """
+    Stamp of the sources of a reference index: the landmark files (path, size and
+    modification time, which are checked without reading them), the tag of the embedding
+    (see utils.embedding_cache.get_tag), the projection and the code of the embeddings
+    """
+    digest = hashlib.sha1()
+    digest.update(f"{SNAPSHOT_VERSION}:{get_code_version()}:{tag}".encode())
+    if projection is not None:
+        digest.update(np.ascontiguousarray(projection.mean).tobytes())
+        digest.update(np.ascontiguousarray(projection.components).tobytes())
+    for path in sorted(landmark_paths):
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+class _ArrayWriter(object):
+    """Collect the arrays of the snapshot and their position in the data section"""
+
+    def __init__(self):
+        self.arrays = []
+        self.size = 0
+
+    def add(self, array: np.ndarray):
+        """:return: descriptor (offset, shape, dtype) of the array in the data section"""
+        array = np.ascontiguousarray(array)
+        offset = -self.size % _ALIGNMENT + self.size
+        self.arrays.append((offset, array))
+        self.size = offset + array.nbytes
+        return offset, array.shape, array.dtype.str
+
+
+def _describe_partition(partition: ReferencePartition, writer: _ArrayWriter):
+    """Header of a partition, whose arrays are added to the writer"""
+    return {
+        "ids": writer.add(partition.ids),
+        "offsets": {hand: writer.add(offsets) for hand, offsets in partition.offsets.items()},
+        "blocks": {hand: writer.add(block) for hand, block in partition.blocks.items()},
+        "weights": partition.weights
+        and {hand: writer.add(weights) for hand, weights in partition.weights.items()},
+        "envelopes": {
+            key: tuple(writer.add(array) for array in envelope)
+            for key, envelope in partition.envelopes.items()
+        },
+        "resampled": {
+            key: tuple(writer.add(array) for array in resampled)
+            for key, resampled in partition.resampled.items()
+        },
+        "joint": partition.joint and _describe_partition(partition.joint, writer),
+    }
+
+
+def save_snapshot(reference_index: ReferenceIndex, stamp: str, path=SNAPSHOT_PATH):
+    """
+    Write the snapshot of a ReferenceIndex, with the envelopes and resampled embeddings
+    already computed in its partitions
+
+    :param stamp: stamp of the sources of the index, see get_source_stamp
+    """
+    writer = _ArrayWriter()
+    header = pkl.dumps(
+        {
+            "version": SNAPSHOT_VERSION,
+            "stamp": stamp,
+            "sign_names": reference_index.sign_names.tolist(),
+            "labels": writer.add(reference_index.labels),
+            "partitions": {
+                key: _describe_partition(partition, writer)
+                for key, partition in reference_index.partitions.items()
+            },
+        }
+    )
+    data_start = len(_MAGIC) + _HEADER_SIZE.size + len(header)
+    data_start += -data_start % _ALIGNMENT
+
+    # Renamed once written: the running apps keep their mapping of the previous snapshot
+    with atomic_write(path) as temporary_path, open(temporary_path, "wb") as file:
+        file.write(_MAGIC + _HEADER_SIZE.pack(len(header)) + header)
+        for offset, array in writer.arrays:
+            file.seek(data_start + offset)
+            file.write(array.tobytes())
+        file.truncate(data_start + writer.size)
+
+
+def _read_partition(description, data: np.memmap) -> ReferencePartition:
+    def read(descriptor) -> np.ndarray:
+        offset, shape, dtype = descriptor
+        return np.ndarray(shape, dtype, buffer=data, offset=offset)
+
+    partition = ReferencePartition(
+        read(description["ids"]),
+        {hand: read(offsets) for hand, offsets in description["offsets"].items()},
+        {hand: read(block) for hand, block in description["blocks"].items()},
+        description["weights"]
+        and {hand: read(weights) for hand, weights in description["weights"].items()},
+    )
+    for key, envelope in description["envelopes"].items():
+        partition.envelopes[key] = tuple(read(array) for array in envelope)
+    for key, resampled in description["resampled"].items():
+        partition.resampled[key] = tuple(read(array) for array in resampled)
+    if description["joint"] is not None:
+        partition.joint = _read_partition(description["joint"], data)
+    return partition
+
+
+def load_snapshot(path=SNAPSHOT_PATH, stamp: str = None):
+    """
+    :param stamp: stamp of the current sources of the index (see get_source_stamp),
+                  None to load the snapshot without checking it
+    :return: the ReferenceIndex of the snapshot, whose arrays are read-only views
+             on the mapped file, None if there is no snapshot or it is out of date
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as file:
+        if file.read(len(_MAGIC)) != _MAGIC:
+            return None
+        (header_size,) = _HEADER_SIZE.unpack(file.read(_HEADER_SIZE.size))
+        header = pkl.loads(file.read(header_size))
+    if header["version"] != SNAPSHOT_VERSION or (stamp is not None and header["stamp"] != stamp):
+        return None
+
+    data_start = len(_MAGIC) + _HEADER_SIZE.size + header_size
+    data_start += -data_start % _ALIGNMENT
+    data = np.memmap(path, dtype=np.uint8, mode="r", offset=data_start)
+    partitions = {
+        key: _read_partition(description, data)
+        for key, description in header["partitions"].items()
+    }
+    offset, shape, dtype = header["labels"]
+    labels = np.ndarray(shape, dtype, buffer=data, offset=offset)
+    return ReferenceIndex(np.array(header["sign_names"], dtype=str), labels, partitions)
+
+
+if __name__ == "__main__":
+    from utils.dataset_utils import get_reference_stamp, load_dataset, load_reference_signs
+    from utils.dtw import precompute_envelopes
+    from utils.projection import load_projection
+    from utils.shortlist import SHORTLIST_LENGTH, precompute_resampled
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--query-len", type=int, default=50)
+    parser.add_argument(
+        "--window",
+        type=lambda value: float(value) if "." in value else int(value),
+        default=None,
+        help="Sakoe-Chiba band: width in frames (int) or fraction of the lengths (float)",
+    )
+    parser.add_argument(
+        "--joint", action="store_true", help="With the joint embeddings, for the joint DTW"
+    )
+    args = parser.parse_args()
+
+    videos = load_dataset()
+    projection = load_projection(videos)
+    reference_signs = load_reference_signs(
+        videos, projection=projection, joint=args.joint, snapshot_path=None
+    )
+    precompute_envelopes(reference_signs, args.query_len, args.window)
+    precompute_resampled(reference_signs, SHORTLIST_LENGTH)
+    save_snapshot(
+        reference_signs, get_reference_stamp(videos, projection=projection, joint=args.joint)
+    )
+    print(f"{len(reference_signs)} reference signs saved in {SNAPSHOT_PATH}")
@@ -0,0 +1,243 @@
+"""
+Backends of the detection of the landmarks: every backend processes RGB images and returns
+results with the attributes of the Holistic results (left_hand_landmarks,
+right_hand_landmarks, pose_landmarks, face_landmarks; None when not detected),
+so that they can be used by mediapipe_detection, SignRecorder and the extraction alike.
+
+- "holistic": mp.solutions.holistic.Holistic (pose, face and hands)
+- "hands": mp.solutions.hands.Hands, the hands only, whose handedness is mapped to
+  the left and right hands of Holistic
+- "hand_landmarker": HandLandmarker of the MediaPipe Tasks, in VIDEO mode
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+from typing import NamedTuple
+
+import mediapipe as mp
+from mediapipe.framework.formats import landmark_pb2
+
+
+DEFAULT_BACKEND = "holistic"
+HAND_LANDMARKER_PATH = os.path.join("data", "models", "hand_landmarker.task")
+HAND_LANDMARKER_URL = (
+    "https://storage.googleapis.com/mediapipe-models/hand_landmarker/"
+    "hand_landmarker/float16/latest/hand_landmarker.task"
+)
+
+
+class LandmarkResults(NamedTuple):
+    """Results of the backends without pose and face, with the attributes of Holistic"""
+
+    left_hand_landmarks: landmark_pb2.NormalizedLandmarkList = None
+    right_hand_landmarks: landmark_pb2.NormalizedLandmarkList = None
+    pose_landmarks: landmark_pb2.NormalizedLandmarkList = None
+    face_landmarks: landmark_pb2.NormalizedLandmarkList = None
+
+
+class LandmarkBackend(ABC):
+    """
+    Detection of the landmarks of the frames of a video stream,
+    usable as a context manager like the MediaPipe solutions
+    """
+
+    @abstractmethod
+    def process(self, image):
+        """
+        :param image: RGB image of the next frame
+        :return: results with the attributes of the Holistic results
+        """
+
+    @abstractmethod
+    def reset(self):
+        """Start a new video stream (no tracking from the previous frames)"""
+
+    def close(self):
+        """Release the resources of the backend (nothing to release by default)"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class HolisticBackend(LandmarkBackend):
+    """
+    Params
+        options: parameters of mp.solutions.holistic.Holistic
+    """
+
+    def __init__(self, min_detection_confidence=0.5, min_tracking_confidence=0.5, **options):
+        self._holistic = mp.solutions.holistic.Holistic(
+            min_detection_confidence=min_detection_confidence,
+            min_tracking_confidence=min_tracking_confidence,
+            **options,
+        )
+
+    def process(self, image):
+        return self._holistic.process(image)
+
+    def reset(self):
+        self._holistic.reset()
+
+    def close(self):
+        self._holistic.close()
+
+
+def _map_handedness(hands, mirrored: bool) -> LandmarkResults:
+    """
+    :param hands: list of (handedness label, score, NormalizedLandmarkList)
+    :param mirrored: whether the images are mirrored; the handedness of MediaPipe assumes
+                     they are, while Holistic names the hands of the person
+    :return: LandmarkResults with the most confident hand of each side
+    """
+    sides = {}
+    for label, score, landmarks in hands:
+        is_left = (label == "Left") == mirrored
+        if is_left not in sides or score > sides[is_left][0]:
+            sides[is_left] = (score, landmarks)
+    return LandmarkResults(
+        left_hand_landmarks=sides[True][1] if True in sides else None,
+        right_hand_landmarks=sides[False][1] if False in sides else None,
+    )
+
+
+class HandsBackend(LandmarkBackend):
+    """
+    Params
+        mirrored: whether the images are mirrored (selfie view)
+        options: parameters of mp.solutions.hands.Hands (model_complexity: 0 or 1)
+    """
+
+    def __init__(
+        self,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5,
+        model_complexity=1,
+        mirrored=False,
+        **options,
+    ):
+        self.mirrored = mirrored
+        self._hands = mp.solutions.hands.Hands(
+            max_num_hands=2,
+            model_complexity=model_complexity,
+            min_detection_confidence=min_detection_confidence,
+            min_tracking_confidence=min_tracking_confidence,
+            **options,
+        )
+
+    def process(self, image):
+        results = self._hands.process(image)
+        if not results.multi_hand_landmarks:
+            return LandmarkResults()
+        return _map_handedness(
+            [
+                (handedness.classification[0].label, handedness.classification[0].score, landmarks)
+                for handedness, landmarks in zip(
+                    results.multi_handedness, results.multi_hand_landmarks
+                )
+            ],
+            self.mirrored,
+        )
+
+    def reset(self):
+        self._hands.reset()
+
+    def close(self):
+        self._hands.close()
+
+
+class HandLandmarkerBackend(LandmarkBackend):
+    """
+    HandLandmarker of the MediaPipe Tasks in VIDEO mode: the hands are tracked
+    between frames, like with the solutions
+
+    Params
+        model_path: path of the model bundle (the model sets the complexity),
+                    downloaded from HAND_LANDMARKER_URL
+        delegate: "cpu" or "gpu", where the model runs (the Python API of the Tasks
+                  does not set the number of threads)
+        mirrored: whether the images are mirrored (selfie view)
+    """
+
+    def __init__(
+        self,
+        model_path=HAND_LANDMARKER_PATH,
+        delegate="cpu",
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5,
+        mirrored=False,
+    ):
+        from mediapipe.tasks.python import BaseOptions, vision
+
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"HandLandmarker model not found at {model_path}, download it from "
+                f"{HAND_LANDMARKER_URL}"
+            )
+        self.mirrored = mirrored
+        self._options = vision.HandLandmarkerOptions(
+            base_options=BaseOptions(
+                model_asset_path=model_path,
+                delegate=getattr(BaseOptions.Delegate, delegate.upper()),
+            ),
+            running_mode=vision.RunningMode.VIDEO,
+            num_hands=2,
+            min_hand_detection_confidence=min_detection_confidence,
+            min_hand_presence_confidence=min_detection_confidence,
+            min_tracking_confidence=min_tracking_confidence,
+        )
+        self._create_landmarker = vision.HandLandmarker.create_from_options
+        self._landmarker = self._create_landmarker(self._options)
+        self._timestamp_ms = 0
+
+    def process(self, image):
+        # VIDEO mode requires increasing timestamps: the time elapsed, at least 1 ms per frame
+        self._timestamp_ms = max(self._timestamp_ms + 1, int(time.monotonic() * 1000))
+        result = self._landmarker.detect_for_video(
+            mp.Image(image_format=mp.ImageFormat.SRGB, data=image), self._timestamp_ms
+        )
+        return _map_handedness(
+            [
+                (
+                    handedness[0].category_name,
+                    handedness[0].score,
+                    landmark_pb2.NormalizedLandmarkList(
+                        landmark=[
+                            landmark_pb2.NormalizedLandmark(x=point.x, y=point.y, z=point.z)
+                            for point in landmarks
+                        ]
+                    ),
+                )
+                for handedness, landmarks in zip(result.handedness, result.hand_landmarks)
+            ],
+            self.mirrored,
+        )
+
+    def reset(self):
+        # A landmarker in VIDEO mode cannot be reset: a new one is created
+        self._landmarker.close()
+        self._landmarker = self._create_landmarker(self._options)
+
+    def close(self):
+        self._landmarker.close()
+
+
+LANDMARK_BACKENDS = {
+    "holistic": HolisticBackend,
+    "hands": HandsBackend,
+    "hand_landmarker": HandLandmarkerBackend,
+}
+
+
+def get_landmark_backend(name=DEFAULT_BACKEND, **options) -> LandmarkBackend:
+    """
+    :param name: name of the backend, one of LANDMARK_BACKENDS
+    :param options: parameters of the backend
+    """
+    if name not in LANDMARK_BACKENDS:
+        raise ValueError(
+            f"Unknown landmark backend {name}, expected one of {tuple(LANDMARK_BACKENDS)}"
+        )
+    return LANDMARK_BACKENDS[name](**options)
@@ -0,0 +1,155 @@
+import numpy as np
+
+from models.hand_model import DEFAULT_EMBEDDING, get_embedding_function, get_embedding_size
+from models.sign_model import SignModel
+from utils.compression import Compression, get_active_frames
+from utils.landmark_utils import copy_landmarks
+from utils.projection import Projection
+
+
+HANDS = ("lh", "rh")
+
+
+class LandmarkBuffer(object):
+    """
+    Ring buffer of the hand landmarks of the last frames, and of their embeddings,
+    preallocated once: its memory does not grow, however many frames are pushed
+
+    Params
+        capacity: maximum number of frames kept (the oldest ones are overwritten)
+        projection: projection of the embeddings (see utils.projection), None to keep
+                    the full embeddings. The buffer keeps the full embeddings, which are
+                    projected when they are read, and after the compression of a recorded
+                    sign (the order in which the reference signs are built)
+        embedding: name of the embedding of the hands (see models.hand_model.EMBEDDINGS)
+    Args
+        landmarks: float32 array of shape (capacity, 2, 21, 3), landmarks of both hands
+        detected: bool array of shape (capacity, 2), whether each hand is detected
+        embeddings: float32 array of shape (capacity, 2, embedding size)
+    """
+
+    def __init__(
+        self, capacity: int, projection: Projection = None, embedding: str = DEFAULT_EMBEDDING
+    ):
+        self.capacity = capacity
+        self.projection = projection
+        self._get_embedding = get_embedding_function(embedding)
+        embedding_size = get_embedding_size(embedding)
+
+        self.landmarks = np.zeros((capacity, len(HANDS), 21, 3), dtype=np.float32)
+        self.detected = np.zeros((capacity, len(HANDS)), dtype=bool)
+        self.embeddings = np.zeros((capacity, len(HANDS), embedding_size), dtype=np.float32)
+        self.clear()
+
+    def clear(self):
+        self._next = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def push(self, results):
+        """
+        Copy the hand landmarks of a frame and compute their embeddings
+
+        :param results: mediapipe object that contains the 3D position of all keypoints
+        """
+        idx = self._next
+        for hand_idx, hand_landmarks in enumerate(
+            (results.left_hand_landmarks, results.right_hand_landmarks)
+        ):
+            landmarks = self.landmarks[idx, hand_idx]
+            # Same criterion as SignModel for the frames where the hand is missing
+            is_detected = copy_landmarks(hand_landmarks, landmarks) and landmarks.sum() != 0
+            self.detected[idx, hand_idx] = is_detected
+            if is_detected:
+                self.embeddings[idx, hand_idx] = self._get_embedding(landmarks)[0]
+
+        self._next = (idx + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def _project(self, embedding: np.ndarray) -> np.ndarray:
+        """Embeddings in the space of the reference signs"""
+        if self.projection is None:
+            return embedding
+        return self.projection.transform(embedding)
+
+    def _get_order(self) -> np.ndarray:
+        """Positions in the buffer of the frames kept, from the oldest to the newest"""
+        return (np.arange(self._size) + self._next - self._size) % self.capacity
+
+    def get_embedding(self, hand: str, start=0, order: np.ndarray = None) -> np.ndarray:
+        """
+        :param start: index of the first detection of the hand to return
+        :param order: positions in the buffer of the frames to use, all the frames kept by default
+        :return: array of shape (n_frames, embedding size), embeddings of
+                 the hand in the frames kept where it is detected, from the oldest,
+                 projected like the reference signs
+        """
+        return self._project(self._get_full_embedding(hand, start, order))
+
+    def _get_full_embedding(self, hand: str, start=0, order: np.ndarray = None) -> np.ndarray:
+        """Same as get_embedding, without the projection"""
+        hand_idx = HANDS.index(hand)
+        if order is None:
+            order = self._get_order()
+        order = order[self.detected[order, hand_idx]][start:]
+        return self.embeddings[order, hand_idx]
+
+    def get_joint_embedding(self, order: np.ndarray = None) -> np.ndarray:
+        """
+        :param order: positions in the buffer of the frames to use, all the frames kept by default
+        :return: array of shape (n_frames, 2 * embedding size), embeddings
+                 of both hands in the frames kept where at least one hand is detected,
+                 with a null embedding for a missing hand (see SignModel), not projected
+        """
+        if order is None:
+            order = self._get_order()
+        order = order[self.detected[order].any(axis=1)]
+        embeddings = np.where(self.detected[order, :, None], self.embeddings[order], 0)
+        return embeddings.reshape((len(order), -1))
+
+    def get_sign_model(self, compression: Compression = None, joint=False) -> SignModel:
+        """
+        :param compression: temporal compression of the sign (see utils.compression),
+                            None to keep every frame
+        :param joint: whether the joint embedding is computed
+        :return: SignModel of the frames kept, compressed then projected
+                 like the reference signs
+        """
+        order = self._get_order()
+        if compression is not None:
+            # Idle lead-in and lead-out frames are trimmed, as in SignModel
+            hand_arrays = [
+                np.where(
+                    self.detected[order, hand_idx, None],
+                    self.landmarks[order, hand_idx].reshape((len(order), -1)),
+                    0,
+                )
+                for hand_idx in range(len(HANDS))
+            ]
+            order = order[get_active_frames(hand_arrays, compression.motion_threshold)]
+
+        sign_model = SignModel.from_embeddings(
+            self._get_full_embedding("lh", order=order),
+            self._get_full_embedding("rh", order=order),
+            self.get_joint_embedding(order) if joint else None,
+        )
+        # The frames are merged in the space of the full embeddings, then projected
+        if compression is not None:
+            sign_model.compress(compression.merge_tolerance)
+        if self.projection is not None:
+            self.projection.apply(sign_model)
+        return sign_model
+
+    def get_last_embeddings(self):
+        """
+        :return: the embedding of each hand in the last frame, None if it is not detected
+        """
+        idx = (self._next - 1) % self.capacity
+        return [
+            self._project(self.embeddings[idx, hand_idx, None])[0]
+            if self.detected[idx, hand_idx]
+            else None
+            for hand_idx in range(len(HANDS))
+        ]
@@ -0,0 +1,143 @@
+"""
+Storage of the landmarks of the videos of the dataset: one .npy file per video holding
+a float32 structured array, one record per frame (timestamp, both hands and optionally
+the pose), which is loaded memory-mapped.
+
+Convert the pose_/lh_/rh_ pickles of data/dataset to this format:
+python -m utils.landmark_store [--with-pose] [--keep]
+"""
+import argparse
+import os
+from typing import List
+
+import cv2
+import numpy as np
+
+
+DATASET_PATH = os.path.join("data", "dataset")
+# Frame rate of the videos whose timestamps are unknown (migrated without their video)
+DEFAULT_FPS = 30.0
+
+
+def get_landmark_dtype(with_pose=False) -> np.dtype:
+    """
+    Record of a frame: timestamp in seconds, landmarks of the left and right hands
+    and of the pose (if with_pose), null where they are not detected
+    """
+    fields = [
+        ("timestamp", "<f4"),
+        ("left_hand", "<f4", (21, 3)),
+        ("right_hand", "<f4", (21, 3)),
+    ]
+    if with_pose:
+        fields.append(("pose", "<f4", (33, 3)))
+    return np.dtype(fields)
+
+
+def get_landmark_path(video_name: str) -> str:
+    """Path of the landmarks of a video of the dataset"""
+    sign_name = video_name.split("-")[0]
+    return os.path.join(DATASET_PATH, sign_name, f"{video_name}.npy")
+
+
+def save_landmarks(
+    path: str,
+    timestamps: np.ndarray,
+    left_hand: np.ndarray,
+    right_hand: np.ndarray,
+    pose: np.ndarray = None,
+):
+    """
+    :param timestamps: array of size n_frames, in seconds
+    :param x_hand: array of shape (n_frames, 21, 3) (or (n_frames, 63))
+    :param pose: array of shape (n_frames, 33, 3) (or (n_frames, 99)), None not to store it
+    """
+    landmarks = np.zeros(len(timestamps), dtype=get_landmark_dtype(pose is not None))
+    landmarks["timestamp"] = timestamps
+    landmarks["left_hand"] = np.reshape(left_hand, (-1, 21, 3))
+    landmarks["right_hand"] = np.reshape(right_hand, (-1, 21, 3))
+    if pose is not None:
+        landmarks["pose"] = np.reshape(pose, (-1, 33, 3))
+
+    # Imported here: utils.landmark_utils imports this module
+    from utils.landmark_utils import atomic_write
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_write(path) as temporary_path, open(temporary_path, "wb") as file:
+        np.save(file, landmarks)
+
+
+def load_landmarks(path: str) -> np.ndarray:
+    """
+    :return: read-only structured array of the frames of the video (see get_landmark_dtype),
+             mapped in memory
+    """
+    return np.load(path, mmap_mode="r")
+
+
+def get_hand_arrays(landmarks: np.ndarray) -> List[np.ndarray]:
+    """
+    :param landmarks: structured array of the frames of a video
+    :return: arrays of shape (n_frames, 21 * 3) of the left and right hands
+    """
+    return [
+        np.asarray(landmarks[hand]).reshape((len(landmarks), 21 * 3))
+        for hand in ("left_hand", "right_hand")
+    ]
+
+
+def _get_video_fps(video_name: str) -> float:
+    """Frame rate of the video of the dataset, DEFAULT_FPS if it is missing"""
+    sign_name = video_name.split("-")[0]
+    cap = cv2.VideoCapture(os.path.join("data", "videos", sign_name, video_name + ".mp4"))
+    fps = cap.get(cv2.CAP_PROP_FPS) if cap.isOpened() else 0
+    cap.release()
+    return fps or DEFAULT_FPS
+
+
+def migrate_video(data_path: str, video_name: str, with_pose=False, keep=False) -> int:
+    """
+    Convert the pickles of the landmarks of a video
+
+    :param data_path: folder of the pickles of the video
+    :return: size of the pickles, in bytes
+    """
+    from utils.landmark_utils import load_array
+
+    pickle_paths = {
+        name: os.path.join(data_path, f"{prefix}_{video_name}.pickle")
+        for name, prefix in (("pose", "pose"), ("left_hand", "lh"), ("right_hand", "rh"))
+    }
+    left_hand = load_array(pickle_paths["left_hand"])
+    right_hand = load_array(pickle_paths["right_hand"])
+    pose = load_array(pickle_paths["pose"]) if with_pose else None
+    timestamps = np.arange(len(left_hand)) / _get_video_fps(video_name)
+    save_landmarks(get_landmark_path(video_name), timestamps, left_hand, right_hand, pose)
+
+    size = sum(os.path.getsize(path) for path in pickle_paths.values())
+    if not keep:
+        for path in pickle_paths.values():
+            os.remove(path)
+        if not os.listdir(data_path):
+            os.rmdir(data_path)
+    return size
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--with-pose", action="store_true", help="Keep the pose landmarks")
+    parser.add_argument("--keep", action="store_true", help="Keep the pickles")
+    args = parser.parse_args()
+
+    n_videos, before, after = 0, 0, 0
+    for root, dirs, files in os.walk(DATASET_PATH):
+        for file_name in files:
+            if file_name.startswith("pose_") and file_name.endswith(".pickle"):
+                video_name = file_name[len("pose_") : -len(".pickle")]
+                before += migrate_video(root, video_name, args.with_pose, args.keep)
+                after += os.path.getsize(get_landmark_path(video_name))
+                n_videos += 1
+    print(
+        f"{n_videos} videos converted: {before / 1e6:.1f} MB of pickles"
+        f" -> {after / 1e6:.1f} MB"
+    )
@@ -1,9 +1,13 @@
 import cv2
+import multiprocessing
 import os
+import queue
+import threading
+from contextlib import contextmanager
 import numpy as np
 import pickle as pkl
-import mediapipe as mp
-from utils.mediapipe_utils import mediapipe_detection
+from utils.landmark_backend import DEFAULT_BACKEND, LandmarkBackend, get_landmark_backend
+from utils.landmark_store import get_landmark_path, save_landmarks
 
 
 def landmark_to_array(mp_landmark_list, num_points):
@@ -13,6 +17,21 @@ def landmark_to_array(mp_landmark_list, num_points):
     return np.array([[lmk.x, lmk.y, lmk.z] for lmk in mp_landmark_list.landmark])
 
 
+def copy_landmarks(mp_landmark_list, out: np.ndarray) -> bool:
+    """Copy the coordinates of the keypoints into out, an array of shape (nb_keypoints, 3)
+
+    :return: False if the landmarks are not detected (out is left unchanged)
+    """
+    if mp_landmark_list is None:
+        return False
+    out.reshape(-1)[:] = np.fromiter(
+        (coordinate for lmk in mp_landmark_list.landmark for coordinate in (lmk.x, lmk.y, lmk.z)),
+        dtype=out.dtype,
+        count=out.size,
+    )
+    return True
+
+
 def extract_landmarks(results):
     """Extract the results of both hands and convert them to a np array of size
     if a hand doesn't appear, return an array of zeros
@@ -30,60 +49,433 @@ def extract_landmarks(results):
 
 
 
-def save_landmarks_from_video(video_name):
-    landmark_list = {"pose": [], "left_hand": [], "right_hand": []}
+# Parameters of the landmark backend of the extraction (see utils.landmark_backend)
+DETECTION_PARAMS = {"min_detection_confidence": 0.5, "min_tracking_confidence": 0.5}
+
+
+# Number of decoded frames waiting for the landmark extraction
+DECODE_QUEUE_SIZE = 8
+# Period at which a decoder blocked on a full queue checks whether it is stopped, in seconds
+_DECODE_POLL = 0.1
+
+
+def get_extraction_params(
+    with_pose=False, frame_step=1, scale=1.0, backend=DEFAULT_BACKEND
+) -> dict:
+    """
+    Parameters of save_landmarks_from_video, recorded in the manifest of the dataset:
+    the landmarks are extracted again when they change
+    """
+    return {
+        **DETECTION_PARAMS,
+        "backend": backend,
+        "with_pose": with_pose,
+        "frame_step": frame_step,
+        "scale": scale,
+    }
+
+
+def _put_frame(frames: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Put an item into the queue of a decoder, waiting while it is full
+
+    :return: False if the decoder was stopped before the item could be put
+    """
+    while not stop.is_set():
+        try:
+            frames.put(item, timeout=_DECODE_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _decode_frames(cap, frames: queue.Queue, stop: threading.Event, frame_step=1, scale=1.0):
+    """
+    Decode the frames of a video into a bounded queue, run in a thread:
+    the (timestamp in seconds, RGB image) of every frame_step-th frame, then None
+
+    :param stop: set by the consumer to end the decoding, e.g. when the extraction failed
+    :param scale: factor of the resolution of the images
+    """
+    try:
+        idx = 0
+        # The skipped frames are only grabbed, without conversion
+        while not stop.is_set() and cap.grab():
+            if idx % frame_step == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                if scale != 1:
+                    frame = cv2.resize(
+                        frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+                    )
+                timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                if not _put_frame(
+                    frames, (timestamp, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), stop
+                ):
+                    break
+            idx += 1
+    finally:
+        _put_frame(frames, None, stop)
+
+
+def _process_frames(frames, backend: LandmarkBackend, with_pose=False, capacity=1):
+    """
+    Run the landmark backend on a stream of frames
+
+    :param frames: iterable of the (timestamp in seconds, RGB image) of the frames
+    :param capacity: expected number of frames, the arrays are grown if it is underestimated
+    :return: {"timestamp", "hands" (of shape (n_frames, 2, 21, 3)), "pose" if with_pose},
+             the landmarks not detected being null
+    """
+    # Landmarks of the frames, preallocated (grown if the capacity is underestimated)
+    landmarks = {
+        "timestamp": np.zeros(capacity, dtype=np.float32),
+        "hands": np.zeros((capacity, 2, 21, 3), dtype=np.float32),
+    }
+    if with_pose:
+        landmarks["pose"] = np.zeros((capacity, 33, 3), dtype=np.float32)
+
+    n_frames = 0
+    for timestamp, image in frames:
+        if n_frames == len(landmarks["timestamp"]):
+            landmarks = {
+                name: np.concatenate([array, np.zeros_like(array)])
+                for name, array in landmarks.items()
+            }
+
+        # Make detections
+        image.flags.writeable = False
+        results = backend.process(image)
+
+        # Store results (the landmarks not detected stay null)
+        landmarks["timestamp"][n_frames] = timestamp
+        copy_landmarks(results.left_hand_landmarks, landmarks["hands"][n_frames, 0])
+        copy_landmarks(results.right_hand_landmarks, landmarks["hands"][n_frames, 1])
+        if with_pose:
+            copy_landmarks(results.pose_landmarks, landmarks["pose"][n_frames])
+        n_frames += 1
+
+    return {name: array[:n_frames] for name, array in landmarks.items()}
+
+
+def _save_frame_landmarks(video_name, landmarks) -> int:
+    """
+    Save the landmarks returned by _process_frames in the folder of the sign
+
+    :return: number of frames
+    """
+    save_landmarks(
+        get_landmark_path(video_name),
+        landmarks["timestamp"],
+        landmarks["hands"][:, 0],
+        landmarks["hands"][:, 1],
+        landmarks.get("pose"),
+    )
+    return len(landmarks["timestamp"])
+
+
+def save_landmarks_from_video(
+    video_name, with_pose=False, backend: LandmarkBackend = None, frame_step=1, scale=1.0
+) -> int:
+    """
+    Extract the landmarks of a video of the dataset and save them (see utils.landmark_store).
+    The video is decoded by another thread while the landmarks of the previous frames
+    are extracted.
+
+    :param with_pose: whether the pose landmarks are stored too (recognition only uses
+                      the hands), null with a backend without pose
+    :param backend: LandmarkBackend to reuse (reset before the video),
+                    None to open a Holistic one
+    :param frame_step: only every frame_step-th frame is processed, for long videos
+    :param scale: factor of the resolution of the frames given to the backend
+    :return: number of frames processed
+    """
+    if backend is None:
+        with get_landmark_backend(DEFAULT_BACKEND, **DETECTION_PARAMS) as backend:
+            return save_landmarks_from_video(video_name, with_pose, backend, frame_step, scale)
+    # No tracking from the last frame of the previous video
+    backend.reset()
+
     sign_name = video_name.split("-")[0]
 
     # Set the Video stream
     cap = cv2.VideoCapture(
         os.path.join("data", "videos", sign_name, video_name + ".mp4")
     )
-    with mp.solutions.holistic.Holistic(
-        min_detection_confidence=0.5, min_tracking_confidence=0.5
-    ) as holistic:
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if ret:
-                # Make detections
-                image, results = mediapipe_detection(frame, holistic)
-
-                # Store results
-                pose, left_hand, right_hand = extract_landmarks(results)
-                landmark_list["pose"].append(pose)
-                landmark_list["left_hand"].append(left_hand)
-                landmark_list["right_hand"].append(right_hand)
-            else:
+    capacity = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) // frame_step + 1, 1)
+
+    frames = queue.Queue(maxsize=DECODE_QUEUE_SIZE)
+    stop = threading.Event()
+    decoder = threading.Thread(
+        target=_decode_frames, args=(cap, frames, stop, frame_step, scale), daemon=True
+    )
+    decoder.start()
+    try:
+        landmarks = _process_frames(iter(frames.get, None), backend, with_pose, capacity)
+    finally:
+        # The decoder is stopped even if the extraction failed, so that it does not stay
+        # blocked on the full queue with the video open
+        stop.set()
+        decoder.join()
+        cap.release()
+
+    return _save_frame_landmarks(video_name, landmarks)
+
+
+# Distance from the current position of a source video beyond which its next range
+# is reached by seeking rather than by grabbing the frames in between, in seconds
+SEEK_DISTANCE = 5.0
+# Seeks land this long before the start of a range: the frames decoded before the start
+# are dropped from their timestamps, so no frame of the range is missed
+SEEK_PREROLL = 0.5
+# Tolerance on the timestamps of the bounds of the ranges, in seconds
+_TIME_EPSILON = 1e-3
+
+
+def _decode_ranges(
+    cap, ranges, frames: queue.Queue, stop: threading.Event, frame_step=1, scale=1.0
+):
+    """
+    Decode the time ranges of a source video into a bounded queue, run in a thread:
+    for each range, the (timestamp from the start of the range, RGB image) of every
+    frame_step-th frame whose timestamp lies in the range, then None
+
+    :param ranges: list of (start, end) in seconds sorted by start, end None up to the end
+                   of the video
+    :param stop: see _decode_frames
+    """
+    n_ranges = 0
+    try:
+        # Timestamp of the last frame grabbed
+        position = -1.0
+        for start, end in ranges:
+            if stop.is_set():
+                break
+            # Ranges far ahead or overlapping the previous one are reached by seeking
+            if start <= position or start - position > SEEK_DISTANCE:
+                cap.set(cv2.CAP_PROP_POS_MSEC, max(start - SEEK_PREROLL, 0.0) * 1000)
+            idx = 0
+            # The frames outside of the range are only grabbed, without conversion
+            while not stop.is_set() and cap.grab():
+                position = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                if position < start - _TIME_EPSILON:
+                    continue
+                if end is not None and position >= end - _TIME_EPSILON:
+                    break
+                if idx % frame_step == 0:
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    if scale != 1:
+                        frame = cv2.resize(
+                            frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+                        )
+                    if not _put_frame(
+                        frames, (position - start, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), stop
+                    ):
+                        break
+                idx += 1
+            _put_frame(frames, None, stop)
+            n_ranges += 1
+    finally:
+        # Every range is closed, even if the decoding failed
+        for _ in range(n_ranges, len(ranges)):
+            if not _put_frame(frames, None, stop):
                 break
+
+
+def save_landmarks_from_source(
+    source_path,
+    ranges,
+    with_pose=False,
+    backend: LandmarkBackend = None,
+    frame_step=1,
+    scale=1.0,
+):
+    """
+    Extract the landmarks of several videos of the dataset cut from one source video,
+    which is decoded once, and save them like save_landmarks_from_video. Only the frames
+    whose timestamp lies in the range of a video are given to the backend, and their
+    timestamps start at the start of the range.
+
+    :param source_path: path of the source video
+    :param ranges: list of (video name, start, end) in seconds, end None up to the end
+                   of the source
+    :param with_pose, backend, frame_step, scale: see save_landmarks_from_video
+    :return: list of the (video name, number of frames) of the videos
+    """
+    if backend is None:
+        with get_landmark_backend(DEFAULT_BACKEND, **DETECTION_PARAMS) as backend:
+            return save_landmarks_from_source(
+                source_path, ranges, with_pose, backend, frame_step, scale
+            )
+    ranges = sorted(ranges, key=lambda sign_range: sign_range[1])
+
+    cap = cv2.VideoCapture(source_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+
+    frames = queue.Queue(maxsize=DECODE_QUEUE_SIZE)
+    stop = threading.Event()
+    decoder = threading.Thread(
+        target=_decode_ranges,
+        args=(cap, [(start, end) for _, start, end in ranges], frames, stop, frame_step, scale),
+        daemon=True,
+    )
+    decoder.start()
+
+    results = []
+    try:
+        for video_name, start, end in ranges:
+            # No tracking from the last frame of the previous range
+            backend.reset()
+            duration = (frame_count / fps if end is None else end) - start
+            capacity = max(int(duration * fps) // frame_step + 1, 1)
+            landmarks = _process_frames(iter(frames.get, None), backend, with_pose, capacity)
+            results.append((video_name, _save_frame_landmarks(video_name, landmarks)))
+    finally:
+        # See save_landmarks_from_video
+        stop.set()
+        decoder.join()
         cap.release()
+    return results
+
+
+# Default number of extraction processes: each one holds a landmark graph in memory
+MAX_DEFAULT_WORKERS = 4
+
+# Landmark backend of the extraction worker process, kept open across the videos
+_worker_backend = None
+
+
+def _init_extraction_worker(backend: str):
+    global _worker_backend
+    _worker_backend = get_landmark_backend(backend, **DETECTION_PARAMS)
+
 
-    # Create the folder of the sign if it doesn't exists
-    path = os.path.join("data", "dataset", sign_name)
-    if not os.path.exists(path):
-        os.mkdir(path)
+def _get_extraction_pool(n_workers: int, backend: str):
+    """
+    Pool of extraction processes, started with spawn rather than fork: the extraction
+    is run from the threaded games, and forking a process with threads is unsafe
+    """
+    return multiprocessing.get_context("spawn").Pool(
+        n_workers, initializer=_init_extraction_worker, initargs=(backend,)
+    )
 
-    # Create the folder of the video data if it doesn't exists
-    data_path = os.path.join(path, video_name)
-    if not os.path.exists(data_path):
-        os.mkdir(data_path)
 
-    # Saving the landmark_list in the correct folder
-    save_array(
-        landmark_list["pose"], os.path.join(data_path, f"pose_{video_name}.pickle")
+def _extract_video(task):
+    """Extract the landmarks of one video, run in a worker process"""
+    video_name, with_pose, frame_step, scale = task
+    return video_name, save_landmarks_from_video(
+        video_name, with_pose, _worker_backend, frame_step, scale
     )
-    save_array(
-        landmark_list["left_hand"], os.path.join(data_path, f"lh_{video_name}.pickle")
+
+
+def extract_landmarks_from_videos(
+    video_names,
+    with_pose=False,
+    n_workers=None,
+    frame_step=1,
+    scale=1.0,
+    backend=DEFAULT_BACKEND,
+):
+    """
+    Extract the landmarks of videos of the dataset in a pool of processes, each one
+    keeping its landmark backend open across its videos
+
+    :param n_workers: number of processes (by default, one per CPU up to
+                      MAX_DEFAULT_WORKERS), 1 to extract the videos in this process
+    :param frame_step, scale: see save_landmarks_from_video
+    :param backend: name of the landmark backend (see utils.landmark_backend)
+    :return: iterator of the (video name, number of frames) of the videos, as they are saved
+    """
+    n_workers = min(
+        n_workers or min(multiprocessing.cpu_count(), MAX_DEFAULT_WORKERS), len(video_names)
     )
-    save_array(
-        landmark_list["right_hand"], os.path.join(data_path, f"rh_{video_name}.pickle")
+    tasks = [(video_name, with_pose, frame_step, scale) for video_name in video_names]
+    if n_workers <= 1:
+        with get_landmark_backend(backend, **DETECTION_PARAMS) as landmark_backend:
+            for task in tasks:
+                yield task[0], save_landmarks_from_video(
+                    task[0], with_pose, landmark_backend, frame_step, scale
+                )
+        return
+
+    with _get_extraction_pool(n_workers, backend) as pool:
+        yield from pool.imap_unordered(_extract_video, tasks)
+
+
+def _extract_source(task):
+    """Extract the landmarks of the ranges of one source video, run in a worker process"""
+    source_path, ranges, with_pose, frame_step, scale = task
+    return save_landmarks_from_source(
+        source_path, ranges, with_pose, _worker_backend, frame_step, scale
     )
 
 
+def extract_landmarks_from_sources(
+    sources,
+    with_pose=False,
+    n_workers=None,
+    frame_step=1,
+    scale=1.0,
+    backend=DEFAULT_BACKEND,
+):
+    """
+    Extract the landmarks of the videos cut from source videos in a pool of processes,
+    each source being decoded once by one process (see save_landmarks_from_source)
+
+    :param sources: {path of the source video: list of (video name, start, end)}
+    :param n_workers, frame_step, scale, backend: see extract_landmarks_from_videos
+    :return: iterator of the lists of (video name, number of frames) of the sources,
+             as they are saved
+    """
+    n_workers = min(
+        n_workers or min(multiprocessing.cpu_count(), MAX_DEFAULT_WORKERS), len(sources)
+    )
+    tasks = [
+        (source_path, ranges, with_pose, frame_step, scale)
+        for source_path, ranges in sources.items()
+    ]
+    if n_workers <= 1:
+        with get_landmark_backend(backend, **DETECTION_PARAMS) as landmark_backend:
+            for source_path, ranges, *_ in tasks:
+                yield save_landmarks_from_source(
+                    source_path, ranges, with_pose, landmark_backend, frame_step, scale
+                )
+        return
+
+    with _get_extraction_pool(n_workers, backend) as pool:
+        yield from pool.imap_unordered(_extract_source, tasks)
+
+
 def save_array(arr, path):
     file = open(path, "wb")
     pkl.dump(arr, file)
     file.close()
 
 
+@contextmanager
+def atomic_write(path: str, suffix=".tmp"):
+    """
+    Write a file next to its path, then rename it: an interrupted write never leaves
+    a partial file at path, and the readers of the previous file keep their copy
+
+    :param suffix: suffix of the temporary path
+    :return: context manager giving the temporary path to write; the file is renamed
+             on exit, or removed if an exception is raised
+    """
+    temporary_path = f"{path}{suffix}"
+    try:
+        yield temporary_path
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
 def load_array(path):
     file = open(path, "rb")
     arr = pkl.load(file)
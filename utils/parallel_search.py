@@ -0,0 +1,242 @@
+import atexit
+import multiprocessing as mp
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from models.reference_index import ReferenceIndex, ReferencePartition
+from models.sign_model import SignModel
+from utils.dtw import (
+    SearchResult,
+    get_joint_partition,
+    get_recorded_hands,
+    get_search_result,
+    new_pruning_stats,
+    search_partition,
+    select_nearest,
+    shortlist_candidates,
+)
+
+
+# Shards of the reference set attached by the worker process, {(partition key, shard): partition}
+_worker_shards = {}
+# SharedMemory objects of the worker process, kept alive as long as the worker
+_worker_shared_memory = []
+
+
+def _share_array(array: np.ndarray, segments: list):
+    """
+    Copy an array into a new shared memory segment
+
+    :param segments: list of the created segments, the new one is appended to it
+    :return: descriptor (name, shape, dtype) used to attach the array in another process
+    """
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=segment.buf)[...] = array
+    segments.append(segment)
+    return segment.name, array.shape, array.dtype.str
+
+
+def _attach_segment(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach a shared memory segment without registering it with the resource tracker:
+    the segments are owned and unlinked by the parent process only
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    # Before Python 3.13, attaching registers the segment like creating it (bpo-38119):
+    # the tracker would then report it as leaked, or unlink it under the parent.
+    # Unregistering it afterwards is not an option, the workers sharing the tracker
+    # of the parent, whose registration would be dropped.
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+def _attach_array(descriptor) -> np.ndarray:
+    """Read-only view on an array shared by _share_array"""
+    name, shape, dtype = descriptor
+    segment = _attach_segment(name)
+    _worker_shared_memory.append(segment)
+    array = np.ndarray(shape, dtype, buffer=segment.buf)
+    array.flags.writeable = False
+    return array
+
+
+def _get_partitions(reference_index: ReferenceIndex):
+    """
+    Iterate over the (key, partition) of the ReferenceIndex, including the partitions
+    of the joint embeddings, whose key is the key of their partition followed by "joint"
+    """
+    for key, partition in reference_index.partitions.items():
+        yield key, partition
+        if partition.joint is not None:
+            yield key + ("joint",), partition.joint
+
+
+def _init_worker(layout):
+    """
+    Attach the worker process to the shared reference embeddings
+
+    :param layout: {partition key: (ids, offsets, {hand: descriptor},
+                    {hand: descriptor of the weights} or None,
+                    {(hand, window): (radii, lower descriptor, upper descriptor)}, bounds)},
+                   bounds being the (start, end) positions of each shard of the partition
+    """
+    for key, (ids, offsets, blocks, weights, envelopes, bounds) in layout.items():
+        partition = ReferencePartition(
+            ids,
+            offsets,
+            {hand: _attach_array(block) for hand, block in blocks.items()},
+            weights and {hand: _attach_array(block) for hand, block in weights.items()},
+        )
+        for envelope_key, (radii, lower, upper) in envelopes.items():
+            partition.envelopes[envelope_key] = (
+                radii,
+                _attach_array(lower),
+                _attach_array(upper),
+            )
+        for shard, (start, end) in enumerate(bounds):
+            _worker_shards[(key, shard)] = partition.get_shard(start, end)
+
+
+def _search_shard(task):
+    """Search the k nearest references of one shard, run in a worker process"""
+    shard_key, recorded_hands, engine, window, k, candidates = task
+    stats = new_pruning_stats()
+    ids, distances = search_partition(
+        _worker_shards[shard_key], recorded_hands, engine, window, k, stats, candidates
+    )
+    return ids, distances, stats
+
+
+class ParallelSearch(object):
+    """
+    Search of the nearest reference signs sharded across a persistent pool of processes
+
+    The embeddings (and the LB_Keogh envelopes already computed) of the ReferenceIndex
+    are copied once into shared memory, which the workers attach to when the pool starts.
+    Each partition is split into one shard of consecutive references per worker:
+    a query searches the local k nearest references of every shard in parallel,
+    then the shards are merged.
+
+    Params
+        reference_index: ReferenceIndex of the reference signs
+        n_workers: number of worker processes (and of shards per partition)
+    """
+
+    def __init__(self, reference_index: ReferenceIndex, n_workers: int = None):
+        self.reference_index = reference_index
+        self.n_workers = n_workers or mp.cpu_count()
+
+        self._segments = []
+        self._bounds = {}
+        layout = {}
+        for key, partition in _get_partitions(reference_index):
+            # Consecutive references, so that each shard is a view on the shared blocks
+            edges = np.linspace(0, len(partition), self.n_workers + 1).astype(int)
+            bounds = [(start, end) for start, end in zip(edges[:-1], edges[1:]) if start < end]
+            self._bounds[key] = bounds
+
+            blocks = {
+                hand: _share_array(block, self._segments)
+                for hand, block in partition.blocks.items()
+            }
+            weights = partition.weights and {
+                hand: _share_array(block, self._segments)
+                for hand, block in partition.weights.items()
+            }
+            envelopes = {
+                envelope_key: (
+                    radii,
+                    _share_array(lower, self._segments),
+                    _share_array(upper, self._segments),
+                )
+                for envelope_key, (radii, lower, upper) in partition.envelopes.items()
+            }
+            layout[key] = (partition.ids, partition.offsets, blocks, weights, envelopes, bounds)
+
+        self.pool = mp.Pool(self.n_workers, initializer=_init_worker, initargs=(layout,))
+        atexit.register(self.close)
+
+    def search(
+        self,
+        recorded_sign: SignModel,
+        engine: str = "dtw",
+        window=None,
+        k: int = None,
+        labels: np.ndarray = None,
+        joint: bool = False,
+        shortlist: int = None,
+        shortlist_metric: str = "euclidean",
+    ) -> SearchResult:
+        """
+        Same search as utils.dtw.dtw_distances, run on all the shards in parallel
+        """
+        stats = new_pruning_stats()
+        key = (bool(recorded_sign.has_left_hand), bool(recorded_sign.has_right_hand))
+        partition = self.reference_index.partitions.get(key)
+        if partition is None:
+            return get_search_result(self.reference_index, [], [], stats)
+
+        candidates = None
+        if labels is not None:
+            candidates = np.flatnonzero(
+                np.isin(self.reference_index.labels[partition.ids], labels)
+            )
+
+        if joint and get_joint_partition(partition, recorded_sign) is not partition:
+            key, partition = key + ("joint",), partition.joint
+        recorded_hands = get_recorded_hands(recorded_sign, partition.hands)
+
+        # The candidates are selected once, then split between the shards
+        if shortlist is not None:
+            candidates = shortlist_candidates(
+                partition, recorded_hands, shortlist, stats, candidates, shortlist_metric
+            )
+        shard_candidates = [None] * len(self._bounds[key])
+        if candidates is not None:
+            shard_candidates = [
+                candidates[(candidates >= start) & (candidates < end)] - start
+                for start, end in self._bounds[key]
+            ]
+
+        tasks = [
+            ((key, shard), recorded_hands, engine, window, k, shard_candidates[shard])
+            for shard in range(len(self._bounds[key]))
+        ]
+
+        # Merge of the local nearest references of each shard
+        ids, distances = [], []
+        for shard_ids, shard_distances, shard_stats in self.pool.map(_search_shard, tasks):
+            ids.append(shard_ids)
+            distances.append(shard_distances)
+            for stage, count in shard_stats.items():
+                stats[stage] += count
+        ids, distances = np.concatenate(ids), np.concatenate(distances)
+
+        nearest = select_nearest(distances, len(distances) if k is None else k)
+        return get_search_result(self.reference_index, ids[nearest], distances[nearest], stats)
+
+    def close(self):
+        """Stop the workers and release the shared memory"""
+        if self.pool is None:
+            return
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = None
+        for segment in self._segments:
+            segment.close()
+            segment.unlink()
+        self._segments = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,251 @@
+"""
+Dimensionality reduction of the hand embeddings: the angle matrix is symmetric with a null
+diagonal, so only its upper triangle is kept, then projected on its principal components
+(or on a random basis). The projection is fitted on the reference signs, stored with
+the dataset and applied to the references and to the recorded signs alike.
+
+Fit the projection of the dataset:
+python -m utils.projection [--method {pca,random}] [--n-components N]
+Leave-one-out accuracy and search time for several numbers of components:
+python -m utils.projection --report
+"""
+import argparse
+import os
+import pickle as pkl
+import time
+from collections import Counter
+from typing import List, NamedTuple
+
+import numpy as np
+
+from models.hand_model import NB_CONNECTIONS
+from models.reference_index import ReferenceIndex
+from models.sign_model import SignModel
+from utils.dtw import dtw_distances
+from utils.landmark_utils import save_array
+
+
+PROJECTION_PATH = os.path.join("data", "dataset", "projection.pickle")
+PROJECTION_METHODS = ("pca", "random")
+
+# Positions in the embedding of the angles of the upper triangle of the angle matrix
+UPPER_TRIANGLE = np.ravel_multi_index(
+    np.triu_indices(NB_CONNECTIONS, k=1), (NB_CONNECTIONS, NB_CONNECTIONS)
+)
+
+
+class Projection(NamedTuple):
+    """
+    Linear projection of the upper triangle of the hand embeddings
+
+    mean: array of size len(UPPER_TRIANGLE), subtracted before the projection
+    components: array of shape (len(UPPER_TRIANGLE), n_components)
+    """
+
+    mean: np.ndarray
+    components: np.ndarray
+
+    @property
+    def n_components(self) -> int:
+        return self.components.shape[1]
+
+    def transform(self, embedding: np.ndarray) -> np.ndarray:
+        """
+        :param embedding: array of shape (n_frames, k * nb_connections * nb_connections),
+                          the embedding of k hands side by side (k = 2 for a joint embedding)
+        :return: array of shape (n_frames, k * n_components); the null embedding of
+                 a missing hand stays null
+        """
+        embedding = np.asarray(embedding, dtype=float)
+        if embedding.shape[1] % (NB_CONNECTIONS * NB_CONNECTIONS) != 0:
+            raise ValueError("The projection only applies to the angle embedding")
+        n_hands = embedding.shape[1] // (NB_CONNECTIONS * NB_CONNECTIONS)
+        hands = embedding.reshape((len(embedding), n_hands, NB_CONNECTIONS * NB_CONNECTIONS))
+        projected = (hands[:, :, UPPER_TRIANGLE] - self.mean) @ self.components
+        projected[~hands.any(axis=2)] = 0
+        return projected.reshape((len(embedding), n_hands * self.n_components))
+
+    def apply(self, sign_model: SignModel) -> SignModel:
+        """Project the embeddings of a SignModel in place"""
+        for name in ("lh", "rh", "joint"):
+            embedding = getattr(sign_model, f"{name}_embedding")
+            if embedding is not None:
+                setattr(sign_model, f"{name}_embedding", self.transform(embedding))
+        return sign_model
+
+
+def fit_projection(
+    embeddings: List[np.ndarray], n_components=32, method="pca", seed=0
+) -> Projection:
+    """
+    :param embeddings: list of hand embeddings,
+                       arrays of shape (n_frames, nb_connections * nb_connections)
+    :param method: "pca" (principal components of the frames of the embeddings)
+                   or "random" (Gaussian random projection, the embeddings are only centered)
+    """
+    if method not in PROJECTION_METHODS:
+        raise ValueError(f"Unknown projection {method}, expected one of {PROJECTION_METHODS}")
+
+    frames = np.concatenate(
+        [np.asarray(embedding)[:, UPPER_TRIANGLE] for embedding in embeddings]
+    )
+    mean = frames.mean(axis=0)
+    if method == "pca":
+        _, _, vh = np.linalg.svd(frames - mean, full_matrices=False)
+        components = vh[:n_components].T
+    else:
+        rng = np.random.default_rng(seed)
+        components = rng.normal(size=(len(UPPER_TRIANGLE), n_components)) / np.sqrt(n_components)
+    return Projection(mean, components)
+
+
+def fit_reference_projection(reference_index: ReferenceIndex, n_components=32, method="pca"):
+    """Fit a projection on the frames of both hands of the reference signs"""
+    embeddings = [
+        partition.blocks[hand]
+        for partition in reference_index.partitions.values()
+        for hand in partition.hands
+    ]
+    return fit_projection(embeddings, n_components, method)
+
+
+def save_projection(projection: Projection, videos: List[str], path=PROJECTION_PATH):
+    """
+    Save the projection with the list of the videos it was fitted on
+    """
+    save_array(
+        {"videos": sorted(videos), "mean": projection.mean, "components": projection.components},
+        path,
+    )
+
+
+def load_projection(videos: List[str], path=PROJECTION_PATH):
+    """
+    :return: the Projection of the dataset,
+             None if it was not fitted or not fitted on the given videos
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as file:
+        projection = pkl.load(file)
+    if projection["videos"] != sorted(videos):
+        print("Projection is out of date, run: python -m utils.projection")
+        return None
+    return Projection(projection["mean"], projection["components"])
+
+
+def _project_copy(projection: Projection, sign_model: SignModel) -> SignModel:
+    """Projected copy of a SignModel, which is left unchanged"""
+    copy = SignModel.from_embeddings(
+        sign_model.lh_embedding, sign_model.rh_embedding, sign_model.joint_embedding
+    )
+    return projection.apply(copy)
+
+
+def _is_recognized(result, name: str, batch_size: int, threshold: float, excluded=None) -> bool:
+    """
+    Whether the vote of SignRecorder over the batch_size nearest references of a search
+    result, without the reference excluded, gives the name of the sign
+    """
+    nearest = [
+        ref_name for ref_idx, ref_name in zip(result.ids, result.names) if ref_idx != excluded
+    ]
+    votes = Counter(nearest[:batch_size]).most_common()
+    return bool(votes) and votes[0][1] / batch_size >= threshold and votes[0][0] == name
+
+
+def leave_one_out(
+    names: List[str],
+    sign_models: List[SignModel],
+    batch_size=5,
+    threshold=0.2,
+    window=None,
+    n_components: int = None,
+    method="pca",
+):
+    """
+    Leave-one-out evaluation: each reference is recognized among the other ones,
+    with the vote of SignRecorder over the batch_size nearest references
+
+    :param n_components: number of components of a projection fitted, for each reference,
+                         on the other ones only (the reference held out is then projected
+                         like a recorded sign), None to keep the embeddings
+    :param method: method of the projection, see fit_projection
+    :return: accuracy and mean search time in seconds
+    """
+    n_correct, duration = 0, 0
+    if n_components is None:
+        reference_index = ReferenceIndex.from_sign_models(names, sign_models)
+        for idx, sign_model in enumerate(sign_models):
+            start = time.perf_counter()
+            result = dtw_distances(sign_model, reference_index, "dtw", window, k=batch_size + 1)
+            duration += time.perf_counter() - start
+            n_correct += _is_recognized(result, names[idx], batch_size, threshold, idx)
+        return n_correct / len(sign_models), duration / len(sign_models)
+
+    for idx, sign_model in enumerate(sign_models):
+        others = sign_models[:idx] + sign_models[idx + 1 :]
+        projection = fit_projection(
+            [
+                getattr(other, f"{hand}_embedding")
+                for other in others
+                for hand, has_hand in (("lh", other.has_left_hand), ("rh", other.has_right_hand))
+                if has_hand
+            ],
+            n_components,
+            method,
+        )
+        reference_index = ReferenceIndex.from_sign_models(
+            names[:idx] + names[idx + 1 :], [_project_copy(projection, other) for other in others]
+        )
+        query = _project_copy(projection, sign_model)
+
+        start = time.perf_counter()
+        result = dtw_distances(query, reference_index, "dtw", window, k=batch_size)
+        duration += time.perf_counter() - start
+        n_correct += _is_recognized(result, names[idx], batch_size, threshold)
+    return n_correct / len(sign_models), duration / len(sign_models)
+
+
+def report(names: List[str], sign_models: List[SignModel], method="pca", window=None):
+    """
+    Print the leave-one-out accuracy and search time for several numbers of components,
+    the projection being fitted without the reference held out
+    """
+    accuracy, duration = leave_one_out(names, sign_models, window=window)
+    print(
+        f"{'full':>10} {NB_CONNECTIONS * NB_CONNECTIONS:4d}-D: "
+        f"accuracy {accuracy:.3f}  {duration * 1000:8.1f} ms/query"
+    )
+
+    for n_components in (len(UPPER_TRIANGLE), 64, 32, 16, 8):
+        accuracy, duration = leave_one_out(
+            names, sign_models, window=window, n_components=n_components, method=method
+        )
+        print(
+            f"{method:>10} {n_components:4d}-D: "
+            f"accuracy {accuracy:.3f}  {duration * 1000:8.1f} ms/query"
+        )
+
+
+if __name__ == "__main__":
+    from utils.dataset_utils import load_dataset, load_reference_signs, load_sign_landmarks
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--method", choices=PROJECTION_METHODS, default="pca")
+    parser.add_argument("--n-components", type=int, default=32)
+    parser.add_argument("--report", action="store_true")
+    args = parser.parse_args()
+
+    videos = load_dataset()
+    if args.report:
+        names = [video_name.split("-")[0] for video_name in videos]
+        sign_models = [SignModel(*load_sign_landmarks(video_name)) for video_name in videos]
+        report(names, sign_models, args.method)
+    else:
+        projection = fit_reference_projection(
+            load_reference_signs(videos), args.n_components, args.method
+        )
+        save_projection(projection, videos)
+        print(f"{projection.n_components}-D projection saved in {PROJECTION_PATH}")
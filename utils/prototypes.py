@@ -0,0 +1,279 @@
+"""
+DTW Barycenter Averaging (DBA) prototypes of the reference signs, for a two-stage recognition:
+the classes are ranked by their distance to the prototypes, then the recorded sign is
+only compared to the real clips of the closest classes.
+
+Build the prototypes of the dataset:
+python -m utils.prototypes [--n-prototypes N] [--window W] [--embedding NAME]
+"""
+import argparse
+import os
+import pickle as pkl
+from typing import List
+
+import numpy as np
+
+from models.hand_model import DEFAULT_EMBEDDING, EMBEDDINGS
+from models.reference_index import ReferenceIndex
+from models.sign_model import SignModel
+from utils.dtw import SearchResult, dtw_distance, dtw_distances, dtw_path
+from utils.landmark_utils import save_array
+from utils.parallel_search import ParallelSearch
+from utils.projection import Projection, load_projection
+
+
+PROTOTYPES_PATH = os.path.join("data", "dataset", "prototypes.pickle")
+
+
+def dba(sequences: List[np.ndarray], n_iterations=10, window=None) -> np.ndarray:
+    """
+    DTW Barycenter Averaging of sequences, starting from their medoid
+
+    :param sequences: list of arrays of shape (n_frames, d)
+    :param n_iterations: maximum number of refinements of the average
+    :param window: Sakoe-Chiba band of the alignments (see utils.dtw)
+    :return: the average sequence, array of shape (n_frames of the medoid, d)
+    """
+    sequences = [np.asarray(sequence, dtype=float) for sequence in sequences]
+    distances = _get_distance_matrix([[sequence] for sequence in sequences], window)
+    average = sequences[int(np.argmin(distances.sum(axis=1)))]
+
+    for _ in range(n_iterations):
+        # Frames of every sequence aligned with each frame of the average
+        aligned_frames = [[] for _ in range(len(average))]
+        for sequence in sequences:
+            _, path = dtw_path(average, sequence, window)
+            for i, j in path:
+                aligned_frames[i].append(sequence[j])
+
+        # The frame cost is the L1 distance: its barycenter is the coordinate-wise median
+        new_average = np.array([np.median(frames, axis=0) for frames in aligned_frames])
+        if np.allclose(new_average, average):
+            break
+        average = new_average
+    return average
+
+
+def _get_distance_matrix(clips: List[List[np.ndarray]], window=None) -> np.ndarray:
+    """
+    DTW distances between all the pairs of clips
+
+    :param clips: list of clips, each one being the list of its hand embeddings
+    """
+    distances = np.zeros((len(clips), len(clips)))
+    for a in range(len(clips)):
+        for b in range(a + 1, len(clips)):
+            distances[a, b] = distances[b, a] = sum(
+                dtw_distance(x, y, window) for x, y in zip(clips[a], clips[b])
+            )
+    return distances
+
+
+def _split_clips(
+    clips: List[List[np.ndarray]], n_groups: int, window=None
+) -> List[List[int]]:
+    """
+    Split clips into groups of similar clips: farthest-first medoids,
+    then assignment of each clip to its closest medoid
+
+    :return: list of the indices of the clips of each group
+    """
+    if n_groups <= 1:
+        return [list(range(len(clips)))]
+    if len(clips) <= n_groups:
+        return [[idx] for idx in range(len(clips))]
+
+    distances = _get_distance_matrix(clips, window)
+    medoids = [int(np.argmin(distances.sum(axis=1)))]
+    while len(medoids) < n_groups:
+        medoids.append(int(np.argmax(distances[:, medoids].min(axis=1))))
+
+    assignment = np.argmin(distances[:, medoids], axis=1)
+    groups = [np.flatnonzero(assignment == group).tolist() for group in range(n_groups)]
+    return [group for group in groups if group]
+
+
+def build_prototypes(
+    reference_index: ReferenceIndex, n_prototypes=1, n_iterations=10, window=None
+) -> ReferenceIndex:
+    """
+    Compute the DBA prototypes of each sign, separately for each hand configuration
+
+    :param reference_index: ReferenceIndex of the reference signs
+    :param n_prototypes: maximum number of prototypes per sign and hand configuration
+    :return: ReferenceIndex of the prototypes
+    """
+    names, lh_embeddings, rh_embeddings = [], [], []
+    for partition in reference_index.partitions.values():
+        labels = reference_index.labels[partition.ids]
+        for label in np.unique(labels):
+            positions = np.flatnonzero(labels == label)
+            clips = [
+                [partition.get_embedding(hand, position) for hand in partition.hands]
+                for position in positions
+            ]
+
+            for group in _split_clips(clips, n_prototypes, window):
+                prototype = {"lh": np.zeros((0, 0)), "rh": np.zeros((0, 0))}
+                for hand_idx, hand in enumerate(partition.hands):
+                    prototype[hand] = dba(
+                        [clips[idx][hand_idx] for idx in group], n_iterations, window
+                    ).astype(np.float32)
+
+                names.append(reference_index.sign_names[label])
+                lh_embeddings.append(prototype["lh"])
+                rh_embeddings.append(prototype["rh"])
+
+    return ReferenceIndex.from_embeddings(names, lh_embeddings, rh_embeddings)
+
+
+def save_prototypes(
+    prototypes: ReferenceIndex,
+    videos: List[str],
+    path=PROTOTYPES_PATH,
+    projection: Projection = None,
+    embedding: str = DEFAULT_EMBEDDING,
+):
+    """
+    Save the prototypes with the list of the videos they were built from,
+    the embedding of the hands and its projection
+    """
+    ids = np.arange(len(prototypes))
+    embeddings = {"lh": [np.zeros((0, 0))] * len(ids), "rh": [np.zeros((0, 0))] * len(ids)}
+    for partition in prototypes.partitions.values():
+        for hand in partition.hands:
+            for position, idx in enumerate(partition.ids):
+                embeddings[hand][idx] = np.array(partition.get_embedding(hand, position))
+
+    save_array(
+        {
+            "videos": sorted(videos),
+            "names": prototypes.get_names(ids),
+            "lh_embeddings": embeddings["lh"],
+            "rh_embeddings": embeddings["rh"],
+            "projection": None if projection is None else projection.components,
+            "projection_mean": None if projection is None else projection.mean,
+            "embedding": embedding,
+        },
+        path,
+    )
+
+
+def load_prototypes(
+    videos: List[str],
+    path=PROTOTYPES_PATH,
+    projection: Projection = None,
+    embedding: str = DEFAULT_EMBEDDING,
+):
+    """
+    :param projection: projection of the embeddings of the reference signs
+    :param embedding: name of the embedding of the hands of the reference signs
+    :return: ReferenceIndex of the prototypes, None if they were not built
+             from the given videos with the given embedding and projection
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "rb") as file:
+        prototypes = pkl.load(file)
+    components = None if projection is None else projection.components
+    mean = None if projection is None else projection.mean
+    if (
+        prototypes["videos"] != sorted(videos)
+        or prototypes.get("embedding", DEFAULT_EMBEDDING) != embedding
+        or not _is_same_array(prototypes.get("projection"), components)
+        or not _is_same_array(prototypes.get("projection_mean"), mean)
+    ):
+        print("Prototypes are out of date, run: python -m utils.prototypes")
+        return None
+    return ReferenceIndex.from_embeddings(
+        prototypes["names"], prototypes["lh_embeddings"], prototypes["rh_embeddings"]
+    )
+
+
+def _is_same_array(a, b) -> bool:
+    """Whether two arrays, or None, are equal"""
+    if a is None or b is None:
+        return a is None and b is None
+    return np.array_equal(a, b)
+
+
+def prototype_search(
+    recorded_sign: SignModel,
+    reference_index: ReferenceIndex,
+    prototypes: ReferenceIndex,
+    n_classes=3,
+    engine="dtw",
+    window=None,
+    k: int = None,
+    joint: bool = False,
+    shortlist: int = None,
+    shortlist_metric: str = "euclidean",
+    parallel_search: ParallelSearch = None,
+) -> SearchResult:
+    """
+    Two-stage search of the nearest references: the classes are ranked by the distance
+    of the recorded sign to their prototypes, then only the clips of the n_classes
+    closest classes are compared (see utils.dtw.dtw_distances)
+
+    :param prototypes: ReferenceIndex of the prototypes (see build_prototypes)
+    :param n_classes: number of classes kept by the first stage
+    :param parallel_search: ParallelSearch of reference_index running the second stage,
+                            None to run it in this process
+    """
+    # First stage: every prototype is compared
+    ranking = dtw_distances(recorded_sign, prototypes, engine, window, joint=joint)
+    closest_names = list(dict.fromkeys(ranking.names))[:n_classes]
+
+    # Second stage: only the clips of the closest classes
+    labels = np.flatnonzero(np.isin(reference_index.sign_names, closest_names))
+    if parallel_search is not None:
+        result = parallel_search.search(
+            recorded_sign, engine, window, k, labels, joint, shortlist, shortlist_metric
+        )
+    else:
+        result = dtw_distances(
+            recorded_sign,
+            reference_index,
+            engine,
+            window,
+            k,
+            labels,
+            joint,
+            shortlist,
+            shortlist_metric,
+        )
+    return result._replace(
+        pruning={**result.pruning, "prototypes": ranking.pruning["candidates"]}
+    )
+
+
+if __name__ == "__main__":
+    from utils.dataset_utils import load_dataset, load_reference_signs
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--n-prototypes", type=int, default=1)
+    parser.add_argument("--n-iterations", type=int, default=10)
+    parser.add_argument(
+        "--window",
+        type=lambda value: float(value) if "." in value else int(value),
+        default=None,
+        help="Sakoe-Chiba band: width in frames (int) or fraction of the lengths (float)",
+    )
+    parser.add_argument("--embedding", choices=tuple(EMBEDDINGS), default=DEFAULT_EMBEDDING)
+    args = parser.parse_args()
+
+    videos = load_dataset()
+    # The prototypes are built in the space of the projection of the dataset, if fitted
+    # (the projection only applies to the angles)
+    projection = None
+    if args.embedding == "angles":
+        projection = load_projection(videos)
+    reference_signs = load_reference_signs(
+        videos, projection=projection, embedding=args.embedding
+    )
+    prototypes = build_prototypes(
+        reference_signs, args.n_prototypes, args.n_iterations, args.window
+    )
+    save_prototypes(prototypes, videos, projection=projection, embedding=args.embedding)
+    print(f"{len(prototypes)} prototypes saved in {PROTOTYPES_PATH}")
@@ -0,0 +1,119 @@
+"""
+First stage of the search: every reference is resampled to a fixed number of frames and
+stacked in one tensor, so that a recorded sign resampled the same way is compared to all
+the references with a single matrix product. The closest references are then compared
+with the exact DTW.
+"""
+import numpy as np
+
+from models.reference_index import ReferenceIndex, ReferencePartition
+
+
+SHORTLIST_METRICS = ("euclidean", "cosine")
+
+# Number of frames of the resampled embeddings
+SHORTLIST_LENGTH = 16
+
+
+def resample_embedding(embedding: np.ndarray, length: int, weights: np.ndarray = None):
+    """
+    Linear interpolation of an embedding at length evenly spaced instants
+
+    :param embedding: array of shape (n_frames, d)
+    :param weights: number of frames merged in each frame (see utils.compression),
+                    which spreads the instants of the frames, None if not compressed
+    :return: array of shape (length, d)
+    """
+    embedding = np.asarray(embedding, dtype=float)
+    if len(embedding) == 1:
+        return np.repeat(embedding, length, axis=0)
+
+    if weights is None:
+        instants = np.arange(len(embedding), dtype=float)
+    else:
+        # Each frame stands at the middle of its segment
+        instants = np.cumsum(weights) - np.asarray(weights) / 2
+    targets = np.linspace(instants[0], instants[-1], length)
+
+    right = np.clip(np.searchsorted(instants, targets, side="right"), 1, len(embedding) - 1)
+    left = right - 1
+    ratios = ((targets - instants[left]) / (instants[right] - instants[left]))[:, None]
+    return (1 - ratios) * embedding[left] + ratios * embedding[right]
+
+
+def get_resampled_block(partition: ReferencePartition, hand: str, length: int):
+    """
+    Embeddings of the hand of the references of a partition resampled to length frames,
+    cached in the partition
+
+    :return: float32 array of shape (n_references, length * d) and
+             array of size n_references, squared norm of each row
+    """
+    if (hand, length) not in partition.resampled:
+        block = np.empty((len(partition), length * partition.blocks[hand].shape[1]), np.float32)
+        for position in range(len(partition)):
+            block[position] = resample_embedding(
+                partition.get_embedding(hand, position),
+                length,
+                partition.get_weights(hand, position),
+            ).reshape(-1)
+        squared_norms = np.einsum("ij,ij->i", block, block, dtype=float)
+        partition.resampled[(hand, length)] = (block, squared_norms)
+    return partition.resampled[(hand, length)]
+
+
+def precompute_resampled(reference_index: ReferenceIndex, length: int):
+    """
+    Resample the reference signs once at load time, so that it is not done
+    during the first search
+    """
+    for partition in reference_index.partitions.values():
+        for part in (partition, partition.joint):
+            if part is None:
+                continue
+            for hand in part.hands:
+                get_resampled_block(part, hand, length)
+
+
+def get_shortlist(
+    partition: ReferencePartition,
+    recorded_hands,
+    size: int,
+    length: int = SHORTLIST_LENGTH,
+    metric: str = "euclidean",
+    candidates: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Positions of the size references of the partition closest to the recorded sign,
+    once both are resampled to length frames
+
+    :param recorded_hands: list of (hand, embedding, weights) of the recorded sign
+    :param metric: "euclidean" (squared Euclidean distance summed over the hands)
+                   or "cosine" (cosine distance summed over the hands)
+    :param candidates: positions of the references to consider, None for all of them
+    :return: sorted positions of the references of the shortlist
+    """
+    if metric not in SHORTLIST_METRICS:
+        raise ValueError(f"Unknown shortlist metric {metric}, expected one of {SHORTLIST_METRICS}")
+    if candidates is None:
+        candidates = np.arange(len(partition))
+    if size >= len(candidates):
+        return candidates
+
+    distances = np.zeros(len(partition))
+    for hand, rec_hand, rec_weights in recorded_hands:
+        block, squared_norms = get_resampled_block(partition, hand, length)
+        query = resample_embedding(rec_hand, length, rec_weights).reshape(-1)
+
+        # One matrix-vector product for all the references
+        products = block @ query.astype(np.float32)
+        query_norm = query @ query
+        if metric == "euclidean":
+            distances += squared_norms - 2 * products + query_norm
+        else:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                cosines = products / np.sqrt(squared_norms * query_norm)
+            distances += 1 - np.nan_to_num(cosines)
+
+    shortlist = candidates[np.argpartition(distances[candidates], size - 1)[:size]]
+    return np.sort(shortlist)
@@ -0,0 +1,197 @@
+"""
+Build of the dataset straight from the source videos of yt_links.csv: the rows are grouped
+by source video, each source is decoded once, and the frames of the time range of each
+sign are given to the landmark extraction, without cutting nor decoding a clip per sign.
+
+The sources are data/sources/<id>.mp4, downloaded by yt_download.py or any local videos
+named after the ids of the rows. The landmarks are recorded in the manifest of the dataset
+with the source and the range they were extracted from (see utils.dataset_manifest);
+the clips of data/videos take precedence over the ranges of the same videos.
+
+python -m utils.source_dataset [--links yt_links.csv] [--sources data/sources] [--with-pose]
+"""
+import argparse
+import csv
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from tqdm import tqdm
+
+from utils.dataset_manifest import DatasetManifest, scan_videos
+from utils.landmark_backend import DEFAULT_BACKEND, LANDMARK_BACKENDS
+from utils.landmark_store import DATASET_PATH, get_landmark_path
+from utils.landmark_utils import extract_landmarks_from_sources, get_extraction_params
+
+
+LINKS_PATH = "yt_links.csv"
+SOURCES_PATH = os.path.join("data", "sources")
+
+
+class SignRange(NamedTuple):
+    """
+    Video of the dataset cut from a source video
+
+    video_name: name of the video, <sign name>-<source id>
+    start: start of the sign in the source, in seconds
+    end: end of the sign in the source, in seconds, None up to the end of the source
+    """
+
+    video_name: str
+    start: float
+    end: Optional[float]
+
+
+def parse_time(value: str) -> Optional[float]:
+    """
+    :param value: time hh:mm:ss.ms of yt_links.csv (or mm:ss.ms, or ss.ms)
+    :return: the time in seconds, None if the value is empty
+    """
+    value = (value or "").strip()
+    if not value:
+        return None
+    seconds = 0.0
+    for part in value.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def read_links(links_path=LINKS_PATH) -> Dict[str, List[SignRange]]:
+    """
+    :param links_path: CSV file with the columns name, id, start_time and duration_time,
+                       the times being empty for the whole source video
+    :return: {source id: ranges of the signs cut from the source}
+    """
+    links = {}
+    with open(links_path, newline="", encoding="utf-8") as file:
+        for row in csv.DictReader(file):
+            source_id = row["id"].strip()
+            start = parse_time(row["start_time"]) or 0.0
+            duration = parse_time(row["duration_time"])
+            links.setdefault(source_id, []).append(
+                SignRange(
+                    f"{row['name'].strip()}-{source_id}",
+                    start,
+                    None if duration is None else start + duration,
+                )
+            )
+    return links
+
+
+def get_source_path(source_id: str, sources_path=SOURCES_PATH) -> str:
+    return os.path.join(sources_path, source_id + ".mp4")
+
+
+def get_range_params(params: dict, source_id: str, sign_range: SignRange) -> dict:
+    """Parameters of the extraction of a range, recorded in the manifest"""
+    return {**params, "source": source_id, "start": sign_range.start, "end": sign_range.end}
+
+
+def build_dataset_from_links(
+    links_path=LINKS_PATH,
+    sources_path=SOURCES_PATH,
+    with_pose=False,
+    n_workers=None,
+    frame_step=1,
+    scale=1.0,
+    backend=DEFAULT_BACKEND,
+) -> List[str]:
+    """
+    Extract the landmarks of the ranges of the links that are new or whose source
+    changed since their extraction; the landmarks of the rows removed are deleted.
+    The ranges whose source is missing keep their landmarks, if they are still on disk.
+
+    :param links_path: CSV file of the ranges of the signs (see read_links)
+    :param sources_path: folder of the source videos, named <id>.mp4
+    :param with_pose, n_workers, frame_step, scale, backend: see load_dataset
+    :return: the names of the videos of the links whose landmarks are extracted
+    """
+    os.makedirs(DATASET_PATH, exist_ok=True)
+    params = get_extraction_params(with_pose, frame_step, scale, backend)
+    manifest = DatasetManifest()
+    links = read_links(links_path)
+    clips = scan_videos()
+    video_names = [
+        sign_range.video_name for ranges in links.values() for sign_range in ranges
+    ]
+
+    # Landmarks of the rows removed from the links
+    orphans = [
+        video_name
+        for video_name, entry in manifest.entries.items()
+        if "source" in entry.params and video_name not in video_names
+    ]
+    for video_name in orphans:
+        if os.path.exists(get_landmark_path(video_name)):
+            os.remove(get_landmark_path(video_name))
+    manifest.remove(orphans)
+
+    # {video name: (source path, stat of the source, parameters)} of the ranges to extract
+    pending = {}
+    sources = {}
+    for source_id, ranges in links.items():
+        source_path = get_source_path(source_id, sources_path)
+        ranges = [sign_range for sign_range in ranges if sign_range.video_name not in clips]
+        if not os.path.exists(source_path):
+            n_missing = sum(
+                not os.path.exists(get_landmark_path(sign_range.video_name))
+                for sign_range in ranges
+            )
+            if n_missing > 0:
+                print(f"Source video {source_path} not found: {n_missing} signs skipped")
+            continue
+
+        stat = os.stat(source_path)
+        for sign_range in ranges:
+            range_params = get_range_params(params, source_id, sign_range)
+            if not manifest.check(sign_range.video_name, stat, range_params, source_path):
+                pending[sign_range.video_name] = (source_path, stat, range_params)
+                sources.setdefault(source_path, []).append(sign_range)
+
+    n = len(pending)
+    if n > 0:
+        print(f"\nExtracting landmarks from {len(sources)} source videos: {n} signs\n")
+
+        start, n_frames = time.perf_counter(), 0
+        with tqdm(total=n, unit="video") as progress:
+            for results in extract_landmarks_from_sources(
+                sources, with_pose, n_workers, frame_step, scale, backend
+            ):
+                for video_name, video_frames in results:
+                    source_path, stat, range_params = pending[video_name]
+                    manifest.add(video_name, stat, range_params, source_path)
+                    n_frames += video_frames
+                # Saved after each source, so that an interrupted extraction resumes from there
+                manifest.save()
+                progress.set_postfix(fps=f"{n_frames / (time.perf_counter() - start):.1f}")
+                progress.update(len(results))
+    manifest.save()
+
+    return [
+        video_name
+        for video_name in video_names
+        if video_name in manifest.entries and os.path.exists(get_landmark_path(video_name))
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--links", default=LINKS_PATH, help="CSV file of the signs")
+    parser.add_argument("--sources", default=SOURCES_PATH, help="Folder of the source videos")
+    parser.add_argument("--with-pose", action="store_true", help="Store the pose landmarks")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes")
+    parser.add_argument("--frame-step", type=int, default=1)
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--backend", choices=tuple(LANDMARK_BACKENDS), default=DEFAULT_BACKEND)
+    args = parser.parse_args()
+
+    videos = build_dataset_from_links(
+        args.links,
+        args.sources,
+        args.with_pose,
+        args.workers,
+        args.frame_step,
+        args.scale,
+        args.backend,
+    )
+    print(f"{len(videos)} videos of the links in the dataset")
@@ -0,0 +1,281 @@
+"""
+Spotting of the reference signs in a continuous stream of frames, without recording:
+subsequence DTW (SPRING) advanced one frame at a time against every reference.
+"""
+from collections import deque
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from models.reference_index import ReferenceIndex
+from utils.dtw import get_bucket_weights, get_buckets
+
+
+class Detection(NamedTuple):
+    """
+    Occurrence of a reference sign detected in the stream
+
+    name: name of the sign of the reference
+    id: position of the reference in the ReferenceIndex
+    distance: DTW distance of the subsequence, divided by the length of the reference
+    start: index of the first frame of the subsequence in the stream
+    end: index of the last frame of the subsequence in the stream
+    """
+
+    name: str
+    id: int
+    distance: float
+    start: int
+    end: int
+
+
+def spring_step(
+    costs: np.ndarray, column: np.ndarray, starts: np.ndarray, frame: int
+):
+    """
+    Advance the SPRING DTW columns of several references by one frame of the stream.
+    A warping path can start at any frame: the cell before the first frame of
+    the references costs 0 on every frame of the stream. As in SPRING, the first frame
+    of the best path ending in each cell is an integer carried along the column,
+    taken from the predecessor the path comes from (the one with the lowest cost).
+
+    :param costs: array of shape (n_references, m), cost between the frame and
+                  each frame of the references
+    :param column: array of shape (n_references, m), DTW column of the previous frame
+                   (inf where no path ends)
+    :param starts: int array of shape (n_references, m), first frame in the stream
+                   of the best path ending in each cell of the previous column
+    :param frame: index of the frame in the stream
+    :return: the new column and the new starts
+    """
+    n_references, m = costs.shape
+
+    # Previous column shifted by one: index 0 stands for the cell before the first frame
+    previous = np.empty((n_references, m + 1))
+    previous[:, 0] = 0
+    previous[:, 1:] = column
+    previous_starts = np.empty((n_references, m + 1), dtype=np.int64)
+    previous_starts[:, 0] = frame
+    previous_starts[:, 1:] = starts
+
+    # Best of the diagonal and horizontal moves (same recurrence as utils.dtw.dtw_distance)
+    is_diagonal = previous[:, :-1] <= previous[:, 1:]
+    best = costs + np.where(is_diagonal, previous[:, :-1], previous[:, 1:])
+    best_starts = np.where(is_diagonal, previous_starts[:, :-1], previous_starts[:, 1:])
+
+    # Vertical moves: new[j] = min_k<=j (best[k] + costs[k+1] + ... + costs[j])
+    cumulative_cost = np.cumsum(costs, axis=1)
+    entries = best - cumulative_cost
+    lowest_entries = np.minimum.accumulate(entries, axis=1)
+    new_column = cumulative_cost + lowest_entries
+
+    # Cell of the column where the best path ending in each cell entered it: the argmin
+    # k of entries[k] over k <= j, i.e. the last cell whose entry is the running minimum
+    # (the values compared are the same floats, so the argmin is exact)
+    positions = np.broadcast_to(np.arange(m), (n_references, m))
+    entry = np.maximum.accumulate(
+        np.where(entries == lowest_entries, positions, 0), axis=1
+    )
+    new_starts = np.take_along_axis(best_starts, entry, axis=1)
+    return new_column, new_starts
+
+
+class SignSpotter(object):
+    """
+    Continuous detection of the reference signs in a stream of hand embeddings
+
+    One DTW column per reference and hand is kept and advanced on every frame where
+    the hand is detected (SPRING: the matches may start on any frame of the stream).
+    A match of a reference is reported once it can no longer be improved by
+    the following frames, if its distance, divided by the length of the reference,
+    is below the threshold.
+
+    The two hands of a two-handed reference are aligned separately, each one on its own
+    warping path (their embeddings are not on a shared timeline, see SignModel): the
+    distance of a match ending on a frame is the sum of the distances of the best path
+    of each hand ending on that frame, and it starts at the earliest of their starts.
+
+    Params
+        reference_index: ReferenceIndex of the reference signs
+        threshold: maximum distance per frame of the reference of a detection
+        max_gap: number of consecutive frames without any hand that ends every match
+    Args
+        frame: index of the next frame of the stream
+    """
+
+    def __init__(self, reference_index: ReferenceIndex, threshold: float, max_gap=10):
+        self.reference_index = reference_index
+        self.threshold = threshold
+        self.max_gap = max_gap
+
+        # States of the references with hands: key of the partition -> dict of arrays
+        self._states = {}
+        for key, partition in reference_index.partitions.items():
+            if not partition.hands:
+                continue
+            lengths = sum(partition.get_lengths(hand) for hand in partition.hands)
+            self._states[key] = {
+                "lengths": lengths,
+                # Buckets of each hand: (positions, embeddings, lengths, column, starts)
+                "buckets": {
+                    hand: [
+                        [positions, bucket, lengths, None, None]
+                        for positions, bucket, lengths in get_buckets(partition, hand)
+                    ]
+                    for hand in partition.hands
+                },
+                # Weights of the frames of the references of each bucket (see utils.compression)
+                "weights": {
+                    hand: get_bucket_weights(partition, hand) for hand in partition.hands
+                },
+                # Best match not yet reported of each reference
+                "distances": np.full(len(partition), np.inf),
+                "starts": np.zeros(len(partition), dtype=np.int64),
+                "ends": np.zeros(len(partition), dtype=np.int64),
+            }
+        self.frame = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the matches in progress (the frames keep their index in the stream)"""
+        self._gap = 0
+        # Hands detected in the last frames, to check the hands of the matches
+        self._history = deque(maxlen=10 * self._get_max_length() + self.max_gap)
+        for state in self._states.values():
+            for buckets in state["buckets"].values():
+                for bucket_state in buckets:
+                    bucket = bucket_state[1]
+                    bucket_state[3] = np.full(bucket.shape[:2], np.inf)
+                    bucket_state[4] = np.zeros(bucket.shape[:2], dtype=np.int64)
+            state["distances"][:] = np.inf
+
+    def update(
+        self, lh_embedding: Optional[np.ndarray], rh_embedding: Optional[np.ndarray]
+    ) -> Optional[Detection]:
+        """
+        Process the next frame of the stream
+
+        :param xh_embedding: array of size nb_connections * nb_connections,
+                             feature vector of the x hand, None if not detected
+        :return: the Detection of a sign ending before this frame, None if there is none
+        """
+        embeddings = {"lh": lh_embedding, "rh": rh_embedding}
+        frame = self.frame
+        self.frame += 1
+        self._history.append((lh_embedding is not None, rh_embedding is not None))
+
+        if lh_embedding is None and rh_embedding is None:
+            self._gap += 1
+            if self._gap < self.max_gap:
+                return None
+            # Every match in progress is over: the best pending one is reported
+            detection = self._get_best_match(None)
+            self.reset()
+            return detection
+        self._gap = 0
+
+        for state in self._states.values():
+            for hand, buckets in state["buckets"].items():
+                if embeddings[hand] is None:
+                    continue
+                embedding = np.asarray(embeddings[hand], dtype=np.float32)
+                weights = state["weights"][hand]
+                for idx, bucket_state in enumerate(buckets):
+                    _, bucket, _, column, starts = bucket_state
+                    costs = np.abs(bucket - embedding).sum(axis=2, dtype=float)
+                    # The frames of the stream weigh 1, less than any frame of the references
+                    if weights is not None:
+                        costs *= weights[idx]
+                    bucket_state[3], bucket_state[4] = spring_step(
+                        costs, column, starts, frame
+                    )
+            self._update_matches(state, frame)
+
+        return self._get_best_match(frame)
+
+    def _update_matches(self, state, frame: int):
+        """Keep the best match ending on this frame of each reference, if below threshold"""
+        distances = np.zeros(len(state["distances"]))
+        starts = np.full(len(state["distances"]), frame, dtype=np.int64)
+        for buckets in state["buckets"].values():
+            for positions, _, lengths, column, column_starts in buckets:
+                # Last frame of each reference, before the padding of its bucket
+                ends = np.arange(len(positions)), lengths - 1
+                distances[positions] += column[ends]
+                starts[positions] = np.minimum(starts[positions], column_starts[ends])
+
+        is_better = (distances <= self.threshold * state["lengths"]) & (
+            distances < state["distances"]
+        )
+        state["distances"][is_better] = distances[is_better]
+        state["starts"][is_better] = starts[is_better]
+        state["ends"][is_better] = frame
+
+    def _get_best_match(self, frame: Optional[int]) -> Optional[Detection]:
+        """
+        Report the best confirmed match: no path in progress, of any hand, starting
+        before its end can still get a lower distance (SPRING condition)
+
+        :param frame: index of the current frame, None if every match is confirmed
+        """
+        best = None
+        for key, state in self._states.items():
+            pending = np.flatnonzero(np.isfinite(state["distances"]))
+            if len(pending) == 0:
+                continue
+
+            is_confirmed = np.ones(len(state["distances"]), dtype=bool)
+            if frame is not None:
+                for buckets in state["buckets"].values():
+                    for positions, bucket, lengths, column, starts in buckets:
+                        is_confirmed[positions] &= np.all(
+                            (column >= state["distances"][positions, None])
+                            | (starts > state["ends"][positions, None])
+                            | (np.arange(bucket.shape[1]) >= lengths[:, None]),
+                            axis=1,
+                        )
+
+            for position in pending[is_confirmed[pending]]:
+                if not self._has_hands(key, state["starts"][position], state["ends"][position]):
+                    state["distances"][position] = np.inf
+                    continue
+                distance = state["distances"][position] / state["lengths"][position]
+                if best is None or distance < best[0]:
+                    best = (distance, key, position)
+
+        if best is None:
+            return None
+        distance, key, position = best
+        state = self._states[key]
+        start, end = state["starts"][position], state["ends"][position]
+        self._forget(end)
+
+        idx = self.reference_index.partitions[key].ids[position]
+        return Detection(
+            self.reference_index.get_names([idx])[0], int(idx), float(distance), int(start), int(end)
+        )
+
+    def _forget(self, end: int):
+        """Drop the matches and the paths in progress overlapping a reported detection"""
+        for state in self._states.values():
+            state["distances"][state["starts"] <= end] = np.inf
+            for buckets in state["buckets"].values():
+                for _, _, _, column, starts in buckets:
+                    column[starts <= end] = np.inf
+
+    def _has_hands(self, key, start: int, end: int) -> bool:
+        """
+        Whether the hands detected in the frames [start, end] of the stream
+        are the hands of the references of the partition
+        """
+        first = len(self._history) - (self.frame - start)
+        if first < 0:
+            return True
+        frames = list(self._history)[first : len(self._history) - (self.frame - 1 - end)]
+        has_lh = any(lh for lh, _ in frames)
+        has_rh = any(rh for _, rh in frames)
+        return (has_lh, has_rh) == key
+
+    def _get_max_length(self) -> int:
+        lengths = [state["lengths"].max() for state in self._states.values()]
+        return int(max(lengths, default=1))
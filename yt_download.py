@@ -1,128 +1,279 @@
-import re
-import yt_dlp
+"""
+Download the source videos of yt_links.csv and cut the clips of the signs into data/videos.
+
+Each source video is resolved and downloaded once, whatever the number of signs cut from it,
+by a bounded pool of concurrent downloads; the clips are cut by ffmpeg processes running
+in parallel as soon as their source is available. The clips done are recorded in a state
+file, so that an interrupted run resumes with the ones left.
+
+python yt_download.py [--downloads N] [--cuts N] [--keep-sources] [--sources-only]
+                      [--local FOLDER]
+
+--sources-only only downloads the sources, for python -m utils.source_dataset;
+--local copies the sources from a local folder (<id>.mp4) instead of YouTube.
+"""
+import argparse
+import json
 import os
-from shutil import copyfile
-import pandas as pd
+import shutil
+import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 from tqdm import tqdm
 
-FOLDER = os.path.join("data", "videos")
+from utils.dataset_manifest import VIDEOS_PATH, get_video_path
+from utils.landmark_utils import atomic_write
+from utils.source_dataset import LINKS_PATH, SOURCES_PATH, SignRange, get_source_path, read_links
 
+STATE_PATH = os.path.join(VIDEOS_PATH, "download_state.json")
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".mkv", ".avi")
 
-def download_video(name, video_id, start_time, duration_time):
+
+class YtDlpDownloader(object):
     """
-    start and end have to be in the format mm:ss
+    Download of the videos from YouTube with yt-dlp
+
+    Params
+        max_height: maximal height of the videos downloaded
     """
-    file_path = os.path.join(FOLDER, name)
-    if not os.path.exists(file_path):
-        os.mkdir(file_path)
-
-    # Configure yt-dlp options
-    ydl_opts = {
-        'format': 'mp4[height<=720]/best[ext=mp4]',  # Prefer mp4 format, max 720p
-        'outtmpl': os.path.join(FOLDER, '%(title)s.%(ext)s'),
-        'quiet': True,  # Suppress yt-dlp output
-        'no_warnings': True,
-    }
-    
-    video_url = f"https://www.youtube.com/watch?v={video_id}"
-    
-    try:
+
+    def __init__(self, max_height=720):
+        self.max_height = max_height
+
+    def download(self, video_id: str, path: str):
+        """
+        Download a video: its info is extracted and the video downloaded in a single call
+
+        :param path: path of the video, the extension of the file downloaded being replaced
+        """
+        import yt_dlp
+
+        base_path = os.path.splitext(path)[0]
+        ydl_opts = {
+            # Prefer mp4 format, max 720p
+            "format": f"mp4[height<={self.max_height}]/best[ext=mp4]",
+            "outtmpl": base_path + ".%(ext)s",
+            "quiet": True,  # Suppress yt-dlp output
+            "no_warnings": True,
+        }
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Get video info first
-            info = ydl.extract_info(video_url, download=False)
-            
-            # Check if info extraction was successful
-            if not info or not isinstance(info, dict):
-                print(f"Could not extract info for video {video_id}")
+            info = ydl.extract_info(f"https://www.youtube.com/watch?v={video_id}", download=True)
+        if not info or not isinstance(info, dict):
+            raise RuntimeError(f"Could not extract info for video {video_id}")
+
+        # The file may be downloaded with another extension
+        for extension in VIDEO_EXTENSIONS:
+            if os.path.exists(base_path + extension):
+                os.replace(base_path + extension, path)
                 return
-            
-            # Get video title safely
-            video_title = info.get('title', f'video_{video_id}')
-            if not video_title:
-                video_title = f'video_{video_id}'
-            
-            # Clean the filename
-            file_name = re.sub(r'[.;:,?!/\\<>:"|*]', "", str(video_title)) + ".mp4"
-            full_video_path = os.path.join(FOLDER, file_name)
-            
-            # Download if not exists
-            if not os.path.exists(full_video_path):
-                try:
-                    # Create a new ydl instance for downloading
-                    download_opts = ydl_opts.copy()
-                    download_opts['outtmpl'] = full_video_path.replace('.mp4', '.%(ext)s')
-                    
-                    with yt_dlp.YoutubeDL(download_opts) as download_ydl:
-                        download_ydl.download([video_url])
-                        
-                    # Check if file was created with different extension
-                    if not os.path.exists(full_video_path):
-                        # Look for the downloaded file with any video extension
-                        base_name = full_video_path.replace('.mp4', '')
-                        for ext in ['.webm', '.mkv', '.mp4', '.avi']:
-                            if os.path.exists(base_name + ext):
-                                # Rename to .mp4 for consistency
-                                os.rename(base_name + ext, full_video_path)
-                                break
-                except Exception as download_error:
-                    print(f"Download failed for {video_id}: {download_error}")
-                    return
-            
-            output_file = os.path.join(file_path, name + "-" + video_id + ".mp4")
-            if os.path.exists(output_file):
+        raise FileNotFoundError(f"Downloaded file of video {video_id} not found")
+
+
+class LocalDownloader(object):
+    """
+    Stand-in of YtDlpDownloader copying the videos from a local folder, to run offline
+
+    Params
+        folder: folder of the videos, named <id> with a video extension
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def download(self, video_id: str, path: str):
+        for extension in VIDEO_EXTENSIONS:
+            local_path = os.path.join(self.folder, video_id + extension)
+            if os.path.exists(local_path):
+                # A partial copy is never taken as done
+                with atomic_write(path, ".part") as temporary_path:
+                    shutil.copyfile(local_path, temporary_path)
                 return
+        raise FileNotFoundError(f"Video {video_id} not found in {self.folder}")
 
-            # Handle video clipping
-            if pd.isna(start_time) and pd.isna(duration_time):
-                # Copy entire video if no time constraints
-                if os.path.exists(full_video_path):
-                    copyfile(src=full_video_path, dst=output_file)
-            else:
-                # Use ffmpeg to create clip
-                if os.path.exists(full_video_path):
-                    original_video = full_video_path
-                    try:
-                        if pd.notna(start_time) and pd.notna(duration_time):
-                            # Both start and duration specified
-                            os.system(
-                                f'ffmpeg -hide_banner -loglevel error -ss {start_time} -i "{original_video}" -to {duration_time} -c copy "{output_file}"'
-                            )
-                        elif pd.notna(start_time):
-                            # Only start time specified
-                            os.system(
-                                f'ffmpeg -hide_banner -loglevel error -ss {start_time} -i "{original_video}" -c copy "{output_file}"'
-                            )
-                        else:
-                            # Only duration specified (from beginning)
-                            os.system(
-                                f'ffmpeg -hide_banner -loglevel error -i "{original_video}" -to {duration_time} -c copy "{output_file}"'
-                            )
-                    except Exception as ffmpeg_error:
-                        print(f"FFmpeg error when processing {video_title}: {ffmpeg_error}")
+
+class DownloadState(object):
+    """
+    Clips already cut, saved in a JSON file after each clip
+
+    Params
+        path: path of the state file, created on the first save
+    """
+
+    def __init__(self, path=STATE_PATH):
+        self.path = path
+        # {video name: [source id, start, end]}
+        self.clips = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                self.clips = json.load(file)["clips"]
+
+    def is_done(self, source_id: str, sign_range: SignRange) -> bool:
+        """Whether the clip was cut from this range of the source and is still there"""
+        return self.clips.get(sign_range.video_name) == [
+            source_id, sign_range.start, sign_range.end
+        ] and os.path.exists(get_video_path(sign_range.video_name))
+
+    def add(self, source_id: str, sign_range: SignRange):
+        self.clips[sign_range.video_name] = [source_id, sign_range.start, sign_range.end]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with atomic_write(self.path) as temporary_path:
+            with open(temporary_path, "w", encoding="utf-8") as file:
+                json.dump({"clips": self.clips}, file, ensure_ascii=False, indent=1)
+
+
+def plan_jobs(links, state: DownloadState, sources_only=False):
+    """
+    :param links: {source id: ranges of the signs}, see utils.source_dataset.read_links
+    :return: {source id: ranges whose clip is still to cut}, with the sources still
+             to download only
+    """
+    jobs = {}
+    for source_id, ranges in links.items():
+        if sources_only:
+            if not os.path.exists(get_source_path(source_id)):
+                jobs[source_id] = []
+            continue
+        ranges = [sign_range for sign_range in ranges if not state.is_done(source_id, sign_range)]
+        if ranges:
+            jobs[source_id] = ranges
+    return jobs
+
+
+def fetch_source(downloader, source_id: str):
+    """
+    :return: path of the source video, downloaded if it is not there yet,
+             and whether it was downloaded
+    """
+    source_path = get_source_path(source_id)
+    if os.path.exists(source_path):
+        return source_path, False
+    os.makedirs(SOURCES_PATH, exist_ok=True)
+    downloader.download(source_id, source_path)
+    return source_path, True
+
+
+def cut_clip(source_path: str, sign_range: SignRange):
+    """Cut the clip of a sign from its source video (without re-encoding) with ffmpeg"""
+    output_path = get_video_path(sign_range.video_name)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # The partial clip of a failed cut is removed
+    with atomic_write(output_path, ".part") as temporary_path:
+        if sign_range.start == 0 and sign_range.end is None:
+            # Copy entire video if no time constraints
+            shutil.copyfile(source_path, temporary_path)
+        else:
+            command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"]
+            command += ["-ss", f"{sign_range.start:.3f}", "-i", source_path]
+            if sign_range.end is not None:
+                command += ["-t", f"{sign_range.end - sign_range.start:.3f}"]
+            command += ["-c", "copy", "-f", "mp4", temporary_path]
+            subprocess.run(command, check=True, capture_output=True)
+
+
+def download_dataset(
+    downloader,
+    links_path=LINKS_PATH,
+    n_downloads=4,
+    n_cuts=None,
+    keep_sources=False,
+    sources_only=False,
+    state_path=STATE_PATH,
+):
+    """
+    :param downloader: YtDlpDownloader, or a stand-in with the same download method
+    :param n_downloads: number of concurrent downloads
+    :param n_cuts: number of concurrent ffmpeg processes (by default, one per CPU)
+    :param keep_sources: whether the source videos downloaded by this run are kept once
+                         their clips are cut (the sources already there are always kept)
+    :param sources_only: only download the sources, without cutting the clips
+    """
+    state = DownloadState(state_path)
+    jobs = plan_jobs(read_links(links_path), state, sources_only)
+    n_clips = sum(len(ranges) for ranges in jobs.values())
+    if sources_only:
+        print(f"\n{len(jobs)} source videos to download\n")
+    else:
+        print(f"\n{n_clips} clips to cut from {len(jobs)} source videos\n")
+
+    # Clips left to cut and clips failed per source, deleted once all its clips are cut
+    # if this run downloaded it
+    remaining = {source_id: len(ranges) for source_id, ranges in jobs.items()}
+    failed = set()
+    downloaded = set()
+    with ThreadPoolExecutor(n_downloads) as downloads, ThreadPoolExecutor(
+        n_cuts or os.cpu_count()
+    ) as cuts, tqdm(total=len(jobs) + n_clips, unit="job") as progress:
+        pending = {
+            downloads.submit(fetch_source, downloader, source_id): (source_id, None)
+            for source_id in jobs
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                source_id, sign_range = pending.pop(future)
+                progress.update()
+                try:
+                    result = future.result()
+                except subprocess.CalledProcessError as error:
+                    tqdm.write(
+                        f"FFmpeg error when cutting {sign_range.video_name}: "
+                        f"{error.stderr.decode(errors='replace').strip()}"
+                    )
+                    failed.add(source_id)
+                except Exception as error:
+                    if sign_range is None:
+                        tqdm.write(f"Download failed for {source_id}: {error}")
+                        progress.update(len(jobs[source_id]))
+                        continue
+                    tqdm.write(f"Cut failed for {sign_range.video_name}: {error}")
+                    failed.add(source_id)
                 else:
-                    print(f"Video file not found: {full_video_path}")
-    
-    except Exception as e:
-        print(f"Error downloading video {video_id}: {e}")
-        # Print more detailed error info for debugging
-        import traceback
-        print(f"Detailed error: {traceback.format_exc()}")
-
-
-print("\nDownloading videos of signs from YouTube\n")
-
-# Create data/videos folder if it doesn't exist
-os.makedirs(FOLDER, exist_ok=True)
-
-# Create the dataset based on yt_links.csv
-df_links = pd.read_csv("yt_links.csv")
-for idx, row in tqdm(df_links.iterrows(), total=df_links.shape[0]):
-    download_video(*row)
-
-# Delete the videos used to create the clips for the dataset
-for file in os.listdir(FOLDER):
-    if file.endswith(".mp4") and not os.path.isdir(os.path.join(FOLDER, file)):
-        try:
-            os.remove(os.path.join(FOLDER, file))
-        except Exception as e:
-            print(f"Could not delete {file}: {e}")
\ No newline at end of file
+                    if sign_range is None:
+                        # Source available: its clips are cut in parallel
+                        source_path, is_downloaded = result
+                        if is_downloaded:
+                            downloaded.add(source_id)
+                        for source_range in jobs[source_id]:
+                            pending[cuts.submit(cut_clip, source_path, source_range)] = (
+                                source_id,
+                                source_range,
+                            )
+                    else:
+                        state.add(source_id, sign_range)
+                        state.save()
+
+                if sign_range is not None:
+                    remaining[source_id] -= 1
+                if (
+                    remaining[source_id] == 0
+                    and source_id in downloaded
+                    and not (keep_sources or sources_only or source_id in failed)
+                ):
+                    os.remove(get_source_path(source_id))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--links", default=LINKS_PATH, help="CSV file of the signs")
+    parser.add_argument("--downloads", type=int, default=4, help="Concurrent downloads")
+    parser.add_argument("--cuts", type=int, default=None, help="Concurrent ffmpeg processes")
+    parser.add_argument("--keep-sources", action="store_true", help="Keep the source videos")
+    parser.add_argument(
+        "--sources-only", action="store_true", help="Only download the source videos"
+    )
+    parser.add_argument(
+        "--local", default=None, help="Folder of local videos <id>.mp4 replacing YouTube"
+    )
+    args = parser.parse_args()
+
+    print("\nDownloading videos of signs from YouTube\n")
+    download_dataset(
+        YtDlpDownloader() if args.local is None else LocalDownloader(args.local),
+        args.links,
+        args.downloads,
+        args.cuts,
+        args.keep_sources,
+        args.sources_only,
+    )